@@ -1,10 +1,15 @@
-from typing import List
+from __future__ import annotations
 
-from elizaconstant import SPECIAL_RULE_NONE
-from elizalogic import eliza_specific_join, NullTracer
+from elizaconstant import SPECIAL_RULE_NONE, TagMap
+from elizalogic import eliza_specific_join, NullTracer, Script
+from elizasession import SessionState
 from elizaencoding import filter_bcd
 from elizautil import collect_tags, get_rule, split_input
 
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import List, Optional
+
 
 class Eliza:
     nomatch_msgs_: List[str] = [
@@ -14,13 +19,11 @@ class Eliza:
         "I SEE"
     ]
 
-    def __init__(self, script):
+    def __init__(self, script, tags: Optional[TagMap] = None):
 
-        self.greetings = script.hello_message
-        self.rules = script.rules
-        self.mem_rule = script.mem_rule
-        self.tags = collect_tags(self.rules)
-        self.limit = 1  # JW's "a certain counting mechanism," cycles through 1..4, then back to 1
+        # the script, and the tags collected from it, are replaced together by swap_script()
+        self._compiled = (script, tags if tags is not None else collect_tags(script.rules))
+        self.session = SessionState(script)
         self.use_limit = True
         self.punctuation = ""
         self.set_delimiters([",", ".", "BUT"])
@@ -30,6 +33,44 @@ class Eliza:
         self.null_tracer = NullTracer()
         self.trace = self.null_tracer
 
+    @property
+    def script(self) -> Script:
+        return self._compiled[0]
+
+    @property
+    def tags(self) -> TagMap:
+        return self._compiled[1]
+
+    @property
+    def rules(self):
+        return self.script.rules
+
+    @property
+    def mem_rule(self):
+        return self.script.mem_rule
+
+    @property
+    def greetings(self) -> List[str]:
+        return self.script.hello_message
+
+    @property
+    def limit(self) -> int:
+        # JW's "a certain counting mechanism," cycles through 1..4, then back to 1
+        return self.session.limit
+
+    @limit.setter
+    def limit(self, value: int):
+        self.session.limit = value
+
+    def swap_script(self, script: Script, tags: Optional[TagMap] = None):
+        """
+        Replace the script in one step. Responses already under way finish with the old script; each
+        conversation is carried over to the new one the next time it is used (see SessionState.migrate).
+        :param script: A script read by ElizaScriptReader.
+        :param tags: collect_tags(script.rules), if the caller has already worked it out.
+        """
+        self._compiled = (script, tags if tags is not None else collect_tags(script.rules))
+
     def set_use_nomatch_msgs(self, flag: bool):
         self.use_nomatch_msgs = flag
 
@@ -58,9 +99,26 @@ class Eliza:
             return "Null Trace"
         return self.trace.text()
 
-    def response_list(self, input_str) -> List[str]:
-
-        input_str = filter_bcd(input_str)
+    def response_list(self, input_str, session: Optional[SessionState] = None, filtered: bool = False) -> List[str]:
+        """
+        Returns ELIZA's reply to input_str as a list of words.
+        :param session: The conversation to continue. Defaults to this instance's own session.
+        :param filtered: input_str has already been through filter_bcd() (or filter_bcd_bytes()).
+        """
+        script, tags = self._compiled
+        # without a tracer nothing in the script is changed, so responses in different sessions may be made on
+        # several threads at once
+        traced = self.trace is not self.null_tracer
+        rules = script.rules
+        mem_rule = script.mem_rule
+        if session is None:
+            session = self.session
+        if session.script is not script:
+            session.migrate(script)
+        memories = session.memories
+
+        if not filtered:
+            input_str = filter_bcd(input_str)
         # for simplicity, convert the given input string to a list of uppercase words
         # e.g. "Hello, world!" -> ("HELLO" "," "WORLD" ".")
 
@@ -68,8 +126,9 @@ class Eliza:
         self.trace.begin_response(words)
 
         # J W's "a certain counting mechanism" is updated for each response
-        self.limit = (self.limit % 4) + 1
-        self.trace.limit(self.limit, self._get_nomatch_msg())
+        session.limit = (session.limit % 4) + 1
+        limit = session.limit
+        self.trace.limit(limit, self._get_nomatch_msg(limit))
 
         keystack: List[str] = []
         top_rank = 0
@@ -80,8 +139,8 @@ class Eliza:
             if self._is_delimiter(word):
                 if len(keystack) == 0:
                     self.trace.discard_subclause(word)
-                    if self.mem_rule.memory_exists() and (not self.use_limit or self.limit == 4):
-                        self.trace.using_memory(self.mem_rule.to_string())
+                    if mem_rule.memory_exists(memories) and (not self.use_limit or limit == 4):
+                        self.trace.using_memory(mem_rule.to_string())
                     else:
                         self.trace.discard_subclause(' '.join(words[:idx]))
                     # discard to the left
@@ -93,7 +152,7 @@ class Eliza:
                     words = words[:idx]
                     break
 
-            rule = get_rule(self.rules, word, throw=False)
+            rule = get_rule(rules, word, throw=False)
 
             if rule and len(rule.keyword):
                 if rule.has_transformation():
@@ -114,9 +173,10 @@ class Eliza:
             idx += 1
 
         w = ' '.join(words or [])
-        self.trace.subclause_complete(w, keystack, self.rules)
-        self.mem_rule.clear_trace()
-        self.trace.memory_stack(self.mem_rule.trace_memory_stack())
+        self.trace.subclause_complete(w, keystack, rules)
+        if traced:
+            mem_rule.clear_trace()
+            self.trace.memory_stack(mem_rule.trace_memory_stack(memories))
 
         if not keystack:
             # a text without keywords; can we recall a MEMORY ? [page 41 (f)]
@@ -124,10 +184,10 @@ class Eliza:
             # mechanism is in a particular state." The ELIZA code shows that the
             # memory is recalled only when LIMIT has the value 4
 
-            if not self.use_limit or self.limit == 4:
-                if self.mem_rule.memory_exists():
-                    self.trace.using_memory(self.mem_rule.to_string())
-                    return [self.mem_rule.recall_memory()]
+            if not self.use_limit or limit == 4:
+                if mem_rule.memory_exists(memories):
+                    self.trace.using_memory(mem_rule.to_string())
+                    return [mem_rule.recall_memory(memories)]
 
             # the keystack contains all keywords that occur in the given 'input';
             # apply transformation associated with the top keyword [page 39 (d)]
@@ -135,22 +195,22 @@ class Eliza:
             top_keyword = keystack.pop(0)
             self.trace.pre_transform(top_keyword, words)
 
-            rule = self.rules.get(top_keyword, None)
+            rule = rules.get(top_keyword, None)
             if not rule:  # if (r == rules_.end())
                 if self.use_nomatch_msgs:
                     self.trace.unknown_key(top_keyword, True)
-                    return [self._get_nomatch_msg()]
+                    return [self._get_nomatch_msg(limit)]
 
                 # e.g. could happen if a rule links to a non-existent keyword
                 self.trace.unknown_key(top_keyword, False)
                 break
 
             # try to lay down a memory for future use
-            self.mem_rule.create_memory(top_keyword, words, self.tags)
-            self.trace.create_memory(self.mem_rule.trace)
-
-            action, words, link_keyword = rule.apply_transformation(words, self.tags, [])
-            self.trace.transform(rule.trace, rule.to_string())
+            mem_rule.create_memory(top_keyword, words, tags, memories, traced)
+            action, words, link_keyword = rule.apply_transformation(words, tags, [], session.cursors, traced)
+            if traced:
+                self.trace.create_memory(mem_rule.trace)
+                self.trace.transform(rule.trace, rule.to_string())
 
             if action == "complete":
                 return words
@@ -160,7 +220,7 @@ class Eliza:
                 self.trace.decomp_failed(self.use_nomatch_msgs)
                 if self.use_nomatch_msgs:
                     self.trace.decomp_failed(self.use_nomatch_msgs)
-                    return [self._get_nomatch_msg()]
+                    return [self._get_nomatch_msg(limit)]
                 break
 
             assert action == "linkkey" or action == "newkey"
@@ -177,19 +237,20 @@ class Eliza:
 
                 if self.on_newkey_fail_use_none and self.use_nomatch_msgs:
                     self.trace.newkey_failed("built-in nomatch")
-                    return [self._get_nomatch_msg()]
+                    return [self._get_nomatch_msg(limit)]
                 else:
                     self.trace.newkey_failed("NONE")
                     break
 
-        none_rule = self.rules.get(SPECIAL_RULE_NONE)
+        none_rule = rules.get(SPECIAL_RULE_NONE)
         discard = ""
-        none_status, none_rule, none_keyword = none_rule.apply_transformation(words, self.tags, discard)
+        none_status, none_rule, none_keyword = none_rule.apply_transformation(
+            words, tags, discard, session.cursors, traced)
         self.trace.using_none(eliza_specific_join(none_rule))
         return none_rule
 
-    def response(self, input_str: str) -> str:
-        return eliza_specific_join(self.response_list(input_str))
+    def response(self, input_str: str, session: Optional[SessionState] = None, filtered: bool = False) -> str:
+        return eliza_specific_join(self.response_list(input_str, session, filtered))
 
     def _is_delimiter(self, word: str) -> bool:
         return word in self.delimiters
@@ -200,10 +261,20 @@ class Eliza:
         else:
             self.trace.discard_subclause(' '.join(words[:idx]))
 
+    def nomatch_response(self, session: Optional[SessionState] = None) -> str:
+        """
+        The built-in nomatch message a response would give in the conversation, where LIMIT is advanced first,
+        without making a response or changing the conversation: the answer to give when there is no time to
+        make a proper one.
+        """
+        return self._get_nomatch_msg(((session or self.session).limit % 4) + 1)
+
     def get_greeting(self) -> str:
         return eliza_specific_join(self.greetings) or "Hello."
 
-    def _get_nomatch_msg(self) -> str:
-        ind = self.limit - 1 % len(self.nomatch_msgs_)
+    def _get_nomatch_msg(self, limit: Optional[int] = None) -> str:
+        if limit is None:
+            limit = self.limit
+        ind = limit - 1 % len(self.nomatch_msgs_)
         return Eliza.nomatch_msgs_[ind]
 
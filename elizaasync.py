@@ -0,0 +1,119 @@
+"""
+Serve ELIZA conversations over TCP from one asyncio event loop, for many clients that are mostly idle. The
+protocol is the one PreforkServer speaks: ELIZA's greeting on connection, then one line of response for each
+line received; a blank line ends the conversation.
+"""
+import asyncio
+from concurrent.futures import Executor
+from typing import Optional, Set, Tuple
+
+from eliza import Eliza
+from elizalogic import DEFAULT_MAX_MEMORIES, Script
+from elizaprefork import DEFAULT_PORT, MAX_LINE
+from elizasession import SessionState
+from elizateletype import TeletypePacer
+
+
+class AsyncLineServer:
+    """
+        Each connection is a conversation with its own SessionState. Responses are made on the event loop,
+        which suits ELIZA's short responses, or in executor if given. Each line may be at most max_line bytes,
+        and a client that does not read its responses is not sent more until it does (StreamWriter.drain()),
+        so neither a fast nor a slow client can make the server buffer without bound. With a pacer, the greeting
+        and responses are typed out at its speed, e.g. an IBM 2741's.
+    """
+    def __init__(self, script: Script, address: Tuple[str, int] = ("127.0.0.1", DEFAULT_PORT),
+                 executor: Optional[Executor] = None, max_line: int = MAX_LINE, idle_timeout: Optional[float] = None,
+                 pacer: Optional[TeletypePacer] = None):
+        self.engine = Eliza(script)
+        self.address = address
+        self.executor = executor
+        self.max_line = max_line
+        self.idle_timeout = idle_timeout
+        self.pacer = pacer
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.connections: Set[asyncio.Task] = set()
+        self.responses = 0
+
+    async def start(self) -> Tuple[str, int]:
+        """
+        Start listening.
+        :return: The address being served, which has the actual port if port 0 was asked for.
+        """
+        host, port = self.address
+        self.server = await asyncio.start_server(self._converse, host, port, limit=self.max_line + 1, backlog=4096)
+        self.address = self.server.sockets[0].getsockname()[:2]
+        return self.address
+
+    async def serve_forever(self) -> None:
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        for task in list(self.connections):
+            task.cancel()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+
+    async def _respond(self, line: str, session: SessionState) -> str:
+        if self.executor is None:
+            return self.engine.response(line, session)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.engine.response, line, session)
+
+    async def _send(self, writer: asyncio.StreamWriter, text: str) -> None:
+        if self.pacer is None:
+            writer.write(text.encode())
+        else:
+            await self.pacer.type(writer.write, text)
+        await writer.drain()
+
+    async def _converse(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self.connections.add(task)
+        session = SessionState(self.engine.script, DEFAULT_MAX_MEMORIES)
+        try:
+            await self._send(writer, self.engine.get_greeting() + "\n")
+            while True:
+                try:
+                    if self.idle_timeout is None:
+                        data = await reader.readuntil(b"\n")
+                    else:
+                        data = await asyncio.wait_for(reader.readuntil(b"\n"), self.idle_timeout)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                    break  # closed, line too long, or idle too long
+                line = data.decode("utf-8", "replace").rstrip("\r\n")
+                if not line:
+                    break
+                response = await self._respond(line, session)
+                self.responses += 1
+                await self._send(writer, response + "\n")
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, asyncio.CancelledError):
+                pass
+
+
+def serve(script: Script, address: Tuple[str, int], announce=print, pacer: Optional[TeletypePacer] = None) -> None:
+    """
+    Run an AsyncLineServer until interrupted.
+    """
+    async def run():
+        server = AsyncLineServer(script, address, pacer=pacer)
+        host, port = await server.start()
+        announce(f"Serving on {host}:{port}")
+        await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
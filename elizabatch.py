@@ -0,0 +1,117 @@
+"""
+Conversations read from files or stdin and answered as a stream, for offline evaluation jobs:
+
+    python main.py --batch conversations.txt,more.txt --output responses.txt
+    python main.py --batch - --jsonl < remarks.jsonl > responses.jsonl
+
+In the text format each line is a remark and a blank line ends the conversation; the output has ELIZA's
+response on the line of each remark and a blank line for each blank line, so the two files line up. Lines
+starting with * are remarks like any other: there are no commands.
+
+In the JSONL format each line is {"session": ID, "text": TEXT} and is answered with {"session": ID,
+"response": TEXT}; the conversations may be interleaved, and {"session": ID, "end": true} ends one (answered
+with nothing). A line that is not such a request is answered with {"line": N, "error": MESSAGE}.
+
+Input is read and output written in large buffered blocks, with no flush per response.
+"""
+import io
+import json
+import sys
+from typing import BinaryIO, Dict, Iterable
+
+from eliza import Eliza
+from elizasession import SessionManager, SessionState
+
+BUFFER_SIZE = 1024 * 1024  # bytes read or written at a time
+
+
+def open_input(name: str) -> BinaryIO:
+    """
+    The file called name, or stdin for -, opened for reading in large blocks.
+    """
+    if name == "-":
+        return io.open(sys.stdin.fileno(), "rb", buffering=BUFFER_SIZE, closefd=False)
+    return open(name, "rb", buffering=BUFFER_SIZE)
+
+
+def open_output(name: str) -> BinaryIO:
+    """
+    The file called name, or stdout for -, opened for writing in large blocks.
+    """
+    if name == "-":
+        sys.stdout.flush()
+        return io.open(sys.stdout.fileno(), "wb", buffering=BUFFER_SIZE, closefd=False)
+    return open(name, "wb", buffering=BUFFER_SIZE)
+
+
+def respond_text(eliza: Eliza, lines: Iterable[bytes], out: BinaryIO, stats: Dict[str, int]) -> None:
+    """
+    Answer the remarks in lines, in the text format.
+    """
+    session = SessionState(eliza.script)
+    started = False
+    write = out.write
+    for line in lines:
+        remark = line.rstrip(b"\r\n").decode("utf-8", "replace")
+        if not remark.strip():
+            if started:
+                stats["conversations"] += 1
+                session = SessionState(eliza.script)
+                started = False
+            write(b"\n")
+            continue
+        write(eliza.response(remark, session).encode())
+        write(b"\n")
+        stats["exchanges"] += 1
+        started = True
+    if started:
+        stats["conversations"] += 1
+
+
+def respond_jsonl(sessions: SessionManager, lines: Iterable[bytes], out: BinaryIO, stats: Dict[str, int]) -> None:
+    """
+    Answer the requests in lines, in the JSONL format.
+    """
+    write = out.write
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict) or "session" not in request:
+                raise ValueError("expected {\"session\": ID, \"text\": TEXT}")
+            session_id = request["session"]
+            if request.get("end"):
+                if sessions.drop(session_id) is not None:
+                    stats["conversations"] += 1
+                continue
+            text = request.get("text")
+            if not isinstance(text, str):
+                raise ValueError("expected {\"session\": ID, \"text\": TEXT}")
+            reply = {"session": session_id, "response": sessions.respond(session_id, text)}
+            stats["exchanges"] += 1
+        except (ValueError, TypeError) as e:  # json.JSONDecodeError is a ValueError; TypeError for an unhashable ID
+            reply = {"line": number, "error": str(e)}
+            stats["errors"] += 1
+        write(json.dumps(reply).encode())
+        write(b"\n")
+
+
+def run_batch(eliza: Eliza, inputs: Iterable[BinaryIO], out: BinaryIO, jsonl: bool = False,
+              max_sessions: int = 100000) -> Dict[str, int]:
+    """
+    Answer the conversations read from each of inputs in turn, writing the responses to out.
+    :param max_sessions: JSONL conversations held at once; beyond it the least recently used is forgotten.
+    :return: Counts of conversations, exchanges and, for JSONL, lines in error.
+    """
+    stats = {"conversations": 0, "exchanges": 0, "errors": 0}
+    sessions = SessionManager(eliza, max_sessions) if jsonl else None
+    for lines in inputs:
+        if jsonl:
+            respond_jsonl(sessions, lines, out, stats)
+        else:
+            respond_text(eliza, lines, out, stats)
+    if sessions is not None:
+        stats["conversations"] += len(sessions)
+    out.flush()
+    return stats
@@ -0,0 +1,743 @@
+"""
+Benchmarks for ELIZA's serving modes. Each benchmark is a function that prints a short report and returns its
+measurements; run one from the command line with e.g.
+
+    python elizabench.py prefork-memory --workers 4 --rules 2000
+    python elizabench.py spawn-memory --workers 4 --rules 2000
+    python elizabench.py sessions --sessions 200000 --max-sessions 100000
+    python elizabench.py async-server --clients 100 --idle 1000
+    python elizabench.py http-server --requests 2000 --batch 50
+    python elizabench.py rpc-server --requests 5000
+    python elizabench.py sharded --workers 1,2,4
+    python elizabench.py threads --threads 1,2,4,8
+    python elizabench.py fair --backlog 5000 --users 100
+    python elizabench.py overload --load 2 --timeout 0.05
+    python elizabench.py teletype --sessions 5000
+    python elizabench.py registry --scripts 50
+    python elizabench.py batch --conversations 2000
+    python elizabench.py replay --workers 1,2,4
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from DOCTOR_1966_01_CACM import CACM_1966_01_DOCTOR_script
+from eliza_test_conversations import cacm_1966_conversation
+
+
+def synthetic_script(rules: int) -> str:
+    """
+    The DOCTOR script with the given number of extra keyword rules, to stand in for a large customer script.
+    """
+    extra = ''.join(f"(KEY{i} DLIST(/TAG{i % 7})\n"
+                    f"    ((0 KEY{i} 0)\n"
+                    f"        (WHY DO YOU MENTION KEY{i} 3)\n"
+                    f"        (TELL ME MORE ABOUT 1)\n"
+                    f"        (PRE (YOU SAID 3) (=KEY{(i + 1) % rules}))))\n" for i in range(rules))
+    return CACM_1966_01_DOCTOR_script + extra
+
+
+def process_memory(pid: int) -> Dict[str, int]:
+    """
+    Memory of a process in kB: Rss, Pss (shared pages divided among the processes sharing them) and Uss (pages
+    only this process has). Linux only.
+    """
+    fields = {"Rss": 0, "Pss": 0, "Private_Clean": 0, "Private_Dirty": 0}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for row in f:
+            name, _, value = row.partition(":")
+            if name in fields:
+                fields[name] = int(value.split()[0])
+    return {"Rss": fields["Rss"], "Pss": fields["Pss"], "Uss": fields["Private_Clean"] + fields["Private_Dirty"]}
+
+
+def _report_memory(title: str, samples: List[Dict[str, int]]) -> Dict[str, float]:
+    mean = {k: sum(s[k] for s in samples) / len(samples) for k in ("Rss", "Pss", "Uss")}
+    print(f"{title:<24} RSS {mean['Rss'] / 1024:7.1f} MB   PSS {mean['Pss'] / 1024:7.1f} MB"
+          f"   USS {mean['Uss'] / 1024:7.1f} MB   (per worker, {len(samples)} workers)")
+    return mean
+
+
+_INDEPENDENT_WORKER = """
+import sys
+from elizascript import ElizaScriptReader
+from eliza import Eliza
+status, script = ElizaScriptReader.read_script(sys.stdin.read(int(sys.argv[1])))
+eliza = Eliza(script)
+for remark in sys.argv[2:]:
+    eliza.response(remark)
+print("ready", flush=True)
+sys.stdin.read()
+"""
+
+
+def prefork_memory(workers: int = 4, rules: int = 2000) -> Dict[str, Dict[str, float]]:
+    """
+    Per-worker memory of PreforkServer workers, which share a script compiled once by their parent, against
+    the same number of independent processes that each read the script with ElizaScriptReader.
+    """
+    from elizaprefork import PreforkServer
+    from elizascript import ElizaScriptReader
+
+    text = synthetic_script(rules)
+    remarks = [prompt for prompt, _ in cacm_1966_conversation]
+    print(f"script: DOCTOR + {rules} rules; reading it takes", end=" ", flush=True)
+    start = time.perf_counter()
+    status, script = ElizaScriptReader.read_script(text)
+    print(f"{time.perf_counter() - start:.2f} s")
+
+    server = PreforkServer(script, ("127.0.0.1", 0), workers)
+    address = server.start()
+    try:
+        # give every worker some conversations, so each has run the engine over the shared script
+        for _ in range(workers * 4):
+            with socket.create_connection(address) as conn:
+                f = conn.makefile("rwb")
+                f.readline()
+                for remark in remarks:
+                    f.write(remark.encode() + b"\n")
+                    f.flush()
+                    f.readline()
+        time.sleep(0.2)
+        prefork = _report_memory("pre-fork", [process_memory(pid) for pid in server.pids])
+    finally:
+        server.stop()
+
+    procs = []
+    try:
+        here = os.path.dirname(os.path.abspath(__file__))
+        for _ in range(workers):
+            proc = subprocess.Popen([sys.executable, "-c", _INDEPENDENT_WORKER, str(len(text))] + remarks,
+                                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=here,
+                                    universal_newlines=True)
+            proc.stdin.write(text)
+            proc.stdin.flush()
+            procs.append(proc)
+        for proc in procs:
+            proc.stdout.readline()
+        independent = _report_memory("independent processes", [process_memory(proc.pid) for proc in procs])
+    finally:
+        for proc in procs:
+            proc.kill()
+            proc.wait()
+    return {"prefork": prefork, "independent": independent}
+
+
+def _spawned_worker(conn, shared_name, text, remarks):
+    # a spawned worker: attach to the shared script, or read the script text itself
+    from eliza import Eliza
+    if shared_name:
+        from elizashared import SharedScript
+        script = SharedScript.attach(shared_name)
+        eliza = Eliza(script, script.tags)
+    else:
+        from elizascript import ElizaScriptReader
+        status, script = ElizaScriptReader.read_script(text)
+        eliza = Eliza(script)
+    for remark in remarks:
+        eliza.response(remark)
+    # the rules the worker holds decoded
+    conn.send(len(script.rules._cache) if shared_name else len(script.rules))
+    conn.recv()
+    if shared_name:
+        script.close()
+
+
+def spawn_memory(workers: int = 4, rules: int = 2000) -> Dict[str, Dict[str, float]]:
+    """
+    Per-worker memory of spawned workers that attach to one SharedScript, against spawned workers that each
+    read the script with ElizaScriptReader. The workers are given remarks on many of the script's keywords, so
+    a SharedScript's cache of decoded rules is full when they are measured.
+    """
+    import multiprocessing
+    from elizascript import ElizaScriptReader
+    from elizashared import SharedScript
+
+    text = synthetic_script(rules)
+    remarks = [prompt for prompt, _ in cacm_1966_conversation]
+    remarks += [f"I KEEP THINKING OF KEY{i}" for i in range(0, rules, max(1, rules // 500))]
+    status, script = ElizaScriptReader.read_script(text)
+    shared = SharedScript.create(script)
+    print(f"script: DOCTOR + {rules} rules; shared block {shared.shm.size / 1024 / 1024:.1f} MB")
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    try:
+        for title, name in (("shared memory", shared.name), ("each reads the script", "")):
+            procs = []
+            try:
+                for _ in range(workers):
+                    parent, child = context.Pipe()
+                    proc = context.Process(target=_spawned_worker, args=(child, name, "" if name else text, remarks))
+                    proc.start()
+                    procs.append((proc, parent))
+                held = [parent.recv() for _, parent in procs]
+                results[title] = _report_memory(title, [process_memory(proc.pid) for proc, _ in procs])
+                results[title]["rules_held"] = max(held)
+                print(f"{'':<24} {max(held)} rules held decoded by each worker")
+            finally:
+                for proc, parent in procs:
+                    parent.send("exit")
+                    proc.join()
+    finally:
+        shared.close()
+    return results
+
+
+def session_table(sessions: int = 200000, max_sessions: int = 100000, ttl: float = 0) -> Dict[str, float]:
+    """
+    Memory and time per response of a SessionManager holding many intermittent DOCTOR conversations: each
+    session gets a few remarks, taken round-robin, so the table fills and then evicts.
+    """
+    import tracemalloc
+    from eliza import Eliza
+    from elizaprebuilt import load_doctor_script
+    from elizasession import SessionManager
+
+    remarks = [prompt for prompt, _ in cacm_1966_conversation]
+    manager = SessionManager(Eliza(load_doctor_script()), max_sessions, ttl or None)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    responses = 0
+    for i in range(sessions):
+        for remark in remarks[i % len(remarks):][:3]:
+            manager.respond(i, remark)
+            responses += 1
+    elapsed = time.perf_counter() - start
+    held = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    result = {"responses_per_second": responses / elapsed, "bytes_per_session": held / len(manager)}
+    print(f"{responses} responses over {sessions} sessions: {result['responses_per_second']:.0f} responses/s; "
+          f"{len(manager)} sessions held, {result['bytes_per_session']:.0f} bytes each; {manager.stats()}")
+    return result
+
+
+def _raise_file_limit(wanted: int) -> None:
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != resource.RLIM_INFINITY and soft < wanted:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard if hard == resource.RLIM_INFINITY else min(wanted, hard),
+                                                        hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+
+def _percentile(samples: List[float], p: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(p / 100 * len(samples)))] if samples else 0.0
+
+
+def _start_server(args: List[str]):
+    """
+    Run main.py with args in a subprocess and wait for it to say where it is serving.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.Popen([sys.executable, "main.py", "--nobanner"] + args, cwd=here,
+                            stdout=subprocess.PIPE, universal_newlines=True)
+    line = proc.stdout.readline()
+    if not line.startswith("Serving on"):
+        proc.kill()
+        raise RuntimeError(f"server did not start: {line!r}")
+    where = line.split()[2]
+    if ":" not in where:
+        return proc, where  # a Unix socket path
+    host, _, port = where.rpartition(":")
+    return proc, (host, int(port))
+
+
+def async_server(clients: int = 100, idle: int = 1000, seconds: float = 5.0) -> Dict[str, float]:
+    """
+    Throughput and latency of main.py --serve: clients connections each replay the CACM conversation as fast
+    as responses come back, while idle further connections stay open and silent.
+    """
+    import asyncio
+
+    _raise_file_limit(clients + idle + 256)
+    proc, (host, port) = _start_server(["--serve", "--quick", "--bind", "127.0.0.1:0"])
+    remarks = [prompt.encode() + b"\n" for prompt, _ in cacm_1966_conversation]
+    latencies: List[float] = []
+
+    async def talk(deadline: float):
+        reader, writer = await asyncio.open_connection(host, port)
+        await reader.readline()
+        while time.perf_counter() < deadline:
+            for remark in remarks:
+                start = time.perf_counter()
+                writer.write(remark)
+                await reader.readline()
+                latencies.append(time.perf_counter() - start)
+        writer.close()
+
+    async def run():
+        idlers = []
+        for _ in range(idle):
+            reader, writer = await asyncio.open_connection(host, port)
+            await reader.readline()
+            idlers.append(writer)
+        print(f"{idle} idle connections open, server RSS {process_memory(proc.pid)['Rss'] / 1024:.1f} MB")
+        start = time.perf_counter()
+        await asyncio.gather(*(talk(start + seconds) for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+        for writer in idlers:
+            writer.close()
+        return elapsed
+
+    try:
+        elapsed = asyncio.run(run())
+    finally:
+        proc.terminate()
+        proc.wait()
+    result = {"responses_per_second": len(latencies) / elapsed,
+              "p50_ms": 1000 * _percentile(latencies, 50), "p99_ms": 1000 * _percentile(latencies, 99)}
+    print(f"{clients} busy clients: {result['responses_per_second']:.0f} responses/s, "
+          f"latency p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms")
+    return result
+
+
+def http_server(requests: int = 2000, batch: int = 50) -> Dict[str, float]:
+    """
+    Time per request of main.py --http over one keep-alive connection, for /respond one remark at a time and
+    for /respond_batch, against the time the engine alone takes for the same remarks.
+    """
+    import http.client
+    import json
+    from eliza import Eliza
+    from elizaprebuilt import load_doctor_script
+
+    remarks = [prompt for prompt, _ in cacm_1966_conversation]
+    eliza = Eliza(load_doctor_script())
+    start = time.perf_counter()
+    for i in range(requests):
+        eliza.response(remarks[i % len(remarks)])
+    engine = (time.perf_counter() - start) / requests
+
+    proc, address = _start_server(["--http", "--bind", "127.0.0.1:0"])
+    try:
+        conn = http.client.HTTPConnection(*address)
+        conn.connect()
+        conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def post(path, message):
+            conn.request("POST", path, json.dumps(message), {"Content-Type": "application/json"})
+            reply = conn.getresponse()
+            return json.loads(reply.read())
+
+        start = time.perf_counter()
+        for i in range(requests):
+            post("/respond", {"session": i // len(remarks), "text": remarks[i % len(remarks)]})
+        single = (time.perf_counter() - start) / requests
+
+        start = time.perf_counter()
+        for n in range(0, requests, batch):
+            post("/respond_batch", {"requests": [{"session": i // len(remarks), "text": remarks[i % len(remarks)]}
+                                                 for i in range(n, min(n + batch, requests))]})
+        batched = (time.perf_counter() - start) / requests
+        conn.close()
+    finally:
+        proc.terminate()
+        proc.wait()
+    result = {"engine_us": engine * 1e6, "respond_us": single * 1e6, "batch_us": batched * 1e6}
+    print(f"per remark: engine alone {result['engine_us']:.0f} us; /respond {result['respond_us']:.0f} us; "
+          f"/respond_batch of {batch} {result['batch_us']:.0f} us")
+    return result
+
+
+def rpc_server(requests: int = 5000, sessions: int = 100) -> Dict[str, float]:
+    """
+    Responses per second from main.py --rpc through RpcClient, one request at a time and pipelined.
+    """
+    import tempfile
+    from elizarpc import RpcClient
+
+    remarks = [prompt for prompt, _ in cacm_1966_conversation]
+    work = [(i % sessions, remarks[i // sessions % len(remarks)]) for i in range(requests)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "eliza.sock")
+        proc, _ = _start_server(["--rpc", path])
+        client = RpcClient(path, 1)
+        try:
+            start = time.perf_counter()
+            for session_id, remark in work:
+                client.respond(session_id, remark)
+            single = requests / (time.perf_counter() - start)
+            start = time.perf_counter()
+            client.respond_many(work)
+            pipelined = requests / (time.perf_counter() - start)
+        finally:
+            client.close()
+            proc.terminate()
+            proc.wait()
+    result = {"single_per_second": single, "pipelined_per_second": pipelined}
+    print(f"{requests} requests: {single:.0f}/s one at a time, {pipelined:.0f}/s pipelined")
+    return result
+
+
+def sharded(workers: str = "1,2,4", requests: int = 20000, sessions: int = 1000) -> Dict[int, float]:
+    """
+    Responses per second of a ShardedPool of each given size, kept busy with many conversations.
+    """
+    from elizaprebuilt import load_doctor_script
+    from elizashard import ShardedPool
+
+    script = load_doctor_script()
+    remarks = [prompt for prompt, _ in cacm_1966_conversation]
+    work = [(i % sessions, remarks[i // sessions % len(remarks)]) for i in range(requests)]
+    print(f"{os.cpu_count()} cores")
+    results = {}
+    for count in (int(n) for n in workers.split(",")):
+        pool = ShardedPool(script, workers=count, max_workers=count)
+        try:
+            pool.respond_many(work[:count * 100])  # warm up
+            start = time.perf_counter()
+            pool.respond_many(work)
+            results[count] = requests / (time.perf_counter() - start)
+        finally:
+            pool.close()
+        print(f"{count} workers: {results[count]:.0f} responses/s ({results[count] / results[min(results)]:.2f}x)")
+    return results
+
+
+FREE_THREADED_PYTHONS = ("python3.14t", "python3.13t")
+
+
+def threads(counts: str = "1,2,4,8", requests: int = 20000, sessions: int = 1000,
+            free_threaded: str = "") -> Dict[int, float]:
+    """
+    Responses per second of a ThreadPoolEliza with each given number of threads, on this interpreter and then
+    on a free-threaded CPython build, free_threaded or the first of FREE_THREADED_PYTHONS found, if there is one.
+    """
+    import shutil
+    from elizaprebuilt import load_doctor_script
+    from elizathreads import ThreadPoolEliza, gil_enabled
+
+    script = load_doctor_script()
+    remarks = [prompt for prompt, _ in cacm_1966_conversation]
+    work = [(i % sessions, remarks[i // sessions % len(remarks)]) for i in range(requests)]
+    print(f"{sys.executable} ({'GIL' if gil_enabled() else 'free-threaded'}), {os.cpu_count()} cores")
+    results = {}
+    for count in (int(n) for n in counts.split(",")):
+        pool = ThreadPoolEliza(script, threads=count)
+        try:
+            pool.respond_many(work[:count * 100])  # warm up
+            start = time.perf_counter()
+            pool.respond_many(work)
+            results[count] = requests / (time.perf_counter() - start)
+        finally:
+            pool.close()
+        print(f"{count} threads: {results[count]:.0f} responses/s ({results[count] / results[min(results)]:.2f}x)")
+
+    if free_threaded != "-" and gil_enabled():
+        python = free_threaded or next(filter(None, map(shutil.which, FREE_THREADED_PYTHONS)), None)
+        if python:
+            print()
+            subprocess.run([python, os.path.abspath(__file__), "threads", "--threads", counts, "--requests",
+                            str(requests), "--sessions", str(sessions), "--free-threaded", "-"], check=True)
+        else:
+            print(f"no free-threaded build found ({', '.join(FREE_THREADED_PYTHONS)}); give one with --free-threaded")
+    return results
+
+
+def fair(backlog: int = 5000, users: int = 100, threads: int = 2) -> Dict[str, Dict[str, float]]:
+    """
+    Latency of ordinary users' remarks while one client has a backlog of remarks queued ahead of them, with
+    requests served in arrival order and by each FairScheduler policy.
+    """
+    from elizafair import DEFICIT, ROUND_ROBIN
+    from elizaprebuilt import load_doctor_script
+    from elizathreads import ThreadPoolEliza
+
+    script = load_doctor_script()
+    remarks = [prompt for prompt, _ in cacm_1966_conversation]
+    results = {}
+    for policy in (None, ROUND_ROBIN, DEFICIT):
+        pool = ThreadPoolEliza(script, threads=threads, fair_policy=policy)
+        try:
+            chatty = [pool.submit("chatty", remarks[n % len(remarks)]) for n in range(backlog)]
+            latencies = []
+            start = time.perf_counter()
+            for user in range(users):
+                future = pool.submit(user, remarks[user % len(remarks)])
+                future.add_done_callback(lambda _, submitted=time.perf_counter():
+                                         latencies.append(time.perf_counter() - submitted))
+            for future in chatty:
+                future.result()
+            elapsed = time.perf_counter() - start
+            while len(latencies) < users:
+                time.sleep(0.001)
+        finally:
+            pool.close()
+        name = policy or "arrival order"
+        results[name] = {"p50_ms": _percentile(latencies, 50) * 1000, "p99_ms": _percentile(latencies, 99) * 1000,
+                         "backlog_seconds": elapsed}
+        print(f"{name:<14} users' latency p50 {results[name]['p50_ms']:8.2f} ms  p99 {results[name]['p99_ms']:8.2f} ms"
+              f"   backlog of {backlog} done in {elapsed:.2f} s")
+    return results
+
+
+def overload(load: float = 2.0, timeout: float = 0.05, seconds: float = 3.0, sessions: int = 1000,
+             threads: int = 2) -> Dict[str, Dict[str, float]]:
+    """
+    Latency and shed rate when requests arrive at load times the rate ELIZA can answer them, without admission
+    control and with each request given timeout seconds.
+    """
+    from elizaprebuilt import load_doctor_script
+    from elizathreads import ThreadPoolEliza
+
+    script = load_doctor_script()
+    remarks = [prompt for prompt, _ in cacm_1966_conversation]
+    pool = ThreadPoolEliza(script, threads=threads)
+    start = time.perf_counter()
+    pool.respond_many((n % sessions, remarks[n % len(remarks)]) for n in range(5000))
+    capacity = 5000 / (time.perf_counter() - start)
+    pool.close()
+    rate = capacity * load
+    print(f"capacity {capacity:.0f} responses/s, offering {rate:.0f}/s for {seconds} s")
+    results = {}
+    for name, options in (("unlimited", {"fair_policy": "round_robin"}), ("deadline", {"timeout": timeout})):
+        pool = ThreadPoolEliza(script, threads=threads, **options)
+        latencies = []
+        futures = []
+        try:
+            start = time.perf_counter()
+            n = 0
+            total = int(seconds * rate)
+            while n < total:
+                # requests arrive at the offered rate, whether or not earlier ones have been answered
+                while n < min(total, (time.perf_counter() - start) * rate):
+                    future = pool.submit(n % sessions, remarks[n % len(remarks)])
+                    future.add_done_callback(lambda _, submitted=time.perf_counter():
+                                             latencies.append(time.perf_counter() - submitted))
+                    futures.append(future)
+                    n += 1
+                time.sleep(0.001)
+            for future in futures:
+                future.result()
+            stats = pool.scheduler.stats()
+        finally:
+            pool.close()
+        results[name] = {"p50_ms": _percentile(latencies, 50) * 1000, "p99_ms": _percentile(latencies, 99) * 1000,
+                         "shed_rate": stats["shed_rate"]}
+        print(f"{name:<10} latency p50 {results[name]['p50_ms']:8.1f} ms  p99 {results[name]['p99_ms']:8.1f} ms"
+              f"   shed {results[name]['shed_rate']:.0%}")
+    return results
+
+
+def teletype(sessions: int = 5000, responses: int = 3) -> Dict[str, float]:
+    """
+    CPU time taken by one event loop typing out responses at IBM 2741 speed for many sessions at once, and how
+    closely the characters kept to time.
+    """
+    import asyncio
+    from elizateletype import IBM_2741_CPS, TeletypePacer
+
+    texts = [response + "\n" for _, response in cacm_1966_conversation]
+    written = [0]
+    late = []
+
+    async def session(pacer: TeletypePacer, n: int):
+        loop = asyncio.get_running_loop()
+        for r in range(responses):
+            text = texts[(n + r) % len(texts)]
+            start = loop.time()
+            await pacer.type(lambda data: written.__setitem__(0, written[0] + len(data)), text)
+            late.append(loop.time() - start - (len(text) - 1) / IBM_2741_CPS)
+
+    async def run():
+        pacer = TeletypePacer()
+        await asyncio.gather(*(session(pacer, n) for n in range(sessions)))
+        return pacer
+
+    cpu, wall = time.process_time(), time.perf_counter()
+    pacer = asyncio.run(run())
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    result = {"cpu_fraction": cpu / wall, "sessions_per_core": sessions * wall / cpu,
+              "late_p99_ms": _percentile(late, 99) * 1000, "characters_per_write": written[0] / pacer.writes}
+    print(f"{sessions} sessions typing for {wall:.1f} s: {cpu:.2f} s CPU ({result['cpu_fraction']:.1%} of a core),"
+          f" about {result['sessions_per_core']:.0f} sessions per core")
+    print(f"{written[0]} characters in {pacer.writes} writes; last character late by p99 {result['late_p99_ms']:.0f} ms")
+    return result
+
+
+def customer_script(n: int) -> str:
+    """
+    A customer's script: DOCTOR with its own greeting and a few rules of its own.
+    """
+    text = CACM_1966_01_DOCTOR_script.replace("HOW DO YOU DO", f"CUSTOMER {n} SAYS HELLO", 1)
+    return text + ''.join(f"(PRODUCT{n}X{i}\n    ((0 PRODUCT{n}X{i} 0)\n        (TELL ME ABOUT YOUR PRODUCT{n}X{i})))\n"
+                          for i in range(3))
+
+
+def registry(scripts: int = 50) -> Dict[str, float]:
+    """
+    Memory held by many customer scripts compiled separately, and held by a ScriptRegistry.
+    """
+    import gc
+    import tracemalloc
+    from elizaregistry import ScriptRegistry
+    from elizascript import ElizaScriptReader
+
+    texts = {f"customer{n}": customer_script(n) for n in range(scripts)}
+    results = {}
+    for name in ("separate", "registry"):
+        gc.collect()
+        tracemalloc.start()
+        if name == "separate":
+            held = [ElizaScriptReader.read_script(text)[1] for text in texts.values()]
+        else:
+            held = ScriptRegistry(texts.__getitem__, max_scripts=scripts)
+            for script_name in texts:
+                held.get(script_name)
+        gc.collect()
+        results[name] = tracemalloc.get_traced_memory()[0] / 1024
+        tracemalloc.stop()
+        del held
+        print(f"{name:<10} {scripts} scripts: {results[name]:8.0f} kB ({results[name] / scripts:6.1f} kB each)")
+    return results
+
+
+def batch(conversations: int = 2000) -> Dict[str, float]:
+    """
+    Exchanges a minute answered by main.py --batch, against the interactive loop's print() per response to a
+    line buffered stream.
+    """
+    import io
+    from eliza import Eliza
+    from elizabatch import run_batch
+    from elizaprebuilt import load_doctor_script
+    from elizasession import SessionState
+
+    eliza = Eliza(load_doctor_script())
+    prompts = [prompt for prompt, _ in cacm_1966_conversation]
+    exchanges = conversations * len(prompts)
+    text = ("\n".join(prompts) + "\n\n").encode() * conversations
+    results = {}
+    with open(os.devnull, "w", buffering=1) as devnull:
+        start = time.perf_counter()
+        for _ in range(conversations):
+            session = SessionState(eliza.script)
+            for prompt in prompts:
+                print(eliza.response(prompt, session), file=devnull)
+        results["print"] = exchanges * 60 / (time.perf_counter() - start)
+    with open(os.devnull, "wb", buffering=1024 * 1024) as devnull:
+        start = time.perf_counter()
+        run_batch(eliza, [io.BytesIO(text)], devnull)
+        results["batch"] = exchanges * 60 / (time.perf_counter() - start)
+    for name, rate in results.items():
+        print(f"{name:<6} {exchanges} exchanges: {rate:9.0f} a minute")
+    return results
+
+
+def replay(worker_counts: str = "1,2,4", conversations: int = 2000) -> Dict[int, float]:
+    """
+    Recorded exchanges a second checked by elizareplay, by number of worker processes.
+    """
+    import json
+    from elizaprebuilt import load_doctor_script
+    from elizareplay import replay as replay_transcripts
+
+    script = load_doctor_script()
+    lines = [json.dumps({"session": n, "text": prompt, "response": response}).encode()
+             for prompt, response in cacm_1966_conversation for n in range(conversations)]
+    results = {}
+    for workers in (int(n) for n in worker_counts.split(",")):
+        start = time.perf_counter()
+        report = replay_transcripts(script, lines, workers)
+        results[workers] = report["exchanges"] / (time.perf_counter() - start)
+        print(f"{workers} workers: {results[workers]:8.0f} exchanges/s, {report['matched']} of {report['exchanges']} matched")
+    return results
+
+
+def main(argv=None) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(description="ELIZA serving benchmarks")
+    commands = parser.add_subparsers(dest="benchmark")
+    command = commands.add_parser("prefork-memory", help="per-worker memory, pre-fork against independent processes")
+    command.add_argument("--workers", type=int, default=4)
+    command.add_argument("--rules", type=int, default=2000, help="extra synthetic rules added to DOCTOR")
+    command = commands.add_parser("spawn-memory", help="per-worker memory, shared memory script against reading it")
+    command.add_argument("--workers", type=int, default=4)
+    command.add_argument("--rules", type=int, default=2000, help="extra synthetic rules added to DOCTOR")
+    command = commands.add_parser("sessions", help="memory and speed of a SessionManager with many sessions")
+    command.add_argument("--sessions", type=int, default=200000)
+    command.add_argument("--max-sessions", type=int, default=100000)
+    command.add_argument("--ttl", type=float, default=0, help="idle seconds before a session is evicted")
+    command = commands.add_parser("async-server", help="throughput and latency of main.py --serve")
+    command.add_argument("--clients", type=int, default=100, help="connections sending remarks")
+    command.add_argument("--idle", type=int, default=1000, help="connections held open without sending")
+    command.add_argument("--seconds", type=float, default=5.0)
+    command = commands.add_parser("http-server", help="time per request of main.py --http")
+    command.add_argument("--requests", type=int, default=2000)
+    command.add_argument("--batch", type=int, default=50, help="remarks per /respond_batch request")
+    command = commands.add_parser("rpc-server", help="responses per second of main.py --rpc")
+    command.add_argument("--requests", type=int, default=5000)
+    command.add_argument("--sessions", type=int, default=100)
+    command = commands.add_parser("sharded", help="responses per second of ShardedPool by number of workers")
+    command.add_argument("--workers", default="1,2,4", help="comma separated pool sizes")
+    command.add_argument("--requests", type=int, default=20000)
+    command.add_argument("--sessions", type=int, default=1000)
+    command = commands.add_parser("threads", help="responses per second of ThreadPoolEliza by number of threads")
+    command.add_argument("--threads", default="1,2,4,8", help="comma separated thread counts")
+    command.add_argument("--requests", type=int, default=20000)
+    command.add_argument("--sessions", type=int, default=1000)
+    command.add_argument("--free-threaded", default="", metavar="PYTHON",
+                         help="free-threaded interpreter to run the benchmark on as well; - for none")
+    command = commands.add_parser("fair", help="users' latency behind one client's backlog, by scheduling policy")
+    command.add_argument("--backlog", type=int, default=5000, help="remarks the chatty client queues")
+    command.add_argument("--users", type=int, default=100, help="other sessions, each sending one remark")
+    command.add_argument("--threads", type=int, default=2)
+    command = commands.add_parser("overload", help="latency and shed rate beyond capacity, with and without deadlines")
+    command.add_argument("--load", type=float, default=2.0, help="offered load as a multiple of capacity")
+    command.add_argument("--timeout", type=float, default=0.05, help="seconds each request is given")
+    command.add_argument("--seconds", type=float, default=3.0)
+    command.add_argument("--threads", type=int, default=2)
+    command = commands.add_parser("teletype", help="CPU cost of typing responses at IBM 2741 speed for many sessions")
+    command.add_argument("--sessions", type=int, default=5000)
+    command.add_argument("--responses", type=int, default=3, help="responses typed by each session")
+    command = commands.add_parser("registry", help="memory of many customer scripts, separate and in a ScriptRegistry")
+    command.add_argument("--scripts", type=int, default=50)
+    command = commands.add_parser("batch", help="exchanges a minute of main.py --batch, against print() per response")
+    command.add_argument("--conversations", type=int, default=2000)
+    command = commands.add_parser("replay", help="exchanges a second checked by elizareplay by number of workers")
+    command.add_argument("--workers", default="1,2,4", help="comma separated worker counts")
+    command.add_argument("--conversations", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    if args.benchmark == "prefork-memory":
+        prefork_memory(args.workers, args.rules)
+    elif args.benchmark == "spawn-memory":
+        spawn_memory(args.workers, args.rules)
+    elif args.benchmark == "sessions":
+        session_table(args.sessions, args.max_sessions, args.ttl)
+    elif args.benchmark == "async-server":
+        async_server(args.clients, args.idle, args.seconds)
+    elif args.benchmark == "http-server":
+        http_server(args.requests, args.batch)
+    elif args.benchmark == "rpc-server":
+        rpc_server(args.requests, args.sessions)
+    elif args.benchmark == "sharded":
+        sharded(args.workers, args.requests, args.sessions)
+    elif args.benchmark == "threads":
+        threads(args.threads, args.requests, args.sessions, args.free_threaded)
+    elif args.benchmark == "fair":
+        fair(args.backlog, args.users, args.threads)
+    elif args.benchmark == "overload":
+        overload(args.load, args.timeout, args.seconds, threads=args.threads)
+    elif args.benchmark == "teletype":
+        teletype(args.sessions, args.responses)
+    elif args.benchmark == "registry":
+        registry(args.scripts)
+    elif args.benchmark == "batch":
+        batch(args.conversations)
+    elif args.benchmark == "replay":
+        replay(args.workers, args.conversations)
+    else:
+        parser.print_help()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
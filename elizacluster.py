@@ -0,0 +1,383 @@
+"""
+Conversations spread over several ELIZA nodes, each a process that may be on another host, behind a router
+that places sessions on nodes by consistent hashing. Each node keeps its own sessions, so no store is shared
+on the hot path. When a node joins or leaves only the sessions whose place on the ring changes are moved, each
+as an encode_session() snapshot, and requests are held while they move, so a session's remarks are always
+answered in the order they were made, by the node that has its state.
+
+Nodes and router talk JSON over multiprocessing.connection, never pickle, and must share an authkey, which
+the connection's HMAC handshake checks before anything else is read: a node will not start without one.
+Session ids are strings or integers, and snapshots travel in base64.
+
+    node = ElizaNode(script, ("0.0.0.0", 2742), authkey=b"secret")   # on each host
+    node.serve_forever()
+
+    router = ClusterRouter({"a": ("host-a", 2742), "b": ("host-b", 2742)}, authkey=b"secret")
+    router.respond("user 1", "Men are all alike.")
+    router.add_node("c", ("host-c", 2742))
+"""
+import base64
+import bisect
+import hashlib
+import json
+import threading
+from multiprocessing.connection import Client, Listener
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+from eliza import Eliza
+from elizalogic import Script
+from elizasession import SessionManager, encode_session
+
+DEFAULT_VNODES = 64
+MAX_MESSAGE = 64 * 1024 * 1024  # longest request or reply accepted, in bytes
+
+
+def _check_authkey(authkey: Optional[bytes]) -> bytes:
+    if not authkey:
+        raise ValueError("an ELIZA cluster needs an authkey shared by the router and its nodes")
+    return authkey
+
+
+def _send(conn, message) -> None:
+    conn.send_bytes(json.dumps(message).encode())
+
+
+def _recv(conn):
+    return json.loads(conn.recv_bytes(MAX_MESSAGE))
+
+
+def _session_id(session_id) -> Hashable:
+    if not isinstance(session_id, (str, int)) or isinstance(session_id, bool):
+        raise TypeError(f"session id {session_id!r} is not a string or an integer")
+    return session_id
+
+
+def _ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+        A consistent hash ring: each node is placed at vnodes points, and a key belongs to the node at the
+        first point at or after the key's hash. Adding or removing a node changes the owner only of the keys
+        on the arcs that node takes or gives up.
+    """
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = DEFAULT_VNODES):
+        self.vnodes = vnodes
+        self.points: List[int] = []
+        self.owners: List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    def nodes(self) -> List[str]:
+        return sorted(set(self.owners))
+
+    def add(self, node: str) -> None:
+        if node in self.owners:
+            raise ValueError(f"node {node!r} is already on the ring")
+        for i in range(self.vnodes):
+            point = _ring_hash(f"{node}#{i}")
+            n = bisect.bisect_left(self.points, point)
+            self.points.insert(n, point)
+            self.owners.insert(n, node)
+
+    def remove(self, node: str) -> None:
+        if node not in self.owners:
+            raise ValueError(f"node {node!r} is not on the ring")
+        kept = [(point, owner) for point, owner in zip(self.points, self.owners) if owner != node]
+        self.points = [point for point, _ in kept]
+        self.owners = [owner for _, owner in kept]
+
+    def copy(self) -> "HashRing":
+        ring = HashRing(vnodes=self.vnodes)
+        ring.points, ring.owners = list(self.points), list(self.owners)
+        return ring
+
+    def node_for(self, key: Hashable) -> str:
+        if not self.points:
+            raise LookupError("the ring has no nodes")
+        n = bisect.bisect_left(self.points, _ring_hash(str(key)))
+        return self.owners[n % len(self.owners)]
+
+
+class ElizaNode:
+    """
+        One node of a cluster: keeps conversations by session id in a SessionManager and answers a
+        ClusterRouter's requests over multiprocessing.connection, authenticated with authkey, which is required.
+        Each router connection is served by its own thread; responses are made one at a time.
+
+        Requests and their replies, as JSON arrays:
+            ["batch", [[session id, remark], ...]]  ->  [[response, error], ...]
+            ["export", {"nodes": [...], "vnodes": N}, name]  ->  {node: [[session id, snapshot], ...]} for the
+                                        sessions that ring places on another node, which are kept until dropped
+            ["drop", [session id, ...]]  ->  number of sessions dropped
+            ["import", [[session id, snapshot], ...]]  ->  number of sessions imported
+            ["count"]  ->  number of sessions held
+        A connection that sends anything else is closed.
+    """
+    def __init__(self, script: Script, address: Tuple[str, int] = ("127.0.0.1", 0), authkey: Optional[bytes] = None,
+                 max_sessions: int = 100000, ttl: Optional[float] = None):
+        self.engine = Eliza(script)
+        self.sessions = SessionManager(self.engine, max_sessions, ttl)
+        self.address = address
+        self.authkey = _check_authkey(authkey)
+        self.listener: Optional[Listener] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> Tuple[str, int]:
+        """
+        Start listening.
+        :return: The address being served, which has the actual port if port 0 was asked for.
+        """
+        self.listener = Listener(self.address, authkey=self.authkey)
+        self.address = self.listener.address
+        return self.address
+
+    def serve_forever(self) -> None:
+        if self.listener is None:
+            self.start()
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                return  # stopped
+            except Exception:
+                continue  # failed authentication
+            threading.Thread(target=self._serve, args=(conn,), name="eliza-node", daemon=True).start()
+
+    def stop(self) -> None:
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+
+    def _serve(self, conn) -> None:
+        with conn:
+            while True:
+                try:
+                    reply = self.handle(_recv(conn))
+                except (EOFError, OSError):
+                    return
+                except (ValueError, TypeError, LookupError):
+                    return  # not a request: json.JSONDecodeError is a ValueError
+                _send(conn, reply)
+
+    def handle(self, message):
+        """
+        The reply to a decoded request.
+        :raises ValueError, TypeError, LookupError: The request is malformed.
+        """
+        kind = message[0]
+        with self._lock:
+            if kind == "batch":
+                replies = []
+                for session_id, remark in message[1]:
+                    try:
+                        replies.append((self.sessions.respond(_session_id(session_id), remark), None))
+                    except Exception as e:
+                        replies.append((None, f"{type(e).__name__}: {e}"))
+                return replies
+            if kind == "export":
+                ring, name = HashRing(message[1]["nodes"], message[1]["vnodes"]), message[2]
+                moving: Dict[str, list] = {}
+                for session_id, state in self.sessions.items():
+                    node = ring.node_for(session_id)
+                    if node != name:
+                        snapshot = base64.b64encode(encode_session(state)).decode()
+                        moving.setdefault(node, []).append((session_id, snapshot))
+                return moving
+            if kind == "drop":
+                return sum(self.sessions.drop(_session_id(session_id)) is not None for session_id in message[1])
+            if kind == "import":
+                sessions = [(_session_id(session_id), self.sessions.new_state(base64.b64decode(snapshot)))
+                            for session_id, snapshot in message[1]]
+                for session_id, state in sessions:
+                    self.sessions.put(session_id, state)
+                return len(sessions)
+            if kind == "count":
+                return len(self.sessions)
+        raise ValueError(f"unknown request {kind!r}")
+
+
+def serve(script: Script, address: Tuple[str, int], authkey: bytes, announce=print) -> None:
+    """
+    Run an ElizaNode until interrupted.
+    """
+    node = ElizaNode(script, address, authkey)
+    host, port = node.start()
+    announce(f"Serving cluster node on {host}:{port}")
+    try:
+        node.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        node.stop()
+
+
+def _run_node(script, address, authkey, ready) -> None:
+    node = ElizaNode(script, address, authkey)
+    ready.send(node.start())
+    ready.close()
+    node.serve_forever()
+
+
+def start_local_node(script: Script, address: Tuple[str, int] = ("127.0.0.1", 0), authkey: Optional[bytes] = None):
+    """
+    Start an ElizaNode in a child process, standing in for a host.
+    :return: (process, address served)
+    """
+    import multiprocessing
+    _check_authkey(authkey)
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_run_node, args=(script, address, authkey, child), daemon=True)
+    process.start()
+    child.close()
+    address = parent.recv()
+    parent.close()
+    return process, address
+
+
+class _NodeLink:
+    def __init__(self, address, authkey: bytes):
+        self.address = address
+        self.conn = Client(tuple(address), authkey=authkey)
+        self.lock = threading.Lock()
+
+    def call(self, message):
+        with self.lock:
+            _send(self.conn, message)
+            return _recv(self.conn)
+
+
+class ClusterRouter:
+    """
+        Routes each conversation to the node the hash ring places its session id on. Safe to share between
+        threads: requests run concurrently, while adding or removing a node waits for the requests under way
+        and holds new ones until the sessions have moved. Session ids are strings or integers.
+    """
+    def __init__(self, nodes: Dict[str, Tuple[str, int]], authkey: Optional[bytes] = None,
+                 vnodes: int = DEFAULT_VNODES):
+        self.authkey = _check_authkey(authkey)
+        self.ring = HashRing(vnodes=vnodes)
+        self.links: Dict[str, _NodeLink] = {}
+        self.migrated = 0
+        self.changes = 0
+        self._gate = threading.Condition()
+        self._active = 0
+        self._changing = False
+        for name, address in nodes.items():
+            self.links[name] = _NodeLink(address, authkey)
+            self.ring.add(name)
+
+    def _enter(self) -> None:
+        with self._gate:
+            while self._changing:
+                self._gate.wait()
+            self._active += 1
+
+    def _leave(self) -> None:
+        with self._gate:
+            self._active -= 1
+            if not self._active:
+                self._gate.notify_all()
+
+    def respond(self, session_id: Hashable, remark: str) -> str:
+        return self.respond_many([(session_id, remark)])[0]
+
+    def respond_many(self, requests: Iterable[Tuple[Hashable, str]]) -> List[str]:
+        """
+        Send the requests, one batch to each node concerned, and return the responses in order.
+        :raises RuntimeError: A node could not answer a request.
+        """
+        requests = [(_session_id(session_id), remark) for session_id, remark in requests]
+        self._enter()
+        try:
+            batches: Dict[str, List[int]] = {}
+            for n, (session_id, _) in enumerate(requests):
+                batches.setdefault(self.ring.node_for(session_id), []).append(n)
+            responses: List[Optional[str]] = [None] * len(requests)
+            for name, indexes in batches.items():
+                replies = self.links[name].call(("batch", [requests[n] for n in indexes]))
+                for n, (response, error) in zip(indexes, replies):
+                    if error is not None:
+                        raise RuntimeError(f"node {name}: {error}")
+                    responses[n] = response
+            return responses
+        finally:
+            self._leave()
+
+    def add_node(self, name: str, address: Tuple[str, int]) -> int:
+        """
+        Add a node and move to it the sessions it now owns.
+        :return: The number of sessions moved.
+        """
+        link = _NodeLink(address, self.authkey)
+        ring = self.ring.copy()
+        ring.add(name)
+        try:
+            return self._change(ring, {name: link}, list(self.links))
+        except BaseException:
+            link.conn.close()
+            raise
+
+    def remove_node(self, name: str) -> int:
+        """
+        Move a node's sessions to the nodes that now own them, and remove it. The node itself keeps running.
+        :return: The number of sessions moved.
+        """
+        if self.ring.nodes() == [name]:
+            raise ValueError("cannot remove the last node")
+        ring = self.ring.copy()
+        ring.remove(name)
+        return self._change(ring, {}, [name])
+
+    def _change(self, ring: HashRing, joining: Dict[str, _NodeLink], sources: List[str]) -> int:
+        with self._gate:
+            while self._changing:
+                self._gate.wait()
+            self._changing = True
+            while self._active:
+                self._gate.wait()
+        try:
+            links = dict(self.links, **joining)
+            ring_data = {"nodes": ring.nodes(), "vnodes": ring.vnodes}
+            # copied to their new nodes first, and dropped from their old ones only once all are there; if a copy
+            # fails, those already made are dropped instead and the ring stays as it was
+            exports = {source: links[source].call(("export", ring_data, source)) for source in sources}
+            imported: List[Tuple[str, List]] = []
+            try:
+                for source, moving in exports.items():
+                    for target, sessions in moving.items():
+                        links[target].call(("import", sessions))
+                        imported.append((target, [session_id for session_id, _ in sessions]))
+            except BaseException:
+                for target, session_ids in imported:
+                    try:
+                        links[target].call(("drop", session_ids))
+                    except Exception:
+                        pass
+                raise
+            moved = 0
+            for source, moving in exports.items():
+                session_ids = [session_id for sessions in moving.values() for session_id, _ in sessions]
+                if session_ids:
+                    links[source].call(("drop", session_ids))
+                moved += len(session_ids)
+            for name in set(links) - set(ring.nodes()):
+                links.pop(name).conn.close()
+            self.links, self.ring = links, ring
+            self.migrated += moved
+            self.changes += 1
+            return moved
+        finally:
+            with self._gate:
+                self._changing = False
+                self._gate.notify_all()
+
+    def stats(self) -> Dict[str, object]:
+        return {"nodes": {name: link.call(("count",)) for name, link in self.links.items()},
+                "changes": self.changes, "sessions_migrated": self.migrated}
+
+    def close(self) -> None:
+        for link in self.links.values():
+            link.conn.close()
+        self.links = {}
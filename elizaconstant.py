@@ -1,8 +1,14 @@
-from typing import Optional, List, Any, OrderedDict
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Optional, List, Any, OrderedDict
 
-# Type definitins.
-RuleMap = OrderedDict[str, Optional[Any]]
-TagMap = OrderedDict[str, List[str]]
+    # Type definitins.
+    RuleMap = OrderedDict[str, Optional[Any]]
+    TagMap = OrderedDict[str, List[str]]
+else:
+    # the type definitions are only for annotations: at run time they are plain OrderedDicts, so typing (and
+    # re, which it imports) is not loaded before the first response
+    from collections import OrderedDict as RuleMap, OrderedDict as TagMap
 
 
 # Constants
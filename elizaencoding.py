@@ -1,4 +1,9 @@
-from typing import List, Dict
+from __future__ import annotations
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import List, Dict
+
 hollerith_undefined = 0xFF
 # "The 7090 BCD character codes are given in the accompanying table.
 #    Six bits are used for each character. [...] The code is generally
@@ -137,6 +142,22 @@ def filter_bcd(utf8_string):
 
     return ''.join(result) if len(result) else ''
 
+
+# filter_bcd() of each ASCII character, as a bytes.translate() table
+_BCD_BYTE_TABLE = bytes(ord(filter_bcd(chr(b))) for b in range(128)) + bytes(128)
+
+
+def filter_bcd_bytes(data) -> str:
+    """
+    filter_bcd() of UTF-8 encoded bytes, without decoding them first when they are ASCII, as they nearly
+    always are. Invalid UTF-8 is treated as non-BCD characters.
+    :param data: bytes, bytearray or a memoryview of bytes.
+    """
+    data = bytes(data)
+    if data.isascii():
+        return data.translate(_BCD_BYTE_TABLE).decode("ascii")
+    return filter_bcd(data.decode("utf-8", "replace"))
+
 def hash(d: int, n: int) -> int:
     """
     This function implements the SLIP HASH algorithm from the FAP
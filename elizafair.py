@@ -0,0 +1,232 @@
+"""
+A fair scheduler for the serving layer. Requests are queued by session and the sessions with requests waiting
+take turns, so a client sending thousands of remarks delays other conversations by at most one response per
+turn instead of by its whole backlog. A session has at most one request in flight, so its remarks are
+answered in the order they were made.
+
+Under overload the scheduler sheds requests rather than let its queue, and everyone's latency, grow without
+bound: a request is shed when the queue is full, or when it has a deadline it can no longer meet, judged by
+how long responses have been taking. A shed request is answered by the scheduler's shed function, e.g. with
+ELIZA's built-in nomatch message, or fails with Overloaded.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Deque, Dict, Hashable, Optional, Tuple
+
+ROUND_ROBIN = "round_robin"
+DEFICIT = "deficit"
+DEFAULT_QUANTUM = 256  # characters of remark a session may be answered for on each turn, with DEFICIT
+WAIT_SAMPLES = 10000  # the queue waits kept for stats()
+SERVICE_TIME_WEIGHT = 0.05  # of each response in the running mean of response time
+
+
+class Overloaded(RuntimeError):
+    """
+    A request was shed and the scheduler has no shed function.
+    """
+
+
+class _SessionQueue:
+    __slots__ = ("requests", "deficit", "busy")
+
+    def __init__(self):
+        self.requests: Deque[Tuple[str, Future, float, Optional[float]]] = deque()
+        self.deficit = 0
+        self.busy = False  # a request is in flight
+
+
+class FairScheduler:
+    """
+        Calls respond(session_id, remark) on worker threads for the requests submitted, taking the sessions
+        with requests waiting in turn.
+
+            scheduler = FairScheduler(sessions.respond, workers=4)
+            scheduler.submit("user 1", "Men are all alike.").result()
+
+        With ROUND_ROBIN each session is answered once per turn. With DEFICIT (deficit round robin) each turn
+        adds quantum to a session's allowance and a remark is answered once the allowance covers its length,
+        so sessions sending long remarks get no more of the workers' time than sessions sending short ones.
+
+        workers is the number of responses made at once. At most max_queue requests wait (0 for no limit), and
+        a request without a deadline of its own is given one timeout seconds after it is submitted, if timeout
+        is given. shed(session_id, remark) answers requests that are shed; without it they fail with Overloaded.
+    """
+    def __init__(self, respond: Callable[[Hashable, str], str], workers: int = 1, policy: str = ROUND_ROBIN,
+                 quantum: int = DEFAULT_QUANTUM, clock: Callable[[], float] = time.monotonic, max_queue: int = 0,
+                 timeout: Optional[float] = None, shed: Optional[Callable[[Hashable, str], str]] = None):
+        if policy not in (ROUND_ROBIN, DEFICIT):
+            raise ValueError(f"unknown scheduling policy {policy!r}")
+        if quantum <= 0:
+            raise ValueError(f"quantum must be positive, not {quantum!r}")
+        self.respond = respond
+        self.policy = policy
+        self.quantum = quantum
+        self.clock = clock
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.shed = shed
+        self.service_time = 0.0  # running mean of the time respond() takes, in seconds
+        self._waiting = 0
+        self._queues: Dict[Hashable, _SessionQueue] = {}
+        self._ready: Deque[Hashable] = deque()  # sessions with requests waiting and none in flight, in turn
+        self._cond = threading.Condition()
+        self._closed = False
+        self.waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)  # seconds each recent request was queued
+        self.submitted = 0
+        self.completed = 0
+        self.queued_max = 0
+        self.shed_queue_full = 0
+        self.shed_deadline = 0  # on submit, or when the request's turn came
+        self._threads = [threading.Thread(target=self._work, name="eliza-fair", daemon=True)
+                         for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, session_id: Hashable, remark: str, deadline: Optional[float] = None) -> Future:
+        """
+        Queue remark behind the earlier remarks of session_id.
+        :param deadline: When the response is needed by, on the scheduler's clock; a request that cannot be
+                         answered by then is shed.
+        :return: A Future of the response.
+        """
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("the scheduler is closed")
+            self.submitted += 1
+            now = self.clock()
+            if deadline is None and self.timeout is not None:
+                deadline = now + self.timeout
+            queue = self._queues.get(session_id)
+            ahead = len(self._ready) + (len(queue.requests) + queue.busy if queue is not None else 0)
+            if self.max_queue and self._waiting >= self.max_queue:
+                self.shed_queue_full += 1
+                shed = True
+            elif deadline is not None and now + (ahead // self.workers + 1) * self.service_time > deadline:
+                self.shed_deadline += 1
+                shed = True
+            else:
+                shed = False
+                if queue is None:
+                    queue = self._queues[session_id] = _SessionQueue()
+                queue.requests.append((remark, future, now, deadline))
+                self._waiting += 1
+                if len(queue.requests) > self.queued_max:
+                    self.queued_max = len(queue.requests)
+                if not queue.busy and len(queue.requests) == 1:
+                    self._ready.append(session_id)
+                    self._cond.notify()
+        if shed:
+            self._shed(session_id, remark, future)
+        return future
+
+    def _shed(self, session_id: Hashable, remark: str, future: Future) -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        if self.shed is None:
+            future.set_exception(Overloaded("too busy to answer in time"))
+            return
+        try:
+            future.set_result(self.shed(session_id, remark))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _next(self) -> Optional[Tuple[Hashable, str, Future, bool]]:
+        # the next request to answer, and whether to shed it, or None once closed and drained; called holding
+        # self._cond
+        while True:
+            while not self._ready:
+                if self._closed and not any(queue.busy for queue in self._queues.values()):
+                    return None
+                self._cond.wait()
+            session_id = self._ready.popleft()
+            queue = self._queues[session_id]
+            remark, future, queued, deadline = queue.requests[0]
+            if self.policy == DEFICIT:
+                queue.deficit += self.quantum
+                if len(remark) > queue.deficit:
+                    self._ready.append(session_id)  # wait for a later turn
+                    continue
+                queue.deficit -= len(remark)
+            queue.requests.popleft()
+            queue.busy = True
+            self._waiting -= 1
+            now = self.clock()
+            self.waits.append(now - queued)
+            late = deadline is not None and now + self.service_time > deadline
+            if late:
+                self.shed_deadline += 1
+            return session_id, remark, future, late
+
+    def _work(self) -> None:
+        while True:
+            with self._cond:
+                request = self._next()
+            if request is None:
+                with self._cond:
+                    self._cond.notify_all()
+                return
+            session_id, remark, future, late = request
+            took = None
+            if late:
+                self._shed(session_id, remark, future)
+            elif future.set_running_or_notify_cancel():
+                start = self.clock()
+                try:
+                    future.set_result(self.respond(session_id, remark))
+                except Exception as e:
+                    future.set_exception(e)
+                took = self.clock() - start
+            with self._cond:
+                if took is not None:
+                    self.service_time += SERVICE_TIME_WEIGHT * (took - self.service_time)
+                self.completed += 1
+                queue = self._queues[session_id]
+                queue.busy = False
+                if queue.requests:
+                    self._ready.append(session_id)
+                    self._cond.notify()
+                else:
+                    del self._queues[session_id]
+                    if self._closed:
+                        self._cond.notify_all()
+
+    def depth(self) -> int:
+        """
+        Requests waiting, not counting those in flight.
+        """
+        with self._cond:
+            return self._waiting
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Counts, the queue wait of recent requests and the mean response time in seconds, and the fraction of
+        requests shed.
+        """
+        with self._cond:
+            waits = sorted(self.waits)
+            waiting = self._waiting
+            sessions = len(self._queues)
+        shed = self.shed_queue_full + self.shed_deadline
+
+        def percentile(p: float) -> float:
+            return waits[min(len(waits) - 1, int(p * len(waits)))] if waits else 0.0
+
+        return {"submitted": self.submitted, "completed": self.completed, "waiting": waiting,
+                "sessions_waiting": sessions, "queued_max": self.queued_max,
+                "wait_p50": percentile(0.5), "wait_p99": percentile(0.99), "wait_max": waits[-1] if waits else 0.0,
+                "service_time": self.service_time, "shed_queue_full": self.shed_queue_full,
+                "shed_deadline": self.shed_deadline, "shed_rate": shed / self.submitted if self.submitted else 0.0}
+
+    def close(self) -> None:
+        """
+        Answer the requests already submitted, then stop the worker threads.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
@@ -0,0 +1,197 @@
+"""
+An HTTP/1.1 JSON API for ELIZA, with persistent connections, built on http.server.
+
+    POST /respond           {"session": ID, "text": TEXT}  ->  {"response": TEXT}
+    POST /respond_batch     {"requests": [{"session": ID, "text": TEXT}, ...]}  ->  {"responses": [TEXT, ...]}
+    GET  /greeting          ->  {"greeting": TEXT}
+
+A conversation is kept either on the server, by session id in a SessionManager, or by the client: send
+"token" instead of "session" (an empty token starts a conversation) and each response comes back with the
+token to send next time, as {"response": TEXT, "token": TOKEN}; a batch with tokens in it is answered with
+{"responses": [...], "tokens": [TOKEN or null, ...]}. A token is an encode_session() snapshot in
+URL-safe base64: a few bytes for a new conversation, growing with its MEMORY queue.
+"""
+import base64
+import binascii
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Hashable, Optional, Tuple
+
+from eliza import Eliza
+from elizalogic import Script
+from elizaprefork import DEFAULT_PORT
+from elizasession import SessionManager, SessionState, encode_session
+
+MAX_BODY = 1 << 20  # largest request accepted, in bytes
+MAX_HEADERS = 100
+MAX_HEADER_LINE = 65536
+
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class ElizaAPI:
+    """
+        The API itself, apart from HTTP: answers decoded JSON requests. Responses are made one at a time.
+    """
+    def __init__(self, script: Script, max_sessions: int = 100000, ttl: Optional[float] = 3600):
+        self.eliza = Eliza(script)
+        self.sessions = SessionManager(self.eliza, max_sessions, ttl)
+        self._lock = threading.Lock()
+
+    def _request(self, request) -> Tuple[Optional[SessionState], Optional[Hashable], str]:
+        # (state, None, text) for a request with a token, (None, session id, text) for one with a session, or
+        # RequestError; nothing is changed, so a batch can be checked whole before any of it is answered
+        if not isinstance(request, dict) or not isinstance(request.get("text"), str):
+            raise RequestError(400, "expected {\"session\": ID, \"text\": TEXT} or {\"token\": TOKEN, \"text\": TEXT}")
+        text = request["text"]
+        if "token" in request:
+            token = request["token"]
+            try:
+                return self.sessions.new_state(base64.urlsafe_b64decode(token) if token else None), None, text
+            except (ValueError, TypeError, binascii.Error):
+                raise RequestError(400, "bad session token") from None
+        session_id = request.get("session")
+        if not isinstance(session_id, (str, int)) or isinstance(session_id, bool):
+            raise RequestError(400, "session must be a string or an integer")
+        return None, session_id, text
+
+    def _respond(self, state: Optional[SessionState], session_id: Optional[Hashable], text: str) -> dict:
+        # called holding self._lock
+        if state is None:
+            return {"response": self.sessions.respond(session_id, text)}
+        response = self.eliza.response(text, state)
+        return {"response": response, "token": base64.urlsafe_b64encode(encode_session(state)).decode()}
+
+    def respond(self, request) -> dict:
+        request = self._request(request)
+        with self._lock:
+            return self._respond(*request)
+
+    def respond_batch(self, request) -> dict:
+        """
+        Answer every request in the batch, or none of them if any is bad.
+        """
+        if not isinstance(request, dict) or not isinstance(request.get("requests"), list):
+            raise RequestError(400, "expected {\"requests\": [...]}")
+        requests = [self._request(r) for r in request["requests"]]
+        with self._lock:
+            results = [self._respond(*r) for r in requests]
+        reply = {"responses": [r["response"] for r in results]}
+        if any("token" in r for r in results):
+            reply["tokens"] = [r.get("token") for r in results]
+        return reply
+
+    def greeting(self) -> dict:
+        return {"greeting": self.eliza.get_greeting()}
+
+
+class ElizaRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep connections open between requests
+    disable_nagle_algorithm = True
+    server_version = "ELIZA/1966"
+    api: ElizaAPI  # set on the subclass made by make_server()
+
+    def parse_request(self) -> bool:
+        # a lean version of BaseHTTPRequestHandler.parse_request(): the email package it uses parses headers
+        # far more thoroughly, and slowly, than this API needs. self.headers is a dict with lower case names.
+        self.command = None
+        self.request_version = "HTTP/1.0"
+        self.close_connection = True
+        words = self.raw_requestline.decode("latin-1").rstrip("\r\n").split()
+        if len(words) != 3 or not words[2].startswith("HTTP/1."):
+            self.send_error(400, "Bad request")
+            return False
+        self.command, self.path, self.request_version = words
+        headers = {}
+        while True:
+            line = self.rfile.readline(MAX_HEADER_LINE + 1)
+            if len(line) > MAX_HEADER_LINE or len(headers) > MAX_HEADERS:
+                self.send_error(431, "Request header fields too large")
+                return False
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        self.headers = headers
+        connection = headers.get("connection", "").lower()
+        self.close_connection = connection == "close" or (self.request_version == "HTTP/1.0" and
+                                                          connection != "keep-alive")
+        if headers.get("expect", "").lower() == "100-continue":
+            self.send_response_only(100)
+            self.end_headers()
+        return True
+
+    def do_GET(self):
+        if self.path == "/greeting":
+            self._reply(200, self.api.greeting())
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        routes = {"/respond": self.api.respond, "/respond_batch": self.api.respond_batch}
+        try:
+            length = int(self.headers.get("content-length", ""))
+        except ValueError:
+            length = -1
+        if length < 0:
+            # and the connection closed, as where the body ends is unknown
+            self._reply(400, {"error": "a Content-Length of 0 or more is required"}, close=True)
+            return
+        if length > MAX_BODY:
+            self._reply(413, {"error": "request too large"}, close=True)
+            return
+        body = self.rfile.read(length)
+        route = routes.get(self.path)
+        if route is None:
+            self._reply(404, {"error": "not found"})
+            return
+        try:
+            self._reply(200, route(json.loads(body)))
+        except (ValueError, UnicodeDecodeError):
+            self._reply(400, {"error": "body is not JSON"})
+        except RequestError as e:
+            self._reply(e.status, {"error": str(e)})
+
+    def _reply(self, status: int, message: dict, close: bool = False) -> None:
+        # the whole response in one write
+        body = json.dumps(message).encode()
+        connection = ""
+        if close:
+            self.close_connection = True
+            connection = "Connection: close\r\n"
+        head = (f"{self.protocol_version} {status} {self.responses[status][0]}\r\n"
+                f"Server: {self.server_version}\r\nDate: {self.date_time_string()}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n{connection}\r\n")
+        self.wfile.write(head.encode("latin-1") + body)
+
+    def log_message(self, format, *args):
+        pass  # one line per request is more than the responses cost
+
+
+def make_server(script: Script, address: Tuple[str, int] = ("127.0.0.1", DEFAULT_PORT),
+                **api_options) -> ThreadingHTTPServer:
+    """
+    An HTTP server for script; call serve_forever() on it. Each connection is served by its own thread.
+    :param api_options: Passed to ElizaAPI.
+    """
+    handler = type("Handler", (ElizaRequestHandler,), {"api": ElizaAPI(script, **api_options)})
+    server = ThreadingHTTPServer(address, handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve(script: Script, address: Tuple[str, int], announce=print) -> None:
+    server = make_server(script, address)
+    host, port = server.server_address[:2]
+    announce(f"Serving on {host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,154 @@
+"""
+Event-sourced conversations. ELIZA is deterministic: LIMIT cycles, reassembly positions advance and MEMORY
+is chosen by a hash of the input, so a conversation is fully described by what the user said. A
+SessionJournal stores each session as an append-only log of its normalised inputs, one line per remark, and
+rebuilds the session by replaying the log through the engine. Every so many entries the log is compacted:
+the session state is written as an encode_session() snapshot and the log starts again empty.
+
+A session with id S in directory D is kept in
+
+    D/<S quoted>.snap           generation (decimal), a newline, then the snapshot; absent before compaction
+    D/<S quoted>.<gen>.log      the inputs since the snapshot of that generation
+
+where a string id is quoted as a URL path segment, and an id of any other type is quoted as its type's name,
+an =, and the quoted str() of the id, so that the ids 1 and "1" are different sessions.
+
+so compaction is safe at any point: a log whose generation does not match the snapshot is stale and ignored.
+Replaying a log needs the script that was used to write it; after the script is changed the rebuilt
+conversation may differ from the original.
+"""
+import os
+from typing import Hashable, List, Optional, Tuple
+from urllib.parse import quote
+
+from elizaencoding import filter_bcd
+from elizalogic import DEFAULT_MAX_MEMORIES, DROP_OLDEST
+from elizasession import SessionManager, SessionState, encode_session
+
+
+class SessionJournal:
+    """
+        Many conversations with one Eliza, by session id, each kept durable as a journal of its inputs. The
+        sessions in use are also held in memory, in a SessionManager of up to max_hot sessions, so a journal is
+        only replayed when a session comes back after being evicted. max_memories and memory_policy are the
+        MEMORY queue settings of sessions, whether new or rebuilt.
+    """
+    def __init__(self, eliza, directory: str, compact_every: int = 100, max_hot: int = 10000,
+                 fsync: bool = False, max_memories: int = DEFAULT_MAX_MEMORIES, memory_policy: str = DROP_OLDEST):
+        self.eliza = eliza
+        self.directory = directory
+        self.compact_every = compact_every
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        # session id -> (generation, entries in its log)
+        self._logs = {}
+        self.hot = SessionManager(eliza, max_hot, on_evict=self._evicted, loader=self._rebuild,
+                                  max_memories=max_memories, memory_policy=memory_policy)
+        self.appends = 0
+        self.replayed = 0
+        self.compactions = 0
+
+    def _path(self, session_id: Hashable, suffix: str) -> str:
+        # quote() escapes "=", so a quoted string id never looks like a typed one
+        name = quote(session_id, safe="") if isinstance(session_id, str) else \
+            f"{type(session_id).__name__}={quote(str(session_id), safe='')}"
+        return os.path.join(self.directory, name + suffix)
+
+    def respond(self, session_id: Hashable, text: str) -> str:
+        """
+        ELIZA's response to text in the conversation session_id. The normalised text is appended to the
+        session's journal before it is answered.
+        """
+        text = filter_bcd(text)
+        state = self.hot.get(session_id)
+        generation, entries = self._logs[session_id]
+        with open(self._path(session_id, f".{generation}.log"), "a", encoding="ascii") as log:
+            log.write(text + "\n")
+            if self.fsync:
+                log.flush()
+                os.fsync(log.fileno())
+        self.appends += 1
+        self._logs[session_id] = (generation, entries + 1)
+        response = self.eliza.response(text, state, filtered=True)
+        if entries + 1 >= self.compact_every:
+            self.compact(session_id)
+        return response
+
+    def _read(self, session_id: Hashable) -> Tuple[int, Optional[bytes], List[str]]:
+        generation, snapshot = 0, None
+        try:
+            with open(self._path(session_id, ".snap"), "rb") as f:
+                line, _, snapshot = f.read().partition(b"\n")
+                generation = int(line)
+        except FileNotFoundError:
+            pass
+        try:
+            with open(self._path(session_id, f".{generation}.log"), encoding="ascii") as log:
+                inputs = log.read().splitlines()
+        except FileNotFoundError:
+            inputs = []
+        return generation, snapshot, inputs
+
+    def _rebuild(self, session_id: Hashable) -> Optional[SessionState]:
+        generation, snapshot, inputs = self._read(session_id)
+        self._logs[session_id] = (generation, len(inputs))
+        if snapshot is None and not inputs:
+            return None
+        state = self.hot.new_state(snapshot or None)
+        for text in inputs:
+            self.eliza.response_list(text, state, filtered=True)
+        self.replayed += len(inputs)
+        return state
+
+    def _evicted(self, session_id: Hashable, state: SessionState, reason: str) -> None:
+        # the journal already has everything
+        self._logs.pop(session_id, None)
+
+    def compact(self, session_id: Hashable) -> None:
+        """
+        Write the state of session_id as a snapshot and start its journal again.
+        """
+        state = self.hot.get(session_id)
+        generation, _ = self._logs[session_id]
+        snap = self._path(session_id, ".snap")
+        with open(snap + ".tmp", "wb") as f:
+            f.write(b"%d\n" % (generation + 1) + encode_session(state))
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(snap + ".tmp", snap)
+        try:
+            os.remove(self._path(session_id, f".{generation}.log"))
+        except FileNotFoundError:
+            pass
+        self._logs[session_id] = (generation + 1, 0)
+        self.compactions += 1
+
+    def replay(self, session_id: Hashable, tracer=None) -> List[Tuple[str, str]]:
+        """
+        Replay the journal of session_id from its last snapshot, without changing the session, e.g. to see
+        why a conversation went the way it did.
+        :param tracer: If given, set on the Eliza for the replay, so it records each response.
+        :return: (input, response) for each entry in the journal.
+        """
+        _, snapshot, inputs = self._read(session_id)
+        state = self.hot.new_state(snapshot or None)
+        old_tracer = self.eliza.trace
+        if tracer is not None:
+            self.eliza.set_tracer(tracer)
+        try:
+            return [(text, self.eliza.response(text, state, filtered=True)) for text in inputs]
+        finally:
+            self.eliza.trace = old_tracer
+
+    def drop(self, session_id: Hashable) -> None:
+        """
+        End the conversation session_id and remove its journal.
+        """
+        self.hot.drop(session_id)
+        generation, _, _ = self._read(session_id)
+        for suffix in (".snap", f".{generation}.log"):
+            try:
+                os.remove(self._path(session_id, suffix))
+            except FileNotFoundError:
+                pass
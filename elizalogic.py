@@ -1,10 +1,15 @@
-from abc import abstractmethod, ABC
-from typing import Tuple, Dict, List
+from __future__ import annotations
 
+from abc import abstractmethod, ABC
+from collections import OrderedDict, deque
 from elizaconstant import TRACE_PREFIX, TagMap, SPECIAL_RULE_NONE, RuleMap
 from elizaencoding import last_chunk_as_bcd, hash
 from elizautil import reassemble_from_rule, eliza_specific_join, slip_match
 
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Iterable, Tuple, Dict, List, Optional
+
 
 def match_func(tags, pattern, words) -> Tuple[bool, List[str]]:
     """
@@ -25,7 +30,12 @@ class RuleBase:
 
     def add_transformation_rule(self, decomposition: List[str], reassembly_rules: List[List[str]]):
         """Add a transformation rule associated with this rule."""
-        self.transformations.append(Transform(decomposition, reassembly_rules))
+        # the identity of a transformation is its keyword plus its decomposition pattern, so that it
+        # can be found again in a recompiled script. A repeated pattern is told apart by its occurrence.
+        pattern = ' '.join(decomposition)
+        occurrence = sum(1 for t in self.transformations if t.key[1] == pattern)
+        key = (self.keyword, pattern, occurrence)
+        self.transformations.append(Transform(decomposition, reassembly_rules, key))
 
     def word_substitute(self, word: str) -> str:
         """Apply word substitution if applicable."""
@@ -68,8 +78,18 @@ class RuleKeyword(RuleBase):
     def has_transformation(self) -> bool:
         return (len(self.transformations) > 0) or (len(self.link_keyword) > 0)
 
-    def apply_transformation(self, words: List[str], tags: TagMap, link_keyword: str) -> Tuple[str, List[str], str]:
-        self.trace_begin(words)
+    def apply_transformation(self, words: List[str], tags: TagMap, link_keyword: str,
+                             cursors: Optional[Dict[tuple, int]] = None,
+                             traced: bool = True) -> Tuple[str, List[str], str]:
+        """
+        Apply the first matching decomposition rule to words.
+        :param cursors: The conversation's reassembly positions keyed by Transform.key. Only positions other than 0
+                        are stored. If None, the position kept on each Transform is used instead.
+        :param traced: Record what was done in self.trace. With cursors given and traced False the rule is not
+                       changed at all, so it may be applied on several threads at once.
+        """
+        if traced:
+            self.trace_begin(words)
 
         constituents = []
         rule = None
@@ -84,19 +104,35 @@ class RuleKeyword(RuleBase):
 
         if rule is None:
             if not self.link_keyword:
-                self.trace_nomatch()
+                if traced:
+                    self.trace_nomatch()
                 return "inapplicable", words, link_keyword  # [page 39 (f)] should not happen?
-            self.trace_reference(link_keyword)
+            if traced:
+                self.trace_reference(link_keyword)
             link_keyword = self.link_keyword
             return "linkkey", words, link_keyword
-        self.trace_decomp(rule.decomposition, constituents)
-
-        reassembly_rule = rule.reassembly_rules[rule.next_reassembly_rule]
-        self.trace_reassembly(reassembly_rule)
+        if traced:
+            self.trace_decomp(rule.decomposition, constituents)
 
-        rule.next_reassembly_rule = (rule.next_reassembly_rule + 1)
-        if rule.next_reassembly_rule == len(rule.reassembly_rules):
-            rule.next_reassembly_rule = 0
+        if cursors is None:
+            cursor = rule.next_reassembly_rule
+        else:
+            cursor = cursors.get(rule.key, 0)
+            if cursor >= len(rule.reassembly_rules):
+                cursor = 0
+        reassembly_rule = rule.reassembly_rules[cursor]
+        if traced:
+            self.trace_reassembly(reassembly_rule)
+
+        cursor += 1
+        if cursor == len(rule.reassembly_rules):
+            cursor = 0
+        if cursors is None:
+            rule.next_reassembly_rule = cursor
+        elif cursor:
+            cursors[rule.key] = cursor
+        else:
+            cursors.pop(rule.key, None)
 
         if len(reassembly_rule) == 1 and reassembly_rule[0] == "NEWKEY":
             return "newkey", words, link_keyword
@@ -172,17 +208,135 @@ class RuleKeyword(RuleBase):
         self.trace += f"{TRACE_PREFIX}selected reassemble rule: {' '.join(r)}\n"
 
 
+# what MemoryQueue.append() does when the queue is full
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+# the bound the serving layers (SessionManager and the servers) put on each conversation's MEMORY queue
+DEFAULT_MAX_MEMORIES = 32
+
+# one copy of each MEMORY string, shared by every queue; the least recently used of them is forgotten beyond
+# _INTERN_LIMIT strings. Each step is a single OrderedDict call, so threads need no lock.
+_interned: "OrderedDict[str, str]" = OrderedDict()
+_INTERN_LIMIT = 65536
+
+
+def _intern(memory: str) -> str:
+    interned = _interned.get(memory)
+    if interned is None:
+        _interned[memory] = memory
+        while len(_interned) > _INTERN_LIMIT:
+            try:
+                _interned.popitem(last=False)
+            except KeyError:
+                break
+        return memory
+    try:
+        _interned.move_to_end(memory)
+    except KeyError:
+        pass  # forgotten meanwhile by another thread
+    return interned
+
+
+class MemoryQueue:
+    """
+        The MEMORY queue: memories are added at the back and recalled from the front. JW's queue has no bound,
+        and neither has this one unless maxlen is given: then it holds at most maxlen memories and, when full,
+        drops either the oldest memory or the one being added, according to policy. Memory strings are interned, so the same memory in many conversations is
+        held once.
+    """
+    __slots__ = ("_items", "maxlen", "policy", "dropped")
+
+    # totals over every queue; approximate when responses are made on several threads at once
+    appended_total = 0
+    dropped_total = 0
+    depth_high_water = 0
+
+    def __init__(self, memories: Iterable[str] = (), maxlen: Optional[int] = None, policy: str = DROP_OLDEST):
+        if policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"unknown MEMORY queue policy {policy!r}")
+        if maxlen is not None and maxlen < 1:
+            raise ValueError("maxlen must be at least 1")
+        self._items = deque()
+        self.maxlen = maxlen
+        self.policy = policy
+        self.dropped = 0
+        for memory in memories:
+            self.append(memory)
+
+    def append(self, memory: str) -> None:
+        memory = _intern(memory)
+        cls = MemoryQueue
+        cls.appended_total += 1
+        if self.maxlen is not None and len(self._items) >= self.maxlen:
+            self.dropped += 1
+            cls.dropped_total += 1
+            if self.policy == DROP_NEWEST:
+                return
+            self._items.popleft()
+        self._items.append(memory)
+        if len(self._items) > cls.depth_high_water:
+            cls.depth_high_water = len(self._items)
+
+    def popleft(self) -> str:
+        return self._items.popleft()
+
+    def pop(self, index: int = -1) -> str:
+        return self._items.popleft() if index == 0 else self._items.pop() if index == -1 else self._pop_at(index)
+
+    def _pop_at(self, index: int) -> str:
+        memory = self._items[index]
+        del self._items[index]
+        return memory
+
+    def clear(self) -> None:
+        self._items.clear()
+
+    def copy(self) -> "MemoryQueue":
+        """
+        A queue with the same memories, without counting them again in the totals.
+        """
+        queue = MemoryQueue((), self.maxlen, self.policy)
+        queue._items = deque(self._items)
+        queue.dropped = self.dropped
+        return queue
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __getitem__(self, index: int) -> str:
+        return self._items[index]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (MemoryQueue, list, tuple, deque)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"MemoryQueue({list(self._items)!r}, maxlen={self.maxlen}, policy={self.policy!r})"
+
+    @classmethod
+    def stats(cls) -> Dict[str, int]:
+        return {"appended": cls.appended_total, "dropped": cls.dropped_total,
+                "depth_high_water": cls.depth_high_water, "interned": len(_interned)}
+
+
 class RuleMemory(RuleBase):
 
     def __init__(self, keyword: str = ""):
         super().__init__(keyword, "", 0)
-        self.memories: List[str] = []
+        self.memories = MemoryQueue()
         self.trace = ""
         self._activity = False
 
-    def create_memory(self, keyword: str, words: List[str], tags: Dict[str, List[str]]):
+    def create_memory(self, keyword: str, words: List[str], tags: Dict[str, List[str]],
+                      memories: Optional[List[str]] = None, traced: bool = True):
         if keyword != self.keyword:
             return
+        if memories is None:
+            memories = self.memories
 
         # // JW says rules are selected at random [page 41 (f)]
         # // But the ELIZA code shows that rules are actually selected via a HASH
@@ -198,17 +352,20 @@ class RuleMemory(RuleBase):
         reassembly_rule = transformation.reassembly_rules[0]
         assmbl = reassemble_from_rule(reassembly_rule, mat)
         new_memory = eliza_specific_join(assmbl)
-        self.trace += f"{TRACE_PREFIX}new memory: {new_memory}\n"
-        self.memories.append(new_memory)
+        if traced:
+            self.trace += f"{TRACE_PREFIX}new memory: {new_memory}\n"
+        memories.append(new_memory)
 
     def is_valid(self) -> bool:
         return len(self.keyword) or self.memory_exists()
 
-    def memory_exists(self) -> bool:
-        return len(self.memories) > 0
+    def memory_exists(self, memories: Optional[List[str]] = None) -> bool:
+        return len(self.memories if memories is None else memories) > 0
 
-    def recall_memory(self) -> str:
-        return self.memories.pop(0) if self.memory_exists else ""
+    def recall_memory(self, memories: Optional[List[str]] = None) -> str:
+        if memories is None:
+            memories = self.memories
+        return memories.pop(0) if memories else ""
 
     def to_string(self) -> str:
         sexp = f"(MEMORY {self.keyword}"
@@ -220,11 +377,13 @@ class RuleMemory(RuleBase):
     def clear_trace(self):
         self.trace = ""
 
-    def trace_memory_stack(self) -> str:
-        if not self.memories:
+    def trace_memory_stack(self, memories: Optional[List[str]] = None) -> str:
+        if memories is None:
+            memories = self.memories
+        if not memories:
             return f"{TRACE_PREFIX}memory queue: <empty>\n"
         else:
-            return f"{TRACE_PREFIX}memory queue:\n" + "\n".join(f"{TRACE_PREFIX}  {m}" for m in self.memories)
+            return f"{TRACE_PREFIX}memory queue:\n" + "\n".join(f"{TRACE_PREFIX}  {m}" for m in memories)
 
     # the MEMORY rule must have this number of transformations
     num_transformations = 4
@@ -232,11 +391,14 @@ class RuleMemory(RuleBase):
 
 class Transform:
 
-    stringList = List[str]
-    def __init__(self, decomposition: List[str], reassembly_rules: List[stringList]):
+    if TYPE_CHECKING:
+        stringList = List[str]
+    def __init__(self, decomposition: List[str], reassembly_rules: List[stringList], key: tuple = ()):
         self.decomposition: List[str] = decomposition
         self.reassembly_rules: List[Transform.stringList] = reassembly_rules
         self.next_reassembly_rule = 0
+        # (keyword, decomposition pattern, occurrence): stays the same when the script is recompiled
+        self.key: tuple = key
 
     def __str__(self):
         return f"Transform: Decomposition={self.decomposition}, Reassembly Rules={self.reassembly_rules},\
@@ -455,3 +617,17 @@ class Script:
         self.rules: Dict[str, RuleKeyword] = {}
         # the one and only special case MEMORY rule.
         self.mem_rule: RuleMemory = RuleMemory()
+
+    def find_transform(self, key: tuple) -> Optional[Transform]:
+        """
+            Returns the keyword transformation with the given Transform.key, or None if this script has no such
+            decomposition rule.
+        """
+        rule = self.rules.get(key[0]) if key else None
+        if rule is None:
+            return None
+        for transform in rule.transformations:
+            if transform.key == key:
+                return transform
+        return None
+
@@ -0,0 +1,327 @@
+"""
+A table of conversations in a memory-mapped file, laid out in fixed-size records, so that any process with
+the file mapped can carry on any conversation: there is nothing to serialise and no need to send a session
+back to the worker that last had it. Each record is locked while a response is made with it, with a POSIX
+record lock on its bytes (between processes) and a lock striped by record (between threads).
+
+The file is
+
+    header          HEADER_SIZE bytes, see _HEADER
+    records         capacity records of record_size bytes:
+                        state (free, in use, deleted), LIMIT, MEMORY ring head and count     4 bytes
+                        session id digest                                                   16 bytes
+                        reassembly positions, one byte per decomposition rule of the script
+                        MEMORY ring, memory_slots string ids (uint32), aligned to 4 bytes
+    string index    index_slots uint32 string ids, open addressed by crc32 of the string
+    string heap     heap_size bytes of (uint32 length, UTF-8 text); a string id is its offset here
+
+Records are found by open addressing on the digest of the session id. MEMORY strings are interned in the
+heap, which is append-only, so a memory said in many conversations is stored once. The file is sized for
+the whole heap up front but is sparse, so only the pages used take up space.
+
+The positions are kept by the decomposition rule's place in the compiled script, so a table belongs to one
+script; its fingerprint is in the header and opening the table with a different script is an error.
+
+POSIX only (fcntl).
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Dict, Hashable, Iterator, List, Optional
+
+from elizalogic import Script
+from elizasession import transform_id
+
+_MAGIC = 0x544D5A45  # "EZMT"
+_VERSION = 1
+_HEADER = struct.Struct("<IIIIIIIIQQQQ")  # magic, version, capacity, transforms, memory_slots, record_size,
+#                                           fingerprint, index_slots, records, index, heap offsets, heap_size
+_HEAP_USED = _HEADER.size  # uint64, changed under the header lock
+HEADER_SIZE = 4096
+
+_FREE, _USED, _DELETED = 0, 1, 2
+_STATE, _LIMIT, _HEAD, _COUNT, _DIGEST = 0, 1, 2, 3, 4
+_CURSORS = 20
+_LOCK_STRIPES = 64
+
+
+def script_transforms(script: Script) -> List[tuple]:
+    """
+    The Transform.key of every decomposition rule in script, in the order the table stores their positions.
+    """
+    return [transform.key for rule in script.rules.values() for transform in rule.transformations]
+
+
+def _fingerprint(keys: List[tuple]) -> int:
+    return zlib.crc32(struct.pack(f"<{len(keys)}I", *(transform_id(key) for key in keys)))
+
+
+class MappedCursors:
+    """
+        The reassembly positions in one record, as the dict SessionState.cursors would be.
+    """
+    def __init__(self, table: "MappedSessionTable", base: int):
+        self._buf = table.buf
+        self._index = table.transform_index
+        self._keys = table.transforms
+        self._base = base + _CURSORS
+
+    def get(self, key: tuple, default: int = 0) -> int:
+        i = self._index.get(key)
+        value = self._buf[self._base + i] if i is not None else 0
+        return value or default
+
+    def __getitem__(self, key: tuple) -> int:
+        value = self.get(key)
+        if not value:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: tuple, value: int) -> None:
+        self._buf[self._base + self._index[key]] = value
+
+    def pop(self, key: tuple, default=None):
+        i = self._index.get(key)
+        if i is None or not self._buf[self._base + i]:
+            return default
+        value = self._buf[self._base + i]
+        self._buf[self._base + i] = 0
+        return value
+
+    def items(self):
+        buf, base = self._buf, self._base
+        return [(key, buf[base + i]) for i, key in enumerate(self._keys) if buf[base + i]]
+
+    def __iter__(self):
+        return iter([key for key, _ in self.items()])
+
+    def __len__(self) -> int:
+        return len(self.items())
+
+
+class MappedMemories:
+    """
+        The MEMORY queue in one record, as the list SessionState.memories would be. It holds at most
+        memory_slots memories; when full, the oldest is dropped to make room.
+    """
+    def __init__(self, table: "MappedSessionTable", base: int):
+        self._table = table
+        self._buf = table.buf
+        self._rec = base
+        self._ring = base + table.ring_offset
+        self._slots = table.memory_slots
+
+    def _slot(self, n: int) -> int:
+        return self._ring + 4 * ((self._buf[self._rec + _HEAD] + n) % self._slots)
+
+    def __len__(self) -> int:
+        return self._buf[self._rec + _COUNT]
+
+    def __iter__(self) -> Iterator[str]:
+        for n in range(len(self)):
+            yield self._table.string(struct.unpack_from("<I", self._buf, self._slot(n))[0])
+
+    def append(self, memory: str) -> None:
+        count = len(self)
+        if count == self._slots:
+            self._buf[self._rec + _HEAD] = (self._buf[self._rec + _HEAD] + 1) % self._slots
+            count -= 1
+        struct.pack_into("<I", self._buf, self._slot(count), self._table.intern(memory))
+        self._buf[self._rec + _COUNT] = count + 1
+
+    def pop(self, index: int = -1) -> str:
+        count = len(self)
+        if not count:
+            raise IndexError("pop from empty MEMORY queue")
+        if index != 0:
+            raise ValueError("the MEMORY queue is only taken from the front")
+        memory = self._table.string(struct.unpack_from("<I", self._buf, self._slot(0))[0])
+        self._buf[self._rec + _HEAD] = (self._buf[self._rec + _HEAD] + 1) % self._slots
+        self._buf[self._rec + _COUNT] = count - 1
+        return memory
+
+
+class MappedSession:
+    """
+        One record of a MappedSessionTable, usable by Eliza.response() wherever a SessionState is. Only valid
+        inside the MappedSessionTable.session() block that made it.
+    """
+    def __init__(self, table: "MappedSessionTable", base: int):
+        self._buf = table.buf
+        self._base = base
+        self.script = table.script
+        self.cursors = MappedCursors(table, base)
+        self.memories = MappedMemories(table, base)
+
+    @property
+    def limit(self) -> int:
+        return self._buf[self._base + _LIMIT]
+
+    @limit.setter
+    def limit(self, value: int) -> None:
+        self._buf[self._base + _LIMIT] = value
+
+    def migrate(self, script: Script) -> None:
+        if script is not self.script:
+            raise RuntimeError("a MappedSessionTable only serves the script it was made for")
+
+
+class MappedSessionTable:
+    """
+        Conversations by session id in a memory-mapped file shared by any number of processes. Make the file
+        once with create(), then open() it in each process, or create it before forking. Session ids are
+        compared by str(session_id).
+
+            table = MappedSessionTable.create(path, eliza.script)
+            with table.session(session_id) as session:
+                response = eliza.response(text, session)
+    """
+    def __init__(self, path: str, script: Script, fd: int):
+        self.path = path
+        self.script = script
+        self.transforms = script_transforms(script)
+        self.transform_index: Dict[tuple, int] = {key: i for i, key in enumerate(self.transforms)}
+        self.fd = fd
+        self.buf = mmap.mmap(fd, 0)
+        (magic, version, self.capacity, transforms, self.memory_slots, self.record_size, fingerprint,
+         self.index_slots, self.records_offset, self.index_offset, self.heap_offset,
+         self.heap_size) = _HEADER.unpack_from(self.buf, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise RuntimeError(f"{path} is not a session table, or of a different version")
+        if transforms != len(self.transforms) or fingerprint != _fingerprint(self.transforms):
+            raise RuntimeError(f"{path} was made for a different script")
+        self.ring_offset = (_CURSORS + transforms + 3) & ~3
+        self._locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+        self._heap_lock = threading.Lock()
+
+    @classmethod
+    def create(cls, path: str, script: Script, capacity: int = 65536, memory_slots: int = 16,
+               index_slots: int = 1 << 20, heap_size: int = 1 << 28) -> "MappedSessionTable":
+        """
+        Make a new, empty table file, replacing any at path.
+        :param capacity: The most sessions the table holds.
+        :param memory_slots: The longest MEMORY queue kept for a session, at most 255.
+        :param heap_size: Bytes kept for MEMORY strings; the table fails when they are used up.
+        """
+        keys = script_transforms(script)
+        if not 0 < memory_slots < 256:
+            raise ValueError("memory_slots must be 1..255")
+        for rule in script.rules.values():
+            for transform in rule.transformations:
+                if len(transform.reassembly_rules) > 255:
+                    raise ValueError(f"{rule.keyword} has a decomposition rule with over 255 reassembly rules")
+        record_size = (((_CURSORS + len(keys) + 3) & ~3) + 4 * memory_slots + 7) & ~7
+        records = HEADER_SIZE
+        index = records + capacity * record_size
+        heap = index + 4 * index_slots
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(fd, heap + heap_size)
+            header = _HEADER.pack(_MAGIC, _VERSION, capacity, len(keys), memory_slots, record_size,
+                                  _fingerprint(keys), index_slots, records, index, heap, heap_size)
+            os.pwrite(fd, header + struct.pack("<Q", 8), 0)  # no string has id 0
+            return cls(path, script, fd)
+        except BaseException:
+            os.close(fd)
+            raise
+
+    @classmethod
+    def open(cls, path: str, script: Script) -> "MappedSessionTable":
+        return cls(path, script, os.open(path, os.O_RDWR))
+
+    def close(self) -> None:
+        self.buf.close()
+        os.close(self.fd)
+
+    @contextmanager
+    def _locked(self, start: int, length: int, stripe: threading.Lock):
+        with stripe:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, length, start)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, length, start)
+
+    @contextmanager
+    def session(self, session_id: Hashable, create: bool = True) -> Iterator[Optional[MappedSession]]:
+        """
+        Lock the record of session_id, making it if need be, and yield it as a MappedSession; yields None if
+        there is no such session and create is False.
+        :raises RuntimeError: The table is full.
+        """
+        digest = hashlib.blake2b(str(session_id).encode(), digest_size=16).digest()
+        start = int.from_bytes(digest[:8], "little") % self.capacity
+        for probe in range(self.capacity):
+            slot = (start + probe) % self.capacity
+            base = self.records_offset + slot * self.record_size
+            with self._locked(base, self.record_size, self._locks[slot % _LOCK_STRIPES]):
+                state = self.buf[base + _STATE]
+                if state == _USED and self.buf[base + _DIGEST:base + _CURSORS] == digest:
+                    yield MappedSession(self, base)
+                    return
+                if state == _FREE:
+                    # the end of the probe sequence: the session is not in the table
+                    # (deleted records are not reused, so a session is always found before a free record)
+                    if not create:
+                        yield None
+                        return
+                    self.buf[base:base + self.record_size] = bytes(self.record_size)
+                    self.buf[base + _DIGEST:base + _CURSORS] = digest
+                    self.buf[base + _LIMIT] = 1
+                    self.buf[base + _STATE] = _USED
+                    yield MappedSession(self, base)
+                    return
+        if not create:
+            yield None
+            return
+        raise RuntimeError("the session table is full")
+
+    def respond(self, eliza, session_id: Hashable, text: str) -> str:
+        with self.session(session_id) as session:
+            return eliza.response(text, session)
+
+    def drop(self, session_id: Hashable) -> bool:
+        """
+        Delete session_id from the table. Its record is not reused.
+        """
+        with self.session(session_id, create=False) as session:
+            if session is None:
+                return False
+            self.buf[session._base + _STATE] = _DELETED
+            return True
+
+    def string(self, sid: int) -> str:
+        offset = self.heap_offset + sid
+        (length,) = struct.unpack_from("<I", self.buf, offset)
+        return str(self.buf[offset + 4:offset + 4 + length], "utf-8")
+
+    def intern(self, s: str) -> int:
+        """
+        The id of s in the string heap, adding it if it is not there.
+        """
+        text = s.encode()
+        h = zlib.crc32(text) % self.index_slots
+        with self._locked(0, HEADER_SIZE, self._heap_lock):
+            for probe in range(self.index_slots):
+                entry = self.index_offset + 4 * ((h + probe) % self.index_slots)
+                (sid,) = struct.unpack_from("<I", self.buf, entry)
+                if sid == 0:
+                    break
+                if self.string(sid) == s:
+                    return sid
+            else:
+                entry = None  # index full: store the string without indexing it
+            (used,) = struct.unpack_from("<Q", self.buf, _HEAP_USED)
+            if used + 4 + len(text) > self.heap_size or used + 4 + len(text) >= 1 << 32:
+                raise RuntimeError("the session table's string heap is full")
+            struct.pack_into("<I", self.buf, self.heap_offset + used, len(text))
+            self.buf[self.heap_offset + used + 4:self.heap_offset + used + 4 + len(text)] = text
+            if entry is not None:
+                struct.pack_into("<I", self.buf, entry, used)
+            struct.pack_into("<Q", self.buf, _HEAP_USED, (used + 4 + len(text) + 3) & ~3)
+            return used
@@ -0,0 +1,66 @@
+"""
+A compiled script written out as Python literals. Importing such a module only unmarshals its .pyc, so the
+script is ready without running ElizaScriptReader at all.
+
+Regenerate the built-in DOCTOR snapshot after changing DOCTOR_1966_01_CACM.py or the script reader with:
+
+    python elizaprebuilt.py
+"""
+from elizalogic import RuleKeyword, RuleMemory, Script
+
+PREBUILT_DOCTOR_MODULE = "DOCTOR_1966_01_CACM_prebuilt.py"
+
+
+def script_to_data(script: Script) -> tuple:
+    """
+    Convert a script to nested tuples of strings and ints, suitable for repr() and for script_from_data().
+    """
+    rules = tuple(
+        (rule.keyword, rule.word_substitution, rule.precedence, tuple(rule.tags), rule.link_keyword,
+         tuple((tuple(t.decomposition), tuple(tuple(r) for r in t.reassembly_rules)) for t in rule.transformations))
+        for rule in script.rules.values())
+    memory = (script.mem_rule.keyword,
+              tuple((tuple(t.decomposition), tuple(tuple(r) for r in t.reassembly_rules))
+                    for t in script.mem_rule.transformations))
+    return tuple(script.hello_message), rules, memory
+
+
+def script_from_data(data: tuple) -> Script:
+    hello_message, rules, memory = data
+    script = Script()
+    script.hello_message = list(hello_message)
+    for keyword, substitution, precedence, tags, link_keyword, transformations in rules:
+        rule = RuleKeyword(keyword, substitution, precedence, list(tags), link_keyword)
+        for decomposition, reassembly_rules in transformations:
+            rule.add_transformation_rule(list(decomposition), [list(r) for r in reassembly_rules])
+        script.rules[keyword] = rule
+    keyword, transformations = memory
+    script.mem_rule = RuleMemory(keyword)
+    for decomposition, reassembly_rules in transformations:
+        script.mem_rule.add_transformation_rule(list(decomposition), [list(r) for r in reassembly_rules])
+    return script
+
+
+def load_doctor_script() -> Script:
+    """
+    The built-in 1966 DOCTOR script, from its prebuilt snapshot.
+    """
+    from DOCTOR_1966_01_CACM_prebuilt import CACM_1966_01_DOCTOR_prebuilt
+    return script_from_data(CACM_1966_01_DOCTOR_prebuilt)
+
+
+def write_doctor_snapshot(filename: str = PREBUILT_DOCTOR_MODULE):
+    from pprint import pformat
+    from elizascript import ElizaScriptReader
+    from DOCTOR_1966_01_CACM import CACM_1966_01_DOCTOR_script
+
+    status, script = ElizaScriptReader.read_script(CACM_1966_01_DOCTOR_script)
+    with open(filename, "w") as f:
+        f.write("# Generated by elizaprebuilt.py from DOCTOR_1966_01_CACM.py -- do not edit.\n")
+        f.write("CACM_1966_01_DOCTOR_prebuilt = ")
+        f.write(pformat(script_to_data(script), width=120))
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    write_doctor_snapshot()
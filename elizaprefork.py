@@ -0,0 +1,209 @@
+import gc
+import os
+import selectors
+import signal
+import socket
+from typing import List, Optional, Tuple
+
+from eliza import Eliza
+from elizalogic import DEFAULT_MAX_MEMORIES, Script
+from elizasession import SessionState
+
+DEFAULT_PORT = 2741  # after the IBM 2741 terminal JW's users typed on
+MAX_LINE = 4096  # longest remark accepted, in bytes; a connection sending a longer one is closed
+# responses waiting to be sent, in bytes, beyond which no more remarks are read from the connection until the
+# client reads them
+MAX_OUTBUF = 65536
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """
+    Parse HOST:PORT, HOST or :PORT.
+    """
+    host, _, port = address.rpartition(":") if ":" in address else (address, "", "")
+    return host or "127.0.0.1", int(port) if port else DEFAULT_PORT
+
+
+class LineConversation:
+    """
+        One conversation over a non-blocking stream socket: ELIZA's greeting is sent on connection, then each line
+        received gets a one line response. A blank line ends the conversation, as it does at the console.
+    """
+    def __init__(self, conn: socket.socket, engine: Eliza):
+        self.conn = conn
+        self.engine = engine
+        self.session = SessionState(engine.script, DEFAULT_MAX_MEMORIES)
+        self.inbuf = bytearray()
+        self.outbuf = bytearray((engine.get_greeting() + "\n").encode())
+        self.closing = False
+
+    def on_readable(self) -> None:
+        try:
+            data = self.conn.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.closing = True
+            self.outbuf.clear()
+            return
+        self.inbuf += data
+        while not self.closing:
+            end = self.inbuf.find(b"\n")
+            if end < 0:
+                if len(self.inbuf) > MAX_LINE:
+                    self.closing = True
+                    self.outbuf.clear()
+                break
+            line = self.inbuf[:end].decode("utf-8", "replace").rstrip("\r")
+            del self.inbuf[:end + 1]
+            if not line:
+                self.closing = True
+                break
+            self.outbuf += (self.engine.response(line, self.session) + "\n").encode()
+
+    def on_writable(self) -> None:
+        try:
+            sent = self.conn.send(self.outbuf)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.closing = True
+            self.outbuf.clear()
+            return
+        del self.outbuf[:sent]
+
+    def finished(self) -> bool:
+        return self.closing and not self.outbuf
+
+
+def serve_connections(listener: socket.socket, engine: Eliza) -> None:
+    """
+    Accept connections on listener and hold a LineConversation with each, until the process is terminated.
+    Several processes may run this on the same listening socket.
+    """
+    sel = selectors.DefaultSelector()
+    listener.setblocking(False)
+    sel.register(listener, selectors.EVENT_READ, None)
+    while True:
+        for key, events in sel.select():
+            conversation: Optional[LineConversation] = key.data
+            if conversation is None:
+                try:
+                    conn, _ = listener.accept()
+                except (BlockingIOError, InterruptedError):
+                    continue  # another worker took it
+                conn.setblocking(False)
+                sel.register(conn, selectors.EVENT_READ | selectors.EVENT_WRITE, LineConversation(conn, engine))
+                continue
+
+            try:
+                if events & selectors.EVENT_READ:
+                    conversation.on_readable()
+                if events & selectors.EVENT_WRITE and conversation.outbuf:
+                    conversation.on_writable()
+            except Exception:
+                # a failure in one conversation ends that one, not every conversation on this worker
+                conversation.closing = True
+                conversation.outbuf.clear()
+            if conversation.finished():
+                sel.unregister(conversation.conn)
+                conversation.conn.close()
+            else:
+                # a client that sends without reading is not read from until it has read its responses
+                wanted = ((selectors.EVENT_READ if len(conversation.outbuf) <= MAX_OUTBUF else 0)
+                          | (selectors.EVENT_WRITE if conversation.outbuf else 0))
+                if key.events != wanted:
+                    sel.modify(conversation.conn, wanted, conversation)
+
+
+class PreforkServer:
+    """
+        Serves ELIZA conversations from several worker processes that share one compiled script. The parent
+        process prepares the script and the listening socket, freezes the garbage collector so that the objects
+        it made are never touched by a collection, then forks the workers. The workers see the script through
+        copy-on-write pages instead of each reading their own copy, and all accept on the same socket.
+
+        Needs os.fork(), so POSIX only.
+    """
+    def __init__(self, script: Script, address: Tuple[str, int] = ("127.0.0.1", DEFAULT_PORT), workers: int = 0):
+        if not hasattr(os, "fork"):
+            raise RuntimeError("pre-fork serving needs os.fork()")
+        self.engine = Eliza(script)
+        self.address = address
+        self.workers = workers or os.cpu_count() or 1
+        self.pids: List[int] = []
+        self.listener: Optional[socket.socket] = None
+        self._stopping = False
+
+    def start(self) -> Tuple[str, int]:
+        """
+        Bind the listening socket and fork the workers.
+        :return: The address being served, which has the actual port if port 0 was asked for.
+        """
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(self.address)
+        self.listener.listen(1024)
+        self.address = self.listener.getsockname()[:2]
+
+        gc.collect()
+        gc.freeze()
+        for _ in range(self.workers):
+            self.pids.append(self._fork_worker())
+        return self.address
+
+    def _fork_worker(self) -> int:
+        pid = os.fork()
+        if pid:
+            return pid
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent stops the workers
+            serve_connections(self.listener, self.engine)
+        except BaseException:
+            status = 1
+        finally:
+            os._exit(status)
+
+    def serve_forever(self) -> None:
+        """
+        Start, if not started, then wait on the workers, replacing any that exit, until stop() is called from a
+        signal handler. SIGTERM and SIGINT call stop().
+        """
+        if self.listener is None:
+            self.start()
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        signal.signal(signal.SIGINT, lambda signum, frame: self.stop())
+        while not self._stopping:
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            if pid in self.pids and not self._stopping:
+                self.pids[self.pids.index(pid)] = self._fork_worker()
+
+    def stop(self) -> None:
+        """
+        Terminate the workers and close the listening socket.
+        """
+        self._stopping = True
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in self.pids:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.pids = []
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+        gc.unfreeze()
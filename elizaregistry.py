@@ -0,0 +1,174 @@
+"""
+Many scripts hosted in one process: DOCTOR alongside customer scripts. Scripts are read on demand by name and
+kept compiled while they are being used, the least recently used being evicted beyond max_scripts. Whatever
+the scripts have in common is held once: every word list (decomposition patterns, reassembly rules, greetings)
+is shared by all the rules with the same words, and a keyword rule that is the same in several scripts is one
+object, so memory grows with the distinct content of the scripts, not their number.
+
+A conversation is pinned to the version of its script it started with: it keeps that version alive, even once
+evicted or reloaded with new text, until the conversation ends.
+"""
+import hashlib
+import os
+import sys
+import weakref
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+from eliza import Eliza
+from elizalogic import DEFAULT_MAX_MEMORIES, RuleKeyword, RuleMemory, Script
+from elizascript import ElizaScriptReader
+from elizasession import SessionState
+
+
+class _Words(list):
+    # a word list shared by the rules of every script with the same words; a list subclass only so that it
+    # can be held weakly
+    __slots__ = ("__weakref__",)
+
+
+class ScriptVersion:
+    """
+        One compiled version of a named script, with the Eliza that answers for it.
+    """
+    __slots__ = ("name", "version", "script", "engine", "__weakref__")
+
+    def __init__(self, name: str, version: str, script: Script):
+        self.name = name
+        self.version = version  # a digest of the script text
+        self.script = script
+        self.engine = Eliza(script)
+
+
+class HostedSession:
+    """
+        A conversation with one version of a named script.
+    """
+    __slots__ = ("script", "state")
+
+    def __init__(self, script: ScriptVersion):
+        self.script = script
+        self.state = SessionState(script.script, DEFAULT_MAX_MEMORIES)
+
+
+def directory_loader(directory: str, suffix: str = ".txt") -> Callable[[str], str]:
+    """
+    A loader for ScriptRegistry that reads the script called name from directory/name + suffix.
+    """
+    def load(name: str) -> str:
+        if os.sep in name or (os.altsep and os.altsep in name) or name.startswith("."):
+            raise KeyError(name)
+        try:
+            with open(os.path.join(directory, name + suffix)) as f:
+                return f.read()
+        except FileNotFoundError:
+            raise KeyError(name) from None
+    return load
+
+
+class ScriptRegistry:
+    """
+        Compiles scripts on demand from the text loader(name) returns, which raises KeyError for an unknown name.
+
+            registry = ScriptRegistry(directory_loader("scripts"))
+            session = registry.start("DOCTOR")
+            registry.respond(session, "Men are all alike.")
+
+        ElizaScriptReader's RuntimeError is raised for a script that does not compile. Scripts users upload
+        can be compiled out of process instead, with compile=elizasandbox.ScriptCompiler().compile.
+    """
+    def __init__(self, loader: Callable[[str], str], max_scripts: int = 64,
+                 compile: Optional[Callable[[str], Script]] = None):
+        self.loader = loader
+        self.compile = compile or (lambda text: ElizaScriptReader.read_script(text)[1])
+        self.max_scripts = max_scripts
+        self._scripts: "OrderedDict[str, ScriptVersion]" = OrderedDict()  # latest versions, least recent first
+        # shared content of every script still in use, by value
+        self._versions: "weakref.WeakValueDictionary[tuple, ScriptVersion]" = weakref.WeakValueDictionary()
+        self._rules: "weakref.WeakValueDictionary[tuple, RuleKeyword]" = weakref.WeakValueDictionary()
+        self._words: "weakref.WeakValueDictionary[tuple, _Words]" = weakref.WeakValueDictionary()
+        self.loads = 0
+        self.evictions = 0
+        self.rules_shared = 0
+
+    def get(self, name: str) -> ScriptVersion:
+        """
+        The current version of the script called name, compiled if it is not in the registry.
+        """
+        version = self._scripts.get(name)
+        if version is not None:
+            self._scripts.move_to_end(name)
+            return version
+        return self._load(name)
+
+    def reload(self, name: str) -> ScriptVersion:
+        """
+        Read the script called name again; conversations started from now on use the new version, if it changed.
+        """
+        self._scripts.pop(name, None)
+        return self._load(name)
+
+    def start(self, name: str) -> HostedSession:
+        """
+        Start a conversation with the current version of the script called name.
+        """
+        return HostedSession(self.get(name))
+
+    @staticmethod
+    def respond(session: HostedSession, text: str) -> str:
+        return session.script.engine.response(text, session.state)
+
+    @staticmethod
+    def greeting(session: HostedSession) -> str:
+        return session.script.engine.get_greeting()
+
+    def _load(self, name: str) -> ScriptVersion:
+        text = self.loader(name)
+        digest = hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+        version = self._versions.get((name, digest))
+        if version is None:
+            version = ScriptVersion(name, digest, self._share(self.compile(text)))
+            self._versions[(name, digest)] = version
+            self.loads += 1
+        self._scripts[name] = version
+        while len(self._scripts) > self.max_scripts:
+            self._scripts.popitem(last=False)
+            self.evictions += 1
+        return version
+
+    def _share_words(self, words) -> _Words:
+        key = tuple(words)
+        shared = self._words.get(key)
+        if shared is None:
+            shared = _Words(sys.intern(word) for word in key)
+            self._words[key] = shared
+        return shared
+
+    def _share(self, script: Script) -> Script:
+        # the script rebuilt from the content already held wherever it is the same
+        shared = Script()
+        shared.hello_message = self._share_words(script.hello_message)
+        for keyword, rule in script.rules.items():
+            key = (rule.keyword, rule.word_substitution, rule.precedence, tuple(rule.tags), rule.link_keyword,
+                   tuple((tuple(t.decomposition), tuple(map(tuple, t.reassembly_rules))) for t in rule.transformations))
+            found = self._rules.get(key)
+            if found is None:
+                found = RuleKeyword(sys.intern(rule.keyword), rule.word_substitution, rule.precedence,
+                                    self._share_words(rule.tags), rule.link_keyword)
+                for transform in rule.transformations:
+                    found.add_transformation_rule(self._share_words(transform.decomposition),
+                                                  [self._share_words(r) for r in transform.reassembly_rules])
+                self._rules[key] = found
+            else:
+                self.rules_shared += 1
+            shared.rules[found.keyword] = found
+        shared.mem_rule = RuleMemory(sys.intern(script.mem_rule.keyword))
+        for transform in script.mem_rule.transformations:
+            shared.mem_rule.add_transformation_rule(self._share_words(transform.decomposition),
+                                                    [self._share_words(r) for r in transform.reassembly_rules])
+        return shared
+
+    def stats(self) -> Dict[str, int]:
+        return {"scripts": len(self._scripts), "versions_in_use": len(self._versions), "loads": self.loads,
+                "evictions": self.evictions, "distinct_rules": len(self._rules), "rules_shared": self.rules_shared,
+                "distinct_word_lists": len(self._words)}
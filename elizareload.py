@@ -0,0 +1,62 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Optional
+
+from elizascript import ElizaScriptReader, IncrementalScriptReader
+from elizautil import collect_tags
+
+
+class ScriptReloader:
+    """
+        Replaces the script of a running Eliza without losing any conversations. The new script is read on a
+        background thread while the old one carries on answering; once it has been read without error it is
+        swapped in, and each conversation keeps its LIMIT, MEMORY queue and the reassembly positions of every
+        decomposition rule that did not change.
+    """
+    def __init__(self, eliza):
+        self.eliza = eliza
+        # successive versions of a script only compile the rules that were edited
+        self.reader = IncrementalScriptReader()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def reload(self, script_text: Any) -> str:
+        """
+        Read script_text and swap it into the Eliza instance.
+        :param script_text: Anything ElizaScriptReader.read_script() accepts.
+        :return: The status from ElizaScriptReader.read_script(). A script error raises RuntimeError and leaves
+                 the running script in place.
+        """
+        with self._lock:
+            if isinstance(script_text, str):
+                status, script = self.reader.read_script(script_text)
+                tags = self.reader.tags
+            else:
+                status, script = ElizaScriptReader.read_script(script_text)
+                tags = collect_tags(script.rules)
+            self.eliza.swap_script(script, tags)
+        return status
+
+    def reload_file(self, filename: str) -> str:
+        with open(filename) as script_file:
+            return self.reload(script_file.read())
+
+    def reload_async(self, script_text: Any) -> Future:
+        """
+        As reload(), but on a background thread. Reloads are applied in the order they were requested.
+        :return: A Future holding the status, or the RuntimeError raised for a bad script.
+        """
+        return self._submit(self.reload, script_text)
+
+    def reload_file_async(self, filename: str) -> Future:
+        return self._submit(self.reload_file, filename)
+
+    def _submit(self, fn, arg) -> Future:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="eliza-reload")
+        return self._executor.submit(fn, arg)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,294 @@
+"""
+Replays recorded conversations and checks ELIZA still gives the recorded responses: the regression gate for
+engine and script changes.
+
+    python elizareplay.py transcripts.jsonl [more.jsonl ...] [--script FILE] [--workers N]
+
+A transcript is JSONL, one exchange a line, {"session": ID, "text": PROMPT, "response": EXPECTED}, as
+main.py --batch --jsonl takes and gives; the conversations may be interleaved, and {"session": ID, "end": true}
+ends one. The corpus is streamed: conversations are spread over worker processes by session id and each
+worker is sent its exchanges in chunks, a few chunks ahead of it at most, so memory does not grow with the
+corpus.
+
+The first exchange in each conversation whose response differs is reported with the trace of how ELIZA came
+to hers; the rest of that conversation is not checked, having gone its own way. The exit status is 1 if
+anything differed, a line could not be read or a worker died before checking all it was sent. Line numbers count on through the transcripts one after another.
+"""
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+from eliza import Eliza
+from elizalogic import Script, StringTracer
+from elizaprebuilt import script_from_data, script_to_data
+from elizasession import SessionState
+from elizashard import session_slot
+
+CHUNK = 500  # exchanges sent to a worker at a time
+CHUNKS_AHEAD = 2  # chunks a worker may have waiting
+
+# (line number, session id, prompt, expected response); prompt None ends the conversation
+Exchange = Tuple[int, Hashable, Optional[str], Optional[str]]
+
+
+class _Conversation:
+    __slots__ = ("state", "exchanges", "diverged")
+
+    def __init__(self, script: Script):
+        self.state = SessionState(script)
+        self.exchanges = 0
+        self.diverged = False
+
+
+def _check(eliza: Eliza, tracer: StringTracer, conversations: Dict[Hashable, _Conversation],
+           exchanges: List[Exchange]) -> Tuple[Dict[str, int], List[dict]]:
+    # the counts for a chunk of exchanges and the divergences found in it
+    counts = {"exchanges": 0, "matched": 0, "skipped": 0, "conversations": 0}
+    divergences = []
+    for line, session_id, text, expected in exchanges:
+        if text is None:
+            conversations.pop(session_id, None)
+            continue
+        conversation = conversations.get(session_id)
+        if conversation is None:
+            conversation = conversations[session_id] = _Conversation(eliza.script)
+            counts["conversations"] += 1
+        counts["exchanges"] += 1
+        conversation.exchanges += 1
+        if conversation.diverged:
+            counts["skipped"] += 1
+            continue
+        before = conversation.state.copy()
+        try:
+            actual = eliza.response(text, conversation.state)
+        except Exception as e:
+            actual = f"{type(e).__name__}: {e}"
+        if actual == expected:
+            counts["matched"] += 1
+            continue
+        conversation.diverged = True
+        # the same exchange again from where it started, traced
+        eliza.set_tracer(tracer)
+        try:
+            eliza.response(text, before)
+            trace = tracer.text()
+        except Exception:
+            trace = ""
+        finally:
+            eliza.set_tracer(None)
+        divergences.append({"session": session_id, "line": line, "exchange": conversation.exchanges,
+                            "text": text, "expected": expected, "actual": actual, "trace": trace})
+    return counts, divergences
+
+
+def _worker(conn, script) -> None:
+    # a worker process: answers ("batch", [exchange, ...]) with ("batch", counts, divergences) and ("stop",)
+    # with ("stopped",), then exits
+    if isinstance(script, tuple):
+        script = script_from_data(script)
+    eliza = Eliza(script)
+    tracer = StringTracer()
+    conversations: Dict[Hashable, _Conversation] = {}
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message[0] == "stop":
+            conn.send(("stopped",))
+            return
+        counts, divergences = _check(eliza, tracer, conversations, message[1])
+        conn.send(("batch", counts, divergences))
+
+
+def parse_exchange(number: int, line: bytes) -> Optional[Exchange]:
+    """
+    The exchange on a transcript line, or None for a blank line.
+    :raises ValueError: The line is not an exchange.
+    """
+    if not line.strip():
+        return None
+    record = json.loads(line)
+    if not isinstance(record, dict) or "session" not in record:
+        raise ValueError("expected {\"session\": ID, \"text\": PROMPT, \"response\": EXPECTED}")
+    session_id = record["session"]
+    try:
+        hash(session_id)
+    except TypeError:
+        raise ValueError(f"session ID {session_id!r} is not a string or number") from None
+    if record.get("end"):
+        return number, session_id, None, None
+    text, expected = record.get("text"), record.get("response")
+    if not isinstance(text, str) or not isinstance(expected, str):
+        raise ValueError("expected {\"session\": ID, \"text\": PROMPT, \"response\": EXPECTED}")
+    return number, session_id, text, expected
+
+
+def replay(script: Script, lines: Iterable[bytes], workers: int = 0, chunk: int = CHUNK) -> Dict[str, object]:
+    """
+    Replay the transcript lines against script on workers processes (0 for one per core).
+    :return: Counts of conversations, exchanges, exchanges matched and exchanges skipped after a divergence;
+             "divergences", the first divergence in each conversation that diverged in the order of the
+             transcript, each {"session", "line", "exchange", "text", "expected", "actual", "trace"}; and
+             "bad_lines", each {"line", "error"}.
+    :raises RuntimeError: A worker exited before answering every exchange it was sent.
+    """
+    workers = workers or os.cpu_count() or 1
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+    script_arg = script if context.get_start_method() == "fork" else script_to_data(script)
+
+    report: Dict[str, object] = {"conversations": 0, "exchanges": 0, "matched": 0, "skipped": 0}
+    divergences: List[dict] = []
+    bad_lines: List[dict] = []
+    lock = threading.Lock()
+
+    def receive(worker: int, conn, ahead: threading.Semaphore) -> None:
+        # the worker's answers are read as they come, so it is never held up sending one while it is being
+        # sent the next chunk
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            if message[0] == "stopped":
+                stopped[worker] = True  # it has answered every chunk it was sent
+                return
+            _, counts, found = message
+            with lock:
+                for key, count in counts.items():
+                    report[key] += count
+                divergences.extend(found)
+            ahead.release()
+
+    conns, processes, receivers, ahead = [], [], [], []
+    stopped = [False] * workers
+    for _ in range(workers):
+        conn, child = context.Pipe()
+        process = context.Process(target=_worker, args=(child, script_arg), daemon=True)
+        process.start()
+        child.close()
+        conns.append(conn)
+        processes.append(process)
+        ahead.append(threading.Semaphore(CHUNKS_AHEAD))
+    # started once every worker is forked
+    for worker, (conn, semaphore) in enumerate(zip(conns, ahead)):
+        receivers.append(threading.Thread(target=receive, args=(worker, conn, semaphore), name="eliza-replay",
+                                          daemon=True))
+        receivers[-1].start()
+    pending: List[List[Exchange]] = [[] for _ in range(workers)]
+
+    def died(worker: int) -> RuntimeError:
+        processes[worker].join(1)
+        return RuntimeError(f"replay worker exited with code {processes[worker].exitcode}")
+
+    def send(worker: int) -> None:
+        while not ahead[worker].acquire(timeout=1):
+            if not processes[worker].is_alive():
+                raise died(worker)
+        try:
+            conns[worker].send(("batch", pending[worker]))
+        except OSError:  # BrokenPipeError: the worker has gone
+            raise died(worker) from None
+        pending[worker] = []
+
+    try:
+        for number, line in enumerate(lines, 1):
+            try:
+                exchange = parse_exchange(number, line)
+            except ValueError as e:  # json.JSONDecodeError is a ValueError
+                bad_lines.append({"line": number, "error": str(e)})
+                continue
+            if exchange is None:
+                continue
+            worker = session_slot(exchange[1]) % workers
+            pending[worker].append(exchange)
+            if len(pending[worker]) >= chunk:
+                send(worker)
+        for worker in range(workers):
+            if pending[worker]:
+                send(worker)
+    finally:
+        for conn in conns:
+            try:
+                conn.send(("stop",))
+            except OSError:
+                pass
+        for receiver in receivers:
+            receiver.join()
+        for conn, process in zip(conns, processes):
+            conn.close()
+            process.join(5)
+            if process.is_alive():
+                process.kill()
+    for worker, process in enumerate(processes):
+        if not stopped[worker] or process.exitcode:
+            raise RuntimeError(f"replay worker exited with code {process.exitcode} before checking all it was sent")
+    divergences.sort(key=lambda divergence: divergence["line"])
+    report["divergences"] = divergences
+    report["bad_lines"] = bad_lines
+    return report
+
+
+def print_divergence(divergence: dict, out=None) -> None:
+    out = out or sys.stdout
+    print(f"line {divergence['line']}: session {divergence['session']!r}, exchange {divergence['exchange']}", file=out)
+    print(f"  prompt:   {divergence['text']}", file=out)
+    print(f"  expected: {divergence['expected']}", file=out)
+    print(f"  actual:   {divergence['actual']}", file=out)
+    for trace_line in divergence["trace"].splitlines():
+        print(f"    {trace_line}", file=out)
+
+
+def main(argv=None) -> int:
+    import argparse
+    from elizabatch import open_input
+    parser = argparse.ArgumentParser(description="Replay recorded ELIZA conversations and report where they differ")
+    parser.add_argument("transcripts", nargs="+", metavar="TRANSCRIPT", help="JSONL transcript; - for stdin")
+    parser.add_argument("--script", metavar="FILE", help="script to replay against; the 1966 DOCTOR script if not given")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes; one per core if not given")
+    parser.add_argument("--show", type=int, default=10, metavar="N", help="divergences to print with their traces")
+    parser.add_argument("--divergences", metavar="FILE", help="write every divergence to FILE as JSONL")
+    args = parser.parse_args(argv)
+
+    if args.script:
+        from elizascript import ElizaScriptReader
+        with open(args.script) as f:
+            _, script = ElizaScriptReader.read_script(f.read())
+    else:
+        from elizaprebuilt import load_doctor_script
+        script = load_doctor_script()
+
+    def lines():
+        for name in args.transcripts:
+            with open_input(name) as f:
+                yield from f
+
+    start = time.perf_counter()
+    try:
+        report = replay(script, lines(), args.workers)
+    except RuntimeError as e:
+        print(f"{sys.argv[0]}: {e}", file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+    divergences, bad_lines = report["divergences"], report["bad_lines"]
+    for divergence in divergences[:args.show]:
+        print_divergence(divergence)
+    for bad_line in bad_lines[:args.show]:
+        print(f"line {bad_line['line']}: {bad_line['error']}")
+    if args.divergences:
+        with open(args.divergences, "w") as f:
+            for divergence in divergences:
+                f.write(json.dumps(divergence) + "\n")
+    print(f"{report['exchanges']} exchanges in {report['conversations']} conversations in {elapsed:.1f} s: "
+          f"{report['matched']} matched, {len(divergences)} conversations diverged "
+          f"({report['skipped']} exchanges after not checked), {len(bad_lines)} lines in error")
+    return 1 if divergences or bad_lines else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,328 @@
+"""
+A binary RPC protocol for front ends on the same host, over a Unix domain socket. Every frame starts with its
+length, so neither side has to scan for delimiters, and a client may send any number of requests before
+reading the responses, which come back in the order the requests were sent.
+
+    request     uint32 length of the rest, uint32 request id, uint16 session id length, session id, remark
+    response    uint32 length of the rest, uint32 request id, uint8 status, response or error message
+
+All integers are big-endian; the session id is any bytes, the remark and response UTF-8. Status is STATUS_OK
+or STATUS_ERROR.
+"""
+import asyncio
+import queue
+import selectors
+import socket
+import struct
+from contextlib import contextmanager
+from typing import Hashable, Iterable, Iterator, List, Optional, Tuple
+
+from eliza import Eliza
+from elizaencoding import filter_bcd_bytes
+from elizalogic import Script
+from elizasession import SessionManager
+
+_REQUEST = struct.Struct(">IIH")
+_RESPONSE = struct.Struct(">IIB")
+STATUS_OK = 0
+STATUS_ERROR = 1
+MAX_FRAME = 65536  # longest frame accepted, in bytes; a connection sending a longer one is closed
+SEND_CHUNK = 65536  # bytes RpcConnection.exchange() offers the socket at a time
+
+
+class RpcProtocol(asyncio.BufferedProtocol):
+    """
+        One connection to the RPC server. Data is received straight into a buffer the protocol owns, and
+        frames are parsed where they lie through a memoryview; all the responses to the requests in one read
+        are sent with one write.
+    """
+    def __init__(self, server: "RpcServer"):
+        self.server = server
+        self.buffer = bytearray(4 * MAX_FRAME)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # first unparsed byte
+        self.end = 0  # end of received data
+        self.transport: Optional[asyncio.Transport] = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if self.end == len(self.buffer):
+            # move the incomplete frame at the end to the front
+            remaining = self.end - self.start
+            self.view[:remaining] = self.view[self.start:self.end]
+            self.start, self.end = 0, remaining
+        return self.view[self.end:]
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self.end += nbytes
+        view, pos, end = self.view, self.start, self.end
+        out = []
+        respond = self.server.respond
+        while end - pos >= 4:
+            (length,) = struct.unpack_from(">I", view, pos)
+            if length > MAX_FRAME - 4 or length < _REQUEST.size - 4:
+                self.transport.close()
+                return
+            if end - pos < 4 + length:
+                break
+            _, request_id, id_length = _REQUEST.unpack_from(view, pos)
+            body = pos + _REQUEST.size
+            frame_end = pos + 4 + length
+            if body + id_length > frame_end:
+                status, text = STATUS_ERROR, b"session id overruns frame"
+            else:
+                status, text = respond(view[body:body + id_length], view[body + id_length:frame_end])
+            out.append(_RESPONSE.pack(_RESPONSE.size - 4 + len(text), request_id, status))
+            out.append(text)
+            pos = frame_end
+        if pos == end:
+            pos = end = 0
+        self.start, self.end = pos, end
+        if out:
+            self.transport.write(b"".join(out))
+
+    def pause_writing(self) -> None:
+        # the client is not reading its responses: stop reading its requests until it does
+        self.transport.pause_reading()
+
+    def resume_writing(self) -> None:
+        self.transport.resume_reading()
+
+
+class RpcServer:
+    """
+        Serves the RPC protocol on a Unix domain socket, keeping conversations by session id in a
+        SessionManager.
+    """
+    def __init__(self, script: Script, path: str, max_sessions: int = 100000, ttl: Optional[float] = 3600):
+        self.engine = Eliza(script)
+        self.sessions = SessionManager(self.engine, max_sessions, ttl)
+        self.path = path
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.requests = 0
+
+    def respond(self, session_id: memoryview, remark: memoryview) -> Tuple[int, bytes]:
+        self.requests += 1
+        try:
+            text = filter_bcd_bytes(remark)
+            session = self.sessions.get(bytes(session_id))
+            return STATUS_OK, self.engine.response(text, session, filtered=True).encode()
+        except Exception as e:
+            return STATUS_ERROR, str(e).encode()
+
+    async def start(self) -> None:
+        self.server = await asyncio.get_running_loop().create_unix_server(lambda: RpcProtocol(self), self.path)
+
+    async def serve_forever(self) -> None:
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+
+def serve(script: Script, path: str, announce=print) -> None:
+    async def run():
+        server = RpcServer(script, path)
+        await server.start()
+        announce(f"Serving on {path}")
+        await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+def _session_bytes(session_id: Hashable) -> bytes:
+    return session_id if isinstance(session_id, bytes) else str(session_id).encode()
+
+
+class RpcConnection:
+    """
+        One blocking connection to an RpcServer. Responses are read into a reusable buffer.
+    """
+    def __init__(self, path: str):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.buffer = bytearray(MAX_FRAME)
+        self.view = memoryview(self.buffer)
+        self.start = self.end = 0
+        self.next_id = 0
+
+    def send(self, requests: Iterable[Tuple[Hashable, str]]) -> List[int]:
+        """
+        Send requests without waiting for their responses. The server stops reading requests while its
+        responses are not being read, so a batch whose responses overflow the socket buffers must be sent
+        with exchange() instead.
+        :return: The request ids, in order.
+        """
+        data, ids = self._frames(requests)
+        self.sock.sendall(data)
+        return ids
+
+    def exchange(self, requests: Iterable[Tuple[Hashable, str]]) -> List[str]:
+        """
+        Send requests and read their responses at the same time, so that however long the batch neither end
+        fills its socket buffer while the other waits on it.
+        :return: The responses, in order.
+        :raises RuntimeError: The server could not answer a request.
+        """
+        data, ids = self._frames(requests)
+        view = memoryview(data)
+        responses: List[str] = []
+
+        def take() -> None:
+            while True:
+                response = self._parse()
+                if response is None:
+                    return
+                request_id, text = response
+                expected = ids[len(responses)]
+                if request_id != expected:
+                    raise RuntimeError(f"response {request_id} out of order, expected {expected}")
+                responses.append(text)
+
+        sent = 0
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.sock, selectors.EVENT_READ | selectors.EVENT_WRITE)
+            self.sock.setblocking(False)
+            try:
+                while sent < len(data):
+                    for _, events in selector.select():
+                        if events & selectors.EVENT_WRITE:
+                            try:
+                                sent += self.sock.send(view[sent:sent + SEND_CHUNK])
+                            except BlockingIOError:
+                                pass
+                        if events & selectors.EVENT_READ:
+                            try:
+                                self._fill()
+                            except BlockingIOError:
+                                pass
+                            take()
+            finally:
+                view.release()
+                self.sock.setblocking(True)
+        while len(responses) < len(ids):
+            self._fill()
+            take()
+        return responses
+
+    def _frames(self, requests: Iterable[Tuple[Hashable, str]]) -> Tuple[bytes, List[int]]:
+        frames, ids = [], []
+        for session_id, remark in requests:
+            session = _session_bytes(session_id)
+            text = remark.encode()
+            self.next_id = (self.next_id + 1) & 0xFFFFFFFF
+            frames.append(_REQUEST.pack(_REQUEST.size - 4 + len(session) + len(text), self.next_id, len(session)))
+            frames.append(session)
+            frames.append(text)
+            ids.append(self.next_id)
+        return b"".join(frames), ids
+
+    def _fill(self) -> None:
+        if self.start:
+            remaining = self.end - self.start
+            self.view[:remaining] = self.view[self.start:self.end]
+            self.start, self.end = 0, remaining
+        if self.end == len(self.buffer):
+            # a response longer than the buffer
+            self.view.release()
+            self.buffer.extend(bytes(len(self.buffer)))
+            self.view = memoryview(self.buffer)
+        n = self.sock.recv_into(self.view[self.end:])
+        if not n:
+            raise ConnectionError("the ELIZA RPC server closed the connection")
+        self.end += n
+
+    def receive(self) -> Tuple[int, str]:
+        """
+        The next response, as (request id, text).
+        :raises RuntimeError: The server could not answer the request.
+        """
+        while True:
+            response = self._parse()
+            if response is not None:
+                return response
+            self._fill()
+
+    def _parse(self) -> Optional[Tuple[int, str]]:
+        # the response at the start of the buffer, or None if it has not all been received
+        if self.end - self.start < _RESPONSE.size:
+            return None
+        length, request_id, status = _RESPONSE.unpack_from(self.view, self.start)
+        if self.end - self.start < 4 + length:
+            return None
+        text = str(self.view[self.start + _RESPONSE.size:self.start + 4 + length], "utf-8")
+        self.start += 4 + length
+        if self.start == self.end:
+            self.start = self.end = 0
+        if status != STATUS_OK:
+            raise RuntimeError(text)
+        return request_id, text
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+class RpcClient:
+    """
+        A pool of up to pool_size connections to an RpcServer, safe to share between threads.
+
+            client = RpcClient("/tmp/eliza.sock")
+            client.respond("user 1", "Men are all alike.")
+            client.respond_many([("user 1", "..."), ("user 2", "...")])  # pipelined on one connection
+    """
+    def __init__(self, path: str, pool_size: int = 4):
+        self.path = path
+        self._idle: "queue.LifoQueue[RpcConnection]" = queue.LifoQueue()
+        self._slots = queue.Queue()
+        for _ in range(pool_size):
+            self._slots.put(None)
+
+    @contextmanager
+    def connection(self) -> Iterator[RpcConnection]:
+        self._slots.get()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+        try:
+            if conn is None:
+                conn = RpcConnection(self.path)
+            yield conn
+        except BaseException:
+            # the connection may be part way through a frame
+            if conn is not None:
+                conn.close()
+            conn = None
+            raise
+        finally:
+            if conn is not None:
+                self._idle.put(conn)
+            self._slots.put(None)
+
+    def respond(self, session_id: Hashable, remark: str) -> str:
+        return self.respond_many([(session_id, remark)])[0]
+
+    def respond_many(self, requests: Iterable[Tuple[Hashable, str]]) -> List[str]:
+        """
+        Pipeline the requests on one connection and return the responses in order.
+        """
+        with self.connection() as conn:
+            return conn.exchange(requests)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,187 @@
+"""
+Scripts uploaded by users are compiled in a separate, short-lived process with limits on its CPU time and
+memory and a timeout, so a pathological script (deep nesting, huge DLISTs) costs the serving process nothing
+but a thread waiting on a pipe. Workers are forked from a fork server, not the serving process, so as with
+any multiprocessing start method but fork, the main module must be importable without side effects (guarded by
+if __name__ == "__main__"). The compiled script comes back as script_to_data() tuples.
+
+A script whose keyword rules link to one another in a cycle (=KEYWORD references, PRE rules or the keyword's
+own link) is rejected too, as ELIZA could follow the cycle forever while responding.
+"""
+import pickle
+import signal
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+from elizalogic import Script
+from elizaprebuilt import script_from_data, script_to_data
+from elizascript import ElizaScriptReader
+
+try:
+    import resource
+except ImportError:  # not on Windows: there is only the timeout
+    resource = None
+
+DEFAULT_CPU_SECONDS = 5
+DEFAULT_MEMORY = 256 * 1024 * 1024  # bytes a compile may allocate
+DEFAULT_TIMEOUT = 10.0  # seconds
+MAX_RESULT = 64 * 1024 * 1024  # longest compiled script accepted back, in bytes
+
+
+class ScriptCompileError(RuntimeError):
+    """
+    The script could not be compiled; the message is ElizaScriptReader's or says which limit was reached.
+    """
+
+
+def link_cycle(script: Script) -> Optional[List[str]]:
+    """
+    A cycle of keywords that link to one another, e.g. ["A", "B", "A"], or None if there is none.
+    """
+    links: Dict[str, List[str]] = {}
+    for keyword, rule in script.rules.items():
+        targets = [rule.link_keyword] if rule.link_keyword else []
+        for transform in rule.transformations:
+            for reassembly in transform.reassembly_rules:
+                if len(reassembly) == 2 and reassembly[0] == "=":
+                    targets.append(reassembly[1])
+                elif reassembly and reassembly[0] == "(":
+                    targets.append(reassembly[-3])  # (PRE (reassembly) (=KEYWORD))
+        links[keyword] = targets
+
+    # depth first, without recursion, which a long chain of links would exhaust
+    state: Dict[str, int] = {}  # 1 while on the path, 2 when done
+    for start in links:
+        if start in state:
+            continue
+        path = [start]
+        stack = [iter(links[start])]
+        state[start] = 1
+        while stack:
+            target = next(stack[-1], None)
+            if target is None:
+                state[path.pop()] = 2
+                stack.pop()
+            elif state.get(target) == 1:
+                return path[path.index(target):] + [target]
+            elif target not in state and target in links:
+                state[target] = 1
+                path.append(target)
+                stack.append(iter(links[target]))
+    return None
+
+
+def _limit(cpu_seconds: Optional[int], memory: Optional[int]) -> None:
+    if resource is None:
+        return
+    if cpu_seconds:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    if memory:
+        # on top of what the process, a fresh fork of the fork server, already has mapped
+        try:
+            with open("/proc/self/statm") as f:
+                mapped = int(f.read().split()[0]) * resource.getpagesize()
+        except OSError:
+            mapped = 0
+        resource.setrlimit(resource.RLIMIT_AS, (mapped + memory, mapped + memory))
+
+
+def _compile_worker(conn, text: str, cpu_seconds: Optional[int], memory: Optional[int],
+                    allow_link_cycles: bool) -> None:
+    _limit(cpu_seconds, memory)
+    try:
+        _, script = ElizaScriptReader.read_script(text)
+        cycle = None if allow_link_cycles else link_cycle(script)
+        if cycle:
+            result = ("error", f"Script error: keywords link in a cycle: {' -> '.join(cycle)}")
+        else:
+            result = ("ok", script_to_data(script))
+    except RuntimeError as e:
+        result = ("error", str(e))
+    except RecursionError:
+        result = ("error", "Script error: nested too deeply")
+    except MemoryError:
+        result = ("error", "Script error: too large to compile")
+    try:
+        data = pickle.dumps(result)
+    except MemoryError:  # the compiled script fitted, but not a copy of it
+        result = None
+        data = pickle.dumps(("error", "Script error: too large to compile"))
+    conn.send_bytes(data)
+
+
+class ScriptCompiler:
+    """
+        Compiles scripts in worker processes, at most workers at a time.
+
+            compiler = ScriptCompiler()
+            future = compiler.submit(uploaded_text)  # a Future of the Script
+            script = compiler.compile(uploaded_text)  # or wait for it
+
+        A script that cannot be compiled raises ScriptCompileError, with ElizaScriptReader's message or one saying
+        the compile ran out of CPU time (cpu_seconds), memory (memory bytes) or time (timeout seconds).
+    """
+    def __init__(self, workers: int = 2, cpu_seconds: Optional[int] = DEFAULT_CPU_SECONDS,
+                 memory: Optional[int] = DEFAULT_MEMORY, timeout: float = DEFAULT_TIMEOUT,
+                 allow_link_cycles: bool = False):
+        import multiprocessing
+        # not forked from the server, whose threads' malloc arenas would be address space to allocate from
+        # beyond the memory limit, and whose sessions a worker has no business seeing
+        methods = multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self._slots = threading.BoundedSemaphore(workers)
+        self.cpu_seconds = cpu_seconds
+        self.memory = memory
+        self.timeout = timeout
+        self.allow_link_cycles = allow_link_cycles
+        self.compiled = 0
+        self.failed = 0
+
+    def submit(self, text: str) -> Future:
+        """
+        Start compiling text.
+        :return: A Future of the Script.
+        """
+        future = Future()
+        threading.Thread(target=self._run, args=(text, future), name="eliza-compile", daemon=True).start()
+        return future
+
+    def compile(self, text: str) -> Script:
+        return self.submit(text).result()
+
+    def _run(self, text: str, future: Future) -> None:
+        with self._slots:
+            try:
+                future.set_result(self._compile(text))
+                self.compiled += 1
+            except Exception as e:
+                self.failed += 1
+                future.set_exception(e)
+
+    def _compile(self, text: str) -> Script:
+        parent, child = self._context.Pipe(duplex=False)
+        process = self._context.Process(target=_compile_worker, daemon=True,
+                                        args=(child, text, self.cpu_seconds, self.memory, self.allow_link_cycles))
+        process.start()
+        child.close()
+        try:
+            if not parent.poll(self.timeout):
+                raise ScriptCompileError(f"Script error: not compiled within {self.timeout:g} seconds")
+            try:
+                status, result = pickle.loads(parent.recv_bytes(MAX_RESULT))
+            except EOFError:
+                process.join()
+                if resource is not None and process.exitcode == -signal.SIGXCPU:
+                    raise ScriptCompileError(f"Script error: used over {self.cpu_seconds} seconds of CPU time")
+                raise ScriptCompileError(f"Script error: the compiler exited with code {process.exitcode}")
+            except OSError:
+                raise ScriptCompileError("Script error: compiled script too large") from None
+        finally:
+            parent.close()
+            if process.is_alive():
+                process.kill()
+            process.join()
+        if status != "ok":
+            raise ScriptCompileError(result)
+        return script_from_data(result)
@@ -1,10 +1,13 @@
+import bisect
 import io
+import re
+from collections import OrderedDict
 from typing import Dict
 from typing import List, Any, Tuple
 
-from elizaconstant import SPECIAL_RULE_NONE
+from elizaconstant import SPECIAL_RULE_NONE, TagMap
 from elizalogic import RuleKeyword, RuleMemory, Script
-from elizautil import eliza_specific_join
+from elizautil import eliza_specific_join, collect_tags
 
 #INTERNAL UTILITY
 def _is_whitespace(ch):
@@ -419,3 +422,257 @@ class ElizaScriptReader:
 
         return self.read_keyword_rule()
 
+
+
+def _nested_form_pattern(depth: int) -> str:
+    # a bracketed form nested at most depth deep; comments may contain brackets. Each alternative
+    # consumes one character (or one whole comment) so a failed match cannot backtrack exponentially
+    form = r"\((?:[^();]|;[^\n]*)*\)"
+    for _ in range(depth):
+        form = r"\((?:[^();]|;[^\n]*|" + form + r")*\)"
+    return form
+
+
+def _common_prefix(a: str, b: str) -> int:
+    # length of the longest common prefix, comparing a block at a time and then bisecting the first
+    # block that differs
+    n = min(len(a), len(b))
+    step = 4096
+    lo = 0
+    while lo < n and a[lo:lo + step] == b[lo:lo + step]:
+        lo += step
+    if lo >= n:
+        return n
+    hi = min(lo + step, n)
+    if a[lo:hi] == b[lo:hi]:
+        return hi
+    base = lo
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if a[base:mid] == b[base:mid]:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+def _common_suffix(a: str, b: str, limit: int) -> int:
+    # as _common_prefix(), from the end of both strings, but no longer than limit
+    la, lb = len(a), len(b)
+    step = 4096
+    lo = 0
+    while lo < limit:
+        hi = min(lo + step, limit)
+        if a[la - hi:la - lo] != b[lb - hi:lb - lo]:
+            break
+        lo = hi
+    else:
+        return limit
+    base = lo
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if a[la - mid:la - base] == b[lb - mid:lb - base]:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+class IncrementalScriptReader:
+    """
+        Reads a script exactly as ElizaScriptReader does, but remembers the compiled form of every top-level rule.
+        When an edited version of the script is read, only the text around the edit is scanned again and only
+        rules whose text changed are compiled again; the others are reused as they are. Rules refer to each other
+        (=KEYWORD links) by name, which is resolved when ELIZA responds, so an edited rule does not invalidate the
+        rules that link to it. The DLIST tag map is only rebuilt when the DLIST of some rule changed.
+
+        Should anything be wrong with the script it is handed to ElizaScriptReader, so the error reported is the
+        same as for a full read.
+    """
+    _form = re.compile(r";[^\n]*|" + _nested_form_pattern(8))
+    _comment = re.compile(r";[^\n]*")
+
+    def __init__(self):
+        self._forget()
+        # the DLIST tags of the most recent script, i.e. collect_tags(script.rules)
+        self.tags: TagMap = OrderedDict()
+        # number of top-level rules compiled by the most recent read_script()
+        self.recompiled = 0
+
+    def _forget(self):
+        # the most recent script text, and for each of its top-level forms: the offset, the text, whether START
+        # preceded it, and the compiled rule (None for the opening remarks, () for an empty rule list)
+        self._text = ""
+        self._starts: List[int] = []
+        self._forms: List[str] = []
+        self._start_symbol: List[bool] = []
+        self._rules: List[Any] = []
+        self._script = None
+        self._tagged: List[Tuple[str, Tuple[str, ...]]] = []
+
+    def read_script(self, text: str) -> Tuple[str, Script]:
+        try:
+            starts, forms, start_symbol, window = self._split(text)
+            script, rules, tagged = self._assemble(text, starts, forms, start_symbol, window)
+        except RuntimeError:
+            self._forget()
+            status, script = ElizaScriptReader.read_script(text)
+            self.tags = collect_tags(script.rules)
+            return status, script
+
+        if tagged is not self._tagged and tagged != self._tagged:
+            self.tags = collect_tags(OrderedDict((keyword, script.rules[keyword]) for keyword, _ in tagged))
+        self._text, self._starts, self._forms, self._start_symbol = text, starts, forms, start_symbol
+        self._rules, self._script, self._tagged = rules, script, tagged
+        return "success", script
+
+    def _split(self, text: str):
+        """
+        Find the top-level forms of text. Returns their offsets, their text, whether START preceded each, and
+        the window (keep, old_end, new_end): forms [keep, old_end) of the previous text became forms
+        [keep, new_end) of this one, and all others are unchanged.
+        """
+        old = self._text
+        if not self._forms:
+            return self._scan(text, 0, [], [], [], None)
+
+        # forms wholly inside the unchanged beginning are kept; scanning restarts after the last of them
+        prefix = _common_prefix(old, text)
+        keep = 0
+        while keep < len(self._forms) and self._starts[keep] + len(self._forms[keep]) <= prefix:
+            keep += 1
+        pos = self._starts[keep - 1] + len(self._forms[keep - 1]) if keep else 0
+
+        # forms wholly inside the unchanged end are kept once scanning arrives back at one of them
+        suffix = _common_suffix(old, text, min(len(old), len(text)) - prefix)
+        shift = len(text) - len(old)
+        resume = len(old) - suffix
+        first = max(bisect.bisect_left(self._starts, resume), keep)
+        return self._scan(text, pos, self._starts[:keep], self._forms[:keep], self._start_symbol[:keep],
+                          (first, shift, resume + shift))
+
+    def _scan(self, text: str, pos: int, starts: List[int], forms: List[str], start_symbol: List[bool], tail):
+        keep = len(forms)
+        for match in self._form.finditer(text, pos):
+            if match.group()[0] == ";":
+                continue
+            at = match.start()
+            if tail is not None and at >= tail[2]:
+                first, shift, _ = tail
+                index = bisect.bisect_left(self._starts, at - shift, first)
+                if index < len(self._starts) and self._starts[index] == at - shift:
+                    # back in step with the previous text: the rest is unchanged
+                    window = (keep, index, len(forms))
+                    starts.append(at)
+                    if shift:
+                        starts.extend([st + shift for st in self._starts[index + 1:]])
+                    else:
+                        starts.extend(self._starts[index + 1:])
+                    forms.extend(self._forms[index:])
+                    start_symbol.append(self._gap(text, pos, at))
+                    start_symbol.extend(self._start_symbol[index + 1:])
+                    return starts, forms, start_symbol, window
+            start_symbol.append(self._gap(text, pos, at))
+            starts.append(at)
+            forms.append(match.group())
+            pos = match.end()
+
+        if self._comment.sub("", text[pos:]).strip():
+            raise RuntimeError("unbalanced brackets")
+        return starts, forms, start_symbol, (keep, len(self._forms), len(forms))
+
+    def _gap(self, text: str, pos: int, end: int) -> bool:
+        # True if the text between two forms is START; anything else but comments is an error
+        gap = self._comment.sub("", text[pos:end]).split()
+        if gap and gap != ["START"]:
+            raise RuntimeError("unexpected text between rules")
+        return bool(gap)
+
+    def _assemble(self, text: str, starts: List[int], forms: List[str], start_symbol: List[bool], window):
+        keep, old_end, new_end = window
+        if not forms:
+            raise RuntimeError("no opening remarks")
+        # START may only come between the opening remarks and the first rule
+        if any(start_symbol[:1]) or any(start_symbol[2:]):
+            raise RuntimeError("misplaced START")
+
+        # compile the forms in the window, reusing any whose text was already in the window
+        previous = dict(zip(self._forms[keep:old_end], self._rules[keep:old_end]))
+        replaced: List[Any] = []
+        self.recompiled = 0
+        line, counted = 1, 0
+        for index in range(keep, new_end):
+            if index == 0:
+                replaced.append(None)
+                continue
+            form = forms[index]
+            rule = previous.get(form)
+            if rule is None:
+                line += text.count("\n", counted, starts[index])
+                counted = starts[index]
+                rule = self._compile(form, line)
+                previous[form] = rule
+                self.recompiled += 1
+            replaced.append(rule)
+        removed = self._rules[keep:old_end]
+        rules = self._rules[:keep] + replaced + self._rules[old_end:]
+
+        def identity(rule):
+            return rule.keyword if isinstance(rule, RuleKeyword) else type(rule)
+
+        old_script = self._script
+        if keep > 0 and old_script is not None and list(map(identity, removed)) == list(map(identity, replaced)):
+            # the same rules in the same order: patch a copy of the previous script
+            script = Script()
+            script.hello_message = old_script.hello_message
+            script.rules = dict(old_script.rules)
+            script.mem_rule = old_script.mem_rule
+            for rule in replaced:
+                if isinstance(rule, RuleMemory):
+                    script.mem_rule = rule
+                elif rule:
+                    script.rules[rule.keyword] = rule
+            if script.mem_rule.keyword not in script.rules:
+                raise RuntimeError("MEMORY keyword is not a keyword")
+            tagged = self._tagged
+            if any(rule and not isinstance(rule, RuleMemory) and rule.tags != old.tags
+                   for rule, old in zip(replaced, removed)):
+                tagged = [(keyword, tuple(rule.tags)) for keyword, rule in script.rules.items() if rule.tags]
+            return script, rules, tagged
+
+        script = Script()
+        script.hello_message = self._compile(forms[0], text.count("\n", 0, starts[0]) + 1, True)
+        tagged = []
+        for rule in rules[1:]:
+            if isinstance(rule, RuleMemory):
+                if script.mem_rule.is_valid():
+                    raise RuntimeError("multiple MEMORY rules specified")
+                script.mem_rule = rule
+            elif rule:
+                if rule.keyword in script.rules:
+                    raise RuntimeError("keyword rule already specified")
+                script.rules[rule.keyword] = rule
+                if rule.tags:
+                    tagged.append((rule.keyword, tuple(rule.tags)))
+        if SPECIAL_RULE_NONE not in script.rules or not script.mem_rule.is_valid() \
+                or script.mem_rule.keyword not in script.rules:
+            raise RuntimeError("incomplete script")
+        return script, rules, tagged
+
+    @staticmethod
+    def _compile(form: str, line: int, hello: bool = False) -> Any:
+        # read one top-level form that starts on the given line of the whole script
+        reader: ElizaScriptReader = ElizaScriptReader.__new__(ElizaScriptReader)
+        reader.tokenizer = Tokenizer(StringIOWithPeek(form))
+        reader.tokenizer.line_number = line
+        reader.script = Script()
+        if hello:
+            return reader.rdlist()
+        if not reader.read_rule():
+            raise RuntimeError("expected rule")
+        if reader.script.rules:
+            (rule,) = reader.script.rules.values()
+            return rule
+        if reader.script.mem_rule.is_valid():
+            return reader.script.mem_rule
+        return ()  # an empty rule list
@@ -0,0 +1,385 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from elizalogic import DEFAULT_MAX_MEMORIES, DROP_OLDEST, MemoryQueue, Script, Transform
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class SessionState:
+    """
+        The part of ELIZA that belongs to one conversation rather than to the script: JW's LIMIT counter, the
+        position each decomposition rule has reached in its list of reassembly rules, and the MEMORY queue.
+
+        Reassembly positions are keyed by Transform.key, which survives a recompile of the script, and only
+        positions other than the first are stored. The MEMORY queue holds at most max_memories memories, or
+        any number if None, as JW's does, see MemoryQueue.
+    """
+    __slots__ = ("limit", "cursors", "memories", "script")
+
+    def __init__(self, script: Optional[Script] = None, max_memories: Optional[int] = None,
+                 memory_policy: str = DROP_OLDEST):
+        self.limit = 1  # cycles through 1..4, then back to 1
+        self.cursors: Dict[tuple, int] = {}
+        self.memories = MemoryQueue((), max_memories, memory_policy)
+        # the script the cursors were last used with
+        self.script: Optional[Script] = script
+
+    def copy(self) -> "SessionState":
+        """
+        The conversation as it stands, to go on with separately.
+        """
+        state = SessionState(self.script)
+        state.limit = self.limit
+        state.cursors = dict(self.cursors)
+        state.memories = self.memories.copy()
+        return state
+
+    def migrate(self, script: Script) -> None:
+        """
+        Carry this conversation over to a recompiled script. A reassembly position is kept if its decomposition
+        rule still exists with the same reassembly rules, otherwise that rule starts again from its first
+        reassembly. LIMIT and the MEMORY queue are unaffected.
+        :param script: The script the conversation continues with.
+        """
+        if script is self.script:
+            return
+        if self.script is not None and self.cursors:
+            cursors: Dict[tuple, int] = {}
+            for key, cursor in self.cursors.items():
+                old = self.script.find_transform(key)
+                new = script.find_transform(key)
+                if old is not None and new is not None and old.reassembly_rules == new.reassembly_rules:
+                    cursors[key] = cursor
+            self.cursors = cursors
+        self.script = script
+
+
+# Compact snapshots of a SessionState, for callers that keep no state between requests. The snapshot is
+#
+#   version         1 byte, SNAPSHOT_VERSION
+#   flags           1 byte, SNAPSHOT_ZLIB if the rest is zlib compressed
+#   LIMIT           1 byte
+#   cursors         varint count, then varint transform_id(key), varint position and varint
+#                   reassembly_digest() of the rule's reassembly rules for each
+#   MEMORY queue    varint count, then varint length and UTF-8 text for each
+#
+# so a fresh session is 5 bytes. It holds no script: decode it against the script the conversation continues
+# with, and reassembly positions of decomposition rules that script does not have, or has with different
+# reassembly rules, are dropped, as migrate() would drop them. Version 1 snapshots, which have no digests, are
+# still read; their positions are kept whenever the decomposition rule exists.
+SNAPSHOT_VERSION = 2
+SNAPSHOT_ZLIB = 1
+# snapshots longer than this are compressed when encode_session() is left to decide
+SNAPSHOT_COMPRESS_OVER = 256
+
+
+@lru_cache(maxsize=65536)
+def transform_id(key: tuple) -> int:
+    """
+    A 32 bit id for a Transform.key, the same in every process and for every compile of the script.
+    """
+    import zlib
+    keyword, pattern, occurrence = key
+    return zlib.crc32(f"{keyword}\0{pattern}\0{occurrence}".encode())
+
+
+def reassembly_digest(transform: Transform) -> int:
+    """
+    A 32 bit digest of a Transform's reassembly rules, which a reassembly position is only good for.
+    """
+    import zlib
+    return zlib.crc32("\0".join(" ".join(rule) for rule in transform.reassembly_rules).encode())
+
+
+# script -> ({transform_id: Transform.key}, {Transform.key: reassembly_digest}); an id two keys share maps to
+# None and is not restored. Made when first needed, as are weakref and zlib imported, to keep them out of the
+# time ELIZA takes to start
+_transform_ids = None
+
+
+def _transform_id_index(script: Script) -> Tuple[Dict[int, Optional[tuple]], Dict[tuple, int]]:
+    global _transform_ids
+    if _transform_ids is None:
+        import weakref
+        _transform_ids = weakref.WeakKeyDictionary()
+    index = _transform_ids.get(script)
+    if index is None:
+        ids, digests = {}, {}
+        for rule in script.rules.values():
+            for transform in rule.transformations:
+                tid = transform_id(transform.key)
+                ids[tid] = None if tid in ids else transform.key
+                digests[transform.key] = reassembly_digest(transform)
+        index = _transform_ids[script] = (ids, digests)
+    return index
+
+
+def _put_varint(out: bytearray, n: int) -> None:
+    if n < 0x80:
+        out.append(n)
+        return
+    while n > 0x7F:
+        out.append(0x80 | (n & 0x7F))
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    n = data[pos]
+    if n < 0x80:
+        return n, pos + 1
+    n = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def encode_session(state: SessionState, compress: Optional[bool] = None) -> bytes:
+    """
+    A snapshot of state in the format above.
+    :param compress: True or False to compress or not; None compresses snapshots over SNAPSHOT_COMPRESS_OVER
+                     bytes, when that makes them smaller.
+    """
+    out = bytearray((state.limit,))
+    _put_varint(out, len(state.cursors))
+    if state.cursors:
+        digests = _transform_id_index(state.script)[1] if state.script is not None else {}
+        for key, cursor in state.cursors.items():
+            _put_varint(out, transform_id(key))
+            _put_varint(out, cursor)
+            _put_varint(out, digests.get(key, 0))
+    _put_varint(out, len(state.memories))
+    for memory in state.memories:
+        text = memory.encode()
+        _put_varint(out, len(text))
+        out += text
+    if compress or (compress is None and len(out) > SNAPSHOT_COMPRESS_OVER):
+        import zlib
+        packed = zlib.compress(out)
+        if compress or len(packed) < len(out):
+            return bytes((SNAPSHOT_VERSION, SNAPSHOT_ZLIB)) + packed
+    return bytes((SNAPSHOT_VERSION, 0)) + out
+
+
+def decode_session(data: bytes, script: Script, max_memories: Optional[int] = None,
+                   memory_policy: str = DROP_OLDEST) -> SessionState:
+    """
+    The SessionState in a snapshot made by encode_session(), continuing with script, with a MEMORY queue of at
+    most max_memories memories (None for no bound) kept by memory_policy.
+    :raises ValueError: The snapshot is damaged or of an unknown version.
+    """
+    if len(data) < 2 or data[0] not in (1, SNAPSHOT_VERSION) or data[1] & ~SNAPSHOT_ZLIB:
+        raise ValueError("not an ELIZA session snapshot, or a different version")
+    with_digests = data[0] >= 2
+    import zlib
+    try:
+        body = zlib.decompress(data[2:]) if data[1] & SNAPSHOT_ZLIB else data[2:]
+        state = SessionState(script, max_memories, memory_policy)
+        state.limit = body[0]
+        count, pos = _get_varint(body, 1)
+        if count:
+            ids, digests = _transform_id_index(script)
+            for _ in range(count):
+                tid, pos = _get_varint(body, pos)
+                cursor, pos = _get_varint(body, pos)
+                digest = None
+                if with_digests:
+                    digest, pos = _get_varint(body, pos)
+                key = ids.get(tid)
+                if key is not None and (digest is None or digest == digests[key]):
+                    state.cursors[key] = cursor
+        count, pos = _get_varint(body, pos)
+        for _ in range(count):
+            length, pos = _get_varint(body, pos)
+            state.memories.append(str(body[pos:pos + length], "utf-8"))
+            pos += length
+    except (IndexError, UnicodeDecodeError, zlib.error) as e:
+        raise ValueError(f"damaged ELIZA session snapshot: {e}") from None
+    if not 1 <= state.limit <= 4 or pos != len(body):
+        raise ValueError("damaged ELIZA session snapshot")
+    return state
+
+
+# called with (session_id, state, reason) when a session leaves a SessionManager; reason is one of these
+EVICT_LRU = "lru"
+EVICT_TTL = "ttl"
+EVICT_DROP = "drop"
+if TYPE_CHECKING:
+    EvictionCallback = Callable[[Hashable, SessionState, str], None]
+
+
+class SessionManager:
+    """
+        Holds many conversations with one Eliza. Each is identified by a caller-chosen session id and its
+        SessionState is created the first time the id is seen.
+
+        The table is bounded: when it holds max_sessions the least recently used session is evicted to make
+        room, and sessions idle for longer than ttl seconds are evicted as the manager is used. Either way the
+        eviction callbacks are called with the session, e.g. to save it somewhere cheaper. A session that comes
+        back after being evicted is asked of loader, if given, and otherwise starts afresh; the caller may also
+        restore it with put().
+    """
+    def __init__(self, eliza, max_sessions: int = 100000, ttl: Optional[float] = None,
+                 on_evict: Optional[EvictionCallback] = None, clock: Callable[[], float] = time.monotonic,
+                 loader: Optional[Callable[[Hashable], Optional[SessionState]]] = None,
+                 max_memories: int = DEFAULT_MAX_MEMORIES, memory_policy: str = DROP_OLDEST):
+        if max_sessions < 1:
+            raise ValueError("max_sessions must be at least 1")
+        self.eliza = eliza
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.clock = clock
+        self.eviction_callbacks: List[EvictionCallback] = [on_evict] if on_evict else []
+        self.loader = loader
+        # for the MEMORY queue of each new session
+        self.max_memories = max_memories
+        self.memory_policy = memory_policy
+        # session id -> (time last used, state), least recently used first
+        self._table: "OrderedDict[Hashable, Tuple[float, SessionState]]" = OrderedDict()
+        self.created = 0
+        self.evicted = {EVICT_LRU: 0, EVICT_TTL: 0, EVICT_DROP: 0}
+
+    def add_eviction_callback(self, callback: EvictionCallback) -> None:
+        self.eviction_callbacks.append(callback)
+
+    def respond(self, session_id: Hashable, text: str) -> str:
+        """
+        ELIZA's response to text in the conversation session_id, which is started if it does not exist.
+        """
+        return self.eliza.response(text, self.get(session_id))
+
+    def greeting(self, session_id: Hashable) -> str:
+        """
+        Start the conversation session_id, if it does not exist, and return the script's greeting.
+        """
+        self.get(session_id)
+        return self.eliza.get_greeting()
+
+    def get(self, session_id: Hashable, create: bool = True) -> Optional[SessionState]:
+        """
+        The state of session_id, marked as just used. A missing session is loaded or created, or None returned
+        if create is False.
+        """
+        now = self.clock()
+        self.expire(now)
+        entry = self._table.get(session_id)
+        if entry is None:
+            if not create:
+                return None
+            state = self.loader(session_id) if self.loader else None
+            if state is None:
+                state = self.new_state()
+                self.created += 1
+            self._insert(session_id, state, now)
+            return state
+        state = entry[1]
+        self._table[session_id] = (now, state)
+        self._table.move_to_end(session_id)
+        return state
+
+    def new_state(self, snapshot: Optional[bytes] = None) -> SessionState:
+        """
+        A new session, or the one in an encode_session() snapshot, with this manager's MEMORY queue settings;
+        for loaders.
+        """
+        if snapshot is not None:
+            return decode_session(snapshot, self.eliza.script, self.max_memories, self.memory_policy)
+        return SessionState(self.eliza.script, self.max_memories, self.memory_policy)
+
+    def put(self, session_id: Hashable, state: SessionState) -> None:
+        """
+        Add or replace the state of session_id, e.g. to restore a session saved by an eviction callback.
+        """
+        now = self.clock()
+        self.expire(now)
+        if self._table.pop(session_id, None) is None:
+            self._insert(session_id, state, now)
+        else:
+            self._table[session_id] = (now, state)
+
+    def _insert(self, session_id: Hashable, state: SessionState, now: float) -> None:
+        while len(self._table) >= self.max_sessions:
+            old_id, (_, old_state) = self._table.popitem(last=False)
+            self._evicted(old_id, old_state, EVICT_LRU)
+        self._table[session_id] = (now, state)
+
+    def drop(self, session_id: Hashable) -> Optional[SessionState]:
+        """
+        End the conversation session_id. The eviction callbacks are called with reason EVICT_DROP.
+        """
+        entry = self._table.pop(session_id, None)
+        if entry is None:
+            return None
+        self._evicted(session_id, entry[1], EVICT_DROP)
+        return entry[1]
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """
+        Evict every session idle for longer than ttl. Sessions are kept in order of last use, so this only
+        looks at the sessions it evicts and one more.
+        :return: The number evicted.
+        """
+        if self.ttl is None or not self._table:
+            return 0
+        if now is None:
+            now = self.clock()
+        deadline = now - self.ttl
+        count = 0
+        table = self._table
+        while table:
+            session_id, (last_used, state) = next(iter(table.items()))
+            if last_used > deadline:
+                break
+            del table[session_id]
+            self._evicted(session_id, state, EVICT_TTL)
+            count += 1
+        return count
+
+    def _evicted(self, session_id: Hashable, state: SessionState, reason: str) -> None:
+        self.evicted[reason] += 1
+        for callback in self.eviction_callbacks:
+            callback(session_id, state, reason)
+
+    def clear(self) -> None:
+        """
+        Drop every session.
+        """
+        while self._table:
+            session_id, (_, state) = self._table.popitem(last=False)
+            self._evicted(session_id, state, EVICT_DROP)
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def __contains__(self, session_id) -> bool:
+        return session_id in self._table
+
+    def __iter__(self):
+        return iter(list(self._table))
+
+    def items(self) -> List[Tuple[Hashable, SessionState]]:
+        """
+        Every (session id, state), least recently used first, without marking any as used.
+        """
+        return [(session_id, state) for session_id, (_, state) in self._table.items()]
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Session counts, and the depth of the MEMORY queues of the sessions held (which takes a pass over them).
+        """
+        depths = [len(state.memories) for _, state in self._table.values()]
+        return {"sessions": len(self._table), "created": self.created,
+                "evicted_lru": self.evicted[EVICT_LRU], "expired_ttl": self.evicted[EVICT_TTL],
+                "dropped": self.evicted[EVICT_DROP],
+                "memory_depth_max": max(depths, default=0),
+                "memory_depth_mean": sum(depths) / len(depths) if depths else 0.0,
+                "memories_dropped": sum(getattr(state.memories, "dropped", 0) for _, state in self._table.values())}
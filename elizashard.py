@@ -0,0 +1,367 @@
+"""
+Conversations sharded over a pool of worker processes, to use more than one core. Session ids are hashed onto
+NUM_SLOTS slots and each slot belongs to one worker, which holds the sessions in it; the front process sends
+each worker its requests in batches over a pipe. The pool grows and shrinks with the depth of its queue, and
+when it does the sessions in the slots that change hands are moved to their new worker as encode_session()
+snapshots. A session's remarks are always answered in the order they were made.
+"""
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+from eliza import Eliza
+from elizalogic import Script
+from elizaprebuilt import script_from_data, script_to_data
+from elizasession import SessionManager, encode_session
+
+NUM_SLOTS = 1024
+
+
+def session_slot(session_id: Hashable) -> int:
+    """
+    The slot session_id is in, the same in every process.
+    """
+    return zlib.crc32(str(session_id).encode()) % NUM_SLOTS
+
+
+def _worker(conn, script_data, max_sessions: int) -> None:
+    # a worker process: answers ("batch", [(request id, session id, remark), ...]) with ("batch", [(request id,
+    # response, error), ...]), ("export", slots) with ("export", [(session id, snapshot), ...]) of the sessions it
+    # gives up, ("import", [(session id, snapshot), ...]) with ("import", count), and ("stop",) by exiting
+    eliza = Eliza(script_from_data(script_data))
+    sessions = SessionManager(eliza, max_sessions)
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        kind = message[0]
+        if kind == "batch":
+            replies = []
+            for request_id, session_id, remark in message[1]:
+                try:
+                    replies.append((request_id, sessions.respond(session_id, remark), None))
+                except Exception as e:
+                    replies.append((request_id, None, f"{type(e).__name__}: {e}"))
+            conn.send(("batch", replies))
+        elif kind == "export":
+            slots = message[1]
+            moving = [(session_id, state) for session_id, state in sessions.items()
+                      if session_slot(session_id) in slots]
+            for session_id, _ in moving:
+                sessions.drop(session_id)
+            conn.send(("export", [(session_id, encode_session(state)) for session_id, state in moving]))
+        elif kind == "import":
+            for session_id, snapshot in message[1]:
+                sessions.put(session_id, sessions.new_state(snapshot))
+            conn.send(("import", len(message[1])))
+        elif kind == "stop":
+            return
+
+
+def _fail(futures: Iterable[Future]) -> None:
+    error = RuntimeError("an ELIZA worker process exited")
+    for future in list(futures):
+        if not future.done():
+            future.set_exception(error)
+
+
+class _Worker:
+    def __init__(self, context, script, max_sessions: int):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker, args=(child, script, max_sessions), daemon=True)
+        self.process.start()
+        child.close()
+        self.pending: Dict[int, Future] = {}  # request id -> future, in flight to this worker
+        self.control: "queue.Queue[tuple]" = queue.Queue()  # replies to export and import, or ("exited",)
+        self.receiver: Optional[threading.Thread] = None
+        self.exited = False  # the process is gone, with the sessions it held
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(("stop",))
+        except OSError:
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class ShardedPool:
+    """
+        Serves conversations from a pool of worker processes, each owning the sessions hashed to its slots.
+
+            pool = ShardedPool(script, workers=4)
+            pool.respond("user 1", "Men are all alike.")
+            pool.submit("user 2", "...")  # a Future
+            pool.close()
+
+        With autoscale, the pool adds a worker (up to max_workers) while more than scale_up_depth requests per
+        worker are waiting or in flight, and removes one (down to min_workers) after idle_seconds without any.
+        Workers are started by a fork server where there is one, and spawned otherwise, and are sent the script
+        as data: workers are started while the pool's threads are running, so a child forked from this process
+        could inherit a lock one of them held.
+
+        A worker process that dies takes its sessions with it: the requests it had in flight fail with
+        RuntimeError and a new worker is started in its place, whose conversations start afresh.
+    """
+    def __init__(self, script: Script, workers: int = 0, min_workers: int = 1, max_workers: int = 0,
+                 autoscale: bool = False, batch_size: int = 64, scale_up_depth: int = 256, idle_seconds: float = 5.0,
+                 max_sessions: int = 100000):
+        cores = os.cpu_count() or 1
+        self.script = script
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max_workers or cores
+        self.autoscale = autoscale
+        self.batch_size = batch_size
+        self.scale_up_depth = scale_up_depth
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        methods = multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self._script_arg = script_to_data(script)
+
+        self.workers: List[_Worker] = []
+        self.owner: List[int] = []  # slot -> index in self.workers
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        # guards every worker's pending requests, and is notified when a worker has none left
+        self._pending = threading.Condition()
+        self._next_id = 0
+        self._closed = False
+        self.migrated = 0
+        self.resizes = 0
+        self.restarts = 0
+
+        for _ in range(min(max(workers or cores, self.min_workers), self.max_workers)):
+            self._start_worker()
+        self.owner = [slot % len(self.workers) for slot in range(NUM_SLOTS)]
+        self._dispatcher = threading.Thread(target=self._dispatch, name="eliza-shard-dispatch", daemon=True)
+        self._dispatcher.start()
+
+    def _start_worker(self, index: Optional[int] = None) -> None:
+        # a new worker, at the end of self.workers or in place of the one at index
+        worker = _Worker(self._context, self._script_arg, self.max_sessions)
+        worker.receiver = threading.Thread(target=self._receive, args=(worker,), name="eliza-shard-receive",
+                                           daemon=True)
+        worker.receiver.start()
+        if index is None:
+            self.workers.append(worker)
+        else:
+            self.workers[index] = worker
+
+    def submit(self, session_id: Hashable, remark: str) -> Future:
+        """
+        Queue remark for the conversation session_id.
+        :return: A Future of the response.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("the pool is closed")
+            self._next_id += 1
+            self._queue.put((self._next_id, session_id, remark, future))
+        return future
+
+    def respond(self, session_id: Hashable, remark: str) -> str:
+        return self.submit(session_id, remark).result()
+
+    def respond_many(self, requests: Iterable[Tuple[Hashable, str]]) -> List[str]:
+        futures = [self.submit(session_id, remark) for session_id, remark in requests]
+        return [future.result() for future in futures]
+
+    def resize(self, workers: int) -> None:
+        """
+        Grow or shrink the pool to the given number of workers, moving sessions as needed, and wait until done.
+        """
+        done = Future()
+        self._queue.put(("resize", workers, done))
+        done.result()
+
+    def depth(self) -> int:
+        """
+        Requests waiting to be sent, plus those in flight.
+        """
+        return self._queue.qsize() + sum(len(worker.pending) for worker in self.workers)
+
+    def stats(self) -> Dict[str, int]:
+        return {"workers": len(self.workers), "depth": self.depth(), "resizes": self.resizes,
+                "sessions_migrated": self.migrated, "restarts": self.restarts}
+
+    # the dispatcher thread is the only one that sends to the workers, so batches and moves of sessions reach
+    # each worker in the order they were decided on
+    def _dispatch(self) -> None:
+        last_busy = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                item = None
+            now = time.monotonic()
+            items = []
+            while item is not None:
+                if item[0] == "resize":
+                    self._send(items)
+                    items = []
+                    try:
+                        self._resize(item[1])
+                        item[2].set_result(None)
+                    except Exception as e:
+                        item[2].set_exception(e)
+                elif item[0] == "stop":
+                    self._send(items)
+                    return
+                else:
+                    items.append(item)
+                    if len(items) >= self.batch_size * len(self.workers):
+                        self._send(items)
+                        items = []
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    item = None
+            self._send(items)
+
+            if self.autoscale:
+                depth = self.depth()
+                if depth:
+                    last_busy = now
+                if depth > self.scale_up_depth * len(self.workers) and len(self.workers) < self.max_workers:
+                    self._resize(len(self.workers) + 1)
+                elif now - last_busy > self.idle_seconds and len(self.workers) > self.min_workers:
+                    self._resize(len(self.workers) - 1)
+                    last_busy = now
+
+    def _send(self, items) -> None:
+        batches: Dict[int, list] = {}
+        futures: Dict[int, Dict[int, Future]] = {}
+        for request_id, session_id, remark, future in items:
+            index = self.owner[session_slot(session_id)]
+            batches.setdefault(index, []).append((request_id, session_id, remark))
+            futures.setdefault(index, {})[request_id] = future
+        for index, batch in batches.items():
+            if self.workers[index].exited or not self.workers[index].process.is_alive():
+                self._restart(index)
+            worker = self.workers[index]
+            with self._pending:
+                if worker.exited:
+                    _fail(futures[index].values())
+                    continue
+                worker.pending.update(futures[index])
+            try:
+                worker.conn.send(("batch", batch))
+            except OSError:
+                self._exited(worker)
+
+    def _exited(self, worker: _Worker) -> None:
+        # the worker's process is gone: fail what it had in flight, and anyone waiting on its control replies
+        with self._pending:
+            if worker.exited:
+                return
+            worker.exited = True
+            _fail(worker.pending.values())
+            worker.pending.clear()
+            self._pending.notify_all()
+        worker.control.put(("exited",))
+
+    def _restart(self, index: int) -> None:
+        old = self.workers[index]
+        self._exited(old)
+        old.stop()
+        self._start_worker(index)
+        self.restarts += 1
+
+    def _receive(self, worker: _Worker) -> None:
+        while True:
+            try:
+                message = worker.conn.recv()
+            except (EOFError, OSError):
+                self._exited(worker)
+                return
+            if message[0] == "batch":
+                with self._pending:
+                    answered = [(worker.pending.pop(request_id, None), response, error)
+                                for request_id, response, error in message[1]]
+                    if not worker.pending:
+                        self._pending.notify_all()
+                for future, response, error in answered:
+                    if future is None or future.done():
+                        continue
+                    if error is None:
+                        future.set_result(response)
+                    else:
+                        future.set_exception(RuntimeError(error))
+            else:
+                worker.control.put(message)
+
+    def _call(self, worker: _Worker, message: tuple) -> Optional[tuple]:
+        # send a control message and wait for the reply, or None if the worker has exited
+        try:
+            worker.conn.send(message)
+        except OSError:
+            self._exited(worker)
+            return None
+        reply = worker.control.get()
+        return None if reply[0] == "exited" else reply
+
+    def _wait_idle(self) -> None:
+        with self._pending:
+            self._pending.wait_for(lambda: not any(worker.pending for worker in self.workers))
+
+    def _resize(self, count: int) -> None:
+        count = min(max(count, self.min_workers), self.max_workers)
+        old = len(self.workers)
+        if count == old:
+            return
+        # let every request already sent be answered, so nothing is in flight to a session that moves
+        self._wait_idle()
+        for _ in range(old, count):
+            self._start_worker()
+        # the slots a worker holds beyond its fair share are handed, one at a time, to the worker with fewest
+        owner = list(self.owner)
+        held: Dict[int, List[int]] = {i: [] for i in range(count)}
+        spare = []
+        for slot, index in enumerate(owner):
+            (held[index] if index < count else spare).append(slot)
+        share = NUM_SLOTS // count
+        for index in range(count):
+            while len(held[index]) > share + (1 if index < NUM_SLOTS % count else 0):
+                spare.append(held[index].pop())
+        for slot in spare:
+            index = min(held, key=lambda i: len(held[i]))
+            held[index].append(slot)
+            owner[slot] = index
+
+        moves: Dict[Tuple[int, int], set] = {}
+        for slot in range(NUM_SLOTS):
+            if owner[slot] != self.owner[slot]:
+                moves.setdefault((self.owner[slot], owner[slot]), set()).add(slot)
+        for (source, target), slots in moves.items():
+            # the sessions of a worker that has exited are lost, and a new one takes its place when next sent to
+            reply = self._call(self.workers[source], ("export", slots))
+            if reply and reply[1] and self._call(self.workers[target], ("import", reply[1])):
+                self.migrated += len(reply[1])
+        self.owner = owner
+        for worker in self.workers[count:]:
+            worker.stop()
+        del self.workers[count:]
+        self.resizes += 1
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(("stop",))
+        self._dispatcher.join()
+        self._wait_idle()
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
@@ -0,0 +1,318 @@
+"""
+A compiled script laid out as flat arrays in one block of shared memory, for worker processes that are
+spawned rather than forked. The owner lays the script out once; each worker attaches to the block by name
+and reads it in place through memoryviews, without parsing or copying it. A worker only holds the few rules it
+has used most recently (DEFAULT_CACHE_SIZE), decoded into ordinary RuleKeyword objects, so its memory does
+not grow with the script.
+
+The block is an array of little-endian uint32 followed by the UTF-8 text of every distinct string:
+
+    header          _HEADER_WORDS words, see the _H_* indices
+    string offsets  n_strings + 1 byte offsets into the text
+    ids             string ids, referred to by (start, count) from the records below
+    rules           8 words each: keyword, substitution, precedence, link, tags start, tags count,
+                    transformations start, transformations count
+    sorted rules    rule numbers in order of keyword (UTF-8 bytes), for lookup
+    transformations 4 words each: decomposition start, count, reassembly rules start, count
+    reassembly      2 words each: start, count
+    tags            3 words each: tag, keywords start, count
+
+Needs multiprocessing.shared_memory (Python 3.8 or later).
+"""
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional
+
+from elizaconstant import TagMap
+from elizalogic import RuleKeyword, RuleMemory, Script, Transform
+from elizautil import collect_tags
+
+_MAGIC = 0x415A494C  # "LIZA"
+_VERSION = 1
+_RULE_WORDS = 8
+_TRANSFORM_WORDS = 4
+_REASSEMBLY_WORDS = 2
+_TAG_WORDS = 3
+
+# header word indices
+(_H_MAGIC, _H_VERSION, _H_WORDS, _H_STRINGS, _H_STRING_OFFSETS, _H_IDS, _H_RULES, _H_RULE_COUNT, _H_SORTED,
+ _H_TRANSFORMS, _H_REASSEMBLY, _H_TAGS, _H_TAG_COUNT, _H_HELLO, _H_HELLO_COUNT, _H_MEMORY_KEYWORD,
+ _H_MEMORY_TRANSFORMS, _H_MEMORY_TRANSFORM_COUNT) = range(18)
+_HEADER_WORDS = 18
+
+DEFAULT_CACHE_SIZE = 16  # decoded rules a SharedScript keeps; the DOCTOR script has 67
+
+
+class _AttachedBlock:
+    # a POSIX shared memory block opened by name, with the parts of SharedMemory that SharedScript uses
+    def __init__(self, name: str):
+        import _posixshmem
+        import mmap
+        import os
+        fd = _posixshmem.shm_open("/" + name, os.O_RDWR, mode=0o600)
+        try:
+            self.size = os.fstat(fd).st_size
+            self._mmap = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        self.name = name
+        self.buf = memoryview(self._mmap)
+
+    def close(self) -> None:
+        self.buf.release()
+        self._mmap.close()
+
+
+def _open_shared_memory(name: Optional[str] = None, size: int = 0):
+    from multiprocessing import shared_memory
+    if name is None:
+        return shared_memory.SharedMemory(create=True, size=size)
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+    # before Python 3.13 SharedMemory registers the block with the resource tracker, which then unlinks it
+    # when the attaching process (or, for a spawned worker, its parent) exits; only the owner should do that,
+    # so the block is opened directly. Windows has no resource tracker and no _posixshmem.
+    try:
+        return _AttachedBlock(name)
+    except ImportError:
+        return shared_memory.SharedMemory(name)
+
+
+def flatten_script(script: Script) -> bytes:
+    """
+    Lay a script out in the flat form described above.
+    """
+    strings: Dict[str, int] = {}
+
+    def sid(s: str) -> int:
+        n = strings.get(s)
+        if n is None:
+            n = strings[s] = len(strings)
+        return n
+
+    ids: List[int] = []
+
+    def id_list(items) -> List[int]:
+        start = len(ids)
+        ids.extend(sid(s) for s in items)
+        return [start, len(items)]
+
+    transforms: List[int] = []
+    reassembly: List[int] = []
+
+    def transform_list(transformations: List[Transform]) -> List[int]:
+        start = len(transforms) // _TRANSFORM_WORDS
+        for t in transformations:
+            first = len(reassembly) // _REASSEMBLY_WORDS
+            for r in t.reassembly_rules:
+                reassembly.extend(id_list(r))
+            transforms.extend(id_list(t.decomposition) + [first, len(t.reassembly_rules)])
+        return [start, len(transformations)]
+
+    sid("")
+    hello = id_list(script.hello_message)
+    rules: List[int] = []
+    for rule in script.rules.values():
+        rules.extend([sid(rule.keyword), sid(rule.word_substitution), rule.precedence, sid(rule.link_keyword)]
+                     + id_list(rule.tags) + transform_list(rule.transformations))
+    memory = [sid(script.mem_rule.keyword)] + transform_list(script.mem_rule.transformations)
+    tags: List[int] = []
+    tag_map = collect_tags(script.rules)
+    for tag, keywords in tag_map.items():
+        tags.extend([sid(tag)] + id_list(keywords))
+
+    keywords = [rule.keyword.encode() for rule in script.rules.values()]
+    ordered = sorted(range(len(keywords)), key=keywords.__getitem__)
+
+    text = bytearray()
+    offsets = [0]
+    for s in strings:  # in id order
+        text += s.encode()
+        offsets.append(len(text))
+
+    header = [0] * _HEADER_WORDS
+    body: List[int] = []
+    for index, section in ((_H_STRING_OFFSETS, offsets), (_H_IDS, ids), (_H_RULES, rules), (_H_SORTED, ordered),
+                           (_H_TRANSFORMS, transforms), (_H_REASSEMBLY, reassembly), (_H_TAGS, tags)):
+        header[index] = _HEADER_WORDS + len(body)
+        body.extend(section)
+    header[_H_MAGIC] = _MAGIC
+    header[_H_VERSION] = _VERSION
+    header[_H_WORDS] = _HEADER_WORDS + len(body)
+    header[_H_STRINGS] = len(strings)
+    header[_H_RULE_COUNT] = len(script.rules)
+    header[_H_TAG_COUNT] = len(tag_map)
+    header[_H_HELLO], header[_H_HELLO_COUNT] = hello
+    header[_H_MEMORY_KEYWORD], header[_H_MEMORY_TRANSFORMS], header[_H_MEMORY_TRANSFORM_COUNT] = memory
+
+    words = array("I", header + body)
+    if words.itemsize != 4:
+        raise RuntimeError("flatten_script needs a 32 bit array('I')")
+    if sys.byteorder != "little":
+        words.byteswap()
+    return words.tobytes() + bytes(text)
+
+
+class SharedRuleMap(Mapping):
+    """
+        The rules of a SharedScript, looked up by keyword without decoding the whole script. Rules are decoded
+        into RuleKeyword objects when asked for, and the most recently used are kept. Safe to use from several
+        threads, as ThreadPoolEliza does.
+    """
+    def __init__(self, shared: "SharedScript", cache_size: int):
+        self._shared = shared
+        self._cache: "OrderedDict[int, RuleKeyword]" = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
+
+    def _find(self, keyword: str) -> int:
+        shared = self._shared
+        u32 = shared.u32
+        target = keyword.encode()
+        sorted_rules = u32[_H_SORTED]
+        lo, hi = 0, u32[_H_RULE_COUNT]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            rule = u32[sorted_rules + mid]
+            found = shared.string_bytes(u32[u32[_H_RULES] + rule * _RULE_WORDS])
+            if found < target:
+                lo = mid + 1
+            elif found > target:
+                hi = mid
+            else:
+                return rule
+        return -1
+
+    def rule(self, number: int) -> RuleKeyword:
+        with self._cache_lock:
+            rule = self._cache.get(number)
+            if rule is not None:
+                self._cache.move_to_end(number)
+                return rule
+        rule = self._shared.decode_rule(number)
+        with self._cache_lock:
+            # another thread may have decoded it meanwhile: keep one RuleKeyword per rule
+            rule = self._cache.setdefault(number, rule)
+            self._cache.move_to_end(number)
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return rule
+
+    def __getitem__(self, keyword: str) -> RuleKeyword:
+        number = self._find(keyword)
+        if number < 0:
+            raise KeyError(keyword)
+        return self.rule(number)
+
+    def __contains__(self, keyword) -> bool:
+        return isinstance(keyword, str) and self._find(keyword) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        shared = self._shared
+        base = shared.u32[_H_RULES]
+        for n in range(len(self)):
+            yield shared.string(shared.u32[base + n * _RULE_WORDS])
+
+    def __len__(self) -> int:
+        return self._shared.u32[_H_RULE_COUNT]
+
+
+class SharedScript(Script):
+    """
+        A script read in place from a shared memory block written by SharedScript.create(). It can be used
+        wherever a Script is: pass its tags to Eliza to avoid collecting them from every rule, as in
+
+            shared = SharedScript.attach(name)
+            eliza = Eliza(shared, shared.tags)
+    """
+    def __init__(self, shm, owner: bool, cache_size: int = DEFAULT_CACHE_SIZE):
+        super().__init__()
+        self.shm = shm
+        self.owner = owner
+        buf = shm.buf.toreadonly()
+        u32 = buf[:4 * _HEADER_WORDS].cast("I")
+        if u32[_H_MAGIC] != _MAGIC or u32[_H_VERSION] != _VERSION:
+            raise RuntimeError("not a shared ELIZA script, or a different version")
+        words = u32[_H_WORDS]
+        u32.release()
+        self.u32 = buf[:4 * words].cast("I")
+        self.text = buf[4 * words:]
+        self._buf = buf
+
+        self.rules = SharedRuleMap(self, cache_size)
+        self.hello_message = self._strings(self.u32[_H_HELLO], self.u32[_H_HELLO_COUNT])
+        self.mem_rule = RuleMemory(self.string(self.u32[_H_MEMORY_KEYWORD]))
+        self._add_transformations(self.mem_rule, self.u32[_H_MEMORY_TRANSFORMS], self.u32[_H_MEMORY_TRANSFORM_COUNT])
+        self.tags: TagMap = OrderedDict()
+        base = self.u32[_H_TAGS]
+        for n in range(self.u32[_H_TAG_COUNT]):
+            tag, start, count = self.u32[base + n * _TAG_WORDS:base + (n + 1) * _TAG_WORDS]
+            self.tags[self.string(tag)] = self._strings(start, count)
+
+    @classmethod
+    def create(cls, script: Script, cache_size: int = DEFAULT_CACHE_SIZE) -> "SharedScript":
+        """
+        Lay script out in a new shared memory block. The caller owns the block and must close() it when done,
+        which also removes it.
+        """
+        data = flatten_script(script)
+        shm = _open_shared_memory(None, len(data))
+        shm.buf[:len(data)] = data
+        return cls(shm, True, cache_size)
+
+    @classmethod
+    def attach(cls, name: str, cache_size: int = DEFAULT_CACHE_SIZE) -> "SharedScript":
+        """
+        Read the script in the shared memory block with the given name (SharedScript.name in the owner).
+        """
+        return cls(_open_shared_memory(name), False, cache_size)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def close(self) -> None:
+        with self.rules._cache_lock:
+            self.rules._cache.clear()
+        self.u32.release()
+        self.text.release()
+        self._buf.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def string(self, sid: int) -> str:
+        offsets = self.u32[_H_STRING_OFFSETS]
+        return str(self.text[self.u32[offsets + sid]:self.u32[offsets + sid + 1]], "utf-8")
+
+    def string_bytes(self, sid: int) -> bytes:
+        offsets = self.u32[_H_STRING_OFFSETS]
+        return self.text[self.u32[offsets + sid]:self.u32[offsets + sid + 1]].tobytes()
+
+    def _strings(self, start: int, count: int) -> List[str]:
+        base = self.u32[_H_IDS] + start
+        return [self.string(sid) for sid in self.u32[base:base + count]]
+
+    def _add_transformations(self, rule, start: int, count: int) -> None:
+        u32 = self.u32
+        base = u32[_H_TRANSFORMS] + start * _TRANSFORM_WORDS
+        for n in range(count):
+            d_start, d_count, r_first, r_count = u32[base + n * _TRANSFORM_WORDS:base + (n + 1) * _TRANSFORM_WORDS]
+            r_base = u32[_H_REASSEMBLY] + r_first * _REASSEMBLY_WORDS
+            reassembly_rules = [self._strings(*u32[r_base + i * _REASSEMBLY_WORDS:r_base + (i + 1) * _REASSEMBLY_WORDS])
+                                for i in range(r_count)]
+            rule.add_transformation_rule(self._strings(d_start, d_count), reassembly_rules)
+
+    def decode_rule(self, number: int) -> RuleKeyword:
+        base = self.u32[_H_RULES] + number * _RULE_WORDS
+        keyword, substitution, precedence, link, t_start, t_count, x_start, x_count = \
+            self.u32[base:base + _RULE_WORDS]
+        rule = RuleKeyword(self.string(keyword), self.string(substitution), precedence,
+                           self._strings(t_start, t_count), self.string(link))
+        self._add_transformations(rule, x_start, x_count)
+        return rule
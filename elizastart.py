@@ -0,0 +1,106 @@
+"""
+Startup-optimised entry point for ELIZA: no banner, no commands, no argument parsing, and the built-in DOCTOR
+script is loaded from its prebuilt snapshot instead of being read. Everything not needed to give the first
+response is imported lazily. Reads one remark per line from stdin and writes one response per line to stdout;
+a blank line or end of input ends the conversation.
+
+    python elizastart.py [SCRIPT_FILE]
+    python elizastart.py --measure      report import times (-X importtime) and time to first response
+"""
+import sys
+
+
+def load_script(argv):
+    if not argv:
+        from elizaprebuilt import load_doctor_script
+        return load_doctor_script()
+    from elizascript import ElizaScriptReader
+    with open(argv[0]) as script_file:
+        status, script = ElizaScriptReader.read_script(script_file.read())
+    return script
+
+
+def converse(argv) -> int:
+    from eliza import Eliza
+
+    try:
+        eliza = Eliza(load_script(argv))
+    except (OSError, RuntimeError) as e:
+        sys.stderr.write(f"Error loading script: {e.__str__()}\n")
+        return 2
+
+    out = sys.stdout
+    out.write(eliza.get_greeting() + "\n")
+    out.flush()
+    for line in sys.stdin:
+        line = line.rstrip("\n")
+        if not line:
+            break
+        out.write(eliza.response(line) + "\n")
+        out.flush()
+    return 0
+
+
+def measure(remark: str = "I AM UNHAPPY.", runs: int = 5) -> int:
+    """
+    Run this entry point under -X importtime and report the best of several runs: the time a bare interpreter
+    takes to start, the time to ELIZA's first response, and the slowest imports of the last run. The runs are of
+    a temporary copy of the modules compiled to bytecode, as they would be once installed, since a run with
+    PYTHONDONTWRITEBYTECODE set or stale .pyc files would otherwise time the compiler; nothing is written next
+    to the sources.
+    """
+    import tempfile
+    with tempfile.TemporaryDirectory() as copy:
+        return _measure_copy(copy, remark, runs)
+
+
+def _measure_copy(copy: str, remark: str, runs: int) -> int:
+    import compileall
+    import os
+    import shutil
+    import subprocess
+    import time
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in os.listdir(here):
+        if name.endswith(".py"):
+            shutil.copy2(os.path.join(here, name), copy)
+    compileall.compile_dir(copy, maxlevels=0, quiet=1)
+
+    def first_response(args, lines):
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, "-X", "importtime"] + args, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        proc.stdin.write(remark + "\n")
+        proc.stdin.flush()
+        for _ in range(lines):
+            proc.stdout.readline()
+        elapsed = time.perf_counter() - start
+        _, err = proc.communicate("\n")
+        return elapsed, err
+
+    bare = min(first_response(["-c", "import sys; print(sys.stdin.readline())"], 1)[0] for _ in range(runs))
+    results = [first_response([os.path.join(copy, os.path.basename(__file__))], 2) for _ in range(runs)]
+    total = min(elapsed for elapsed, _ in results)
+
+    imports = []
+    for row in results[-1][1].splitlines():
+        if row.startswith("import time:") and "|" in row and "cumulative" not in row:
+            _, cumulative, name = row.split("|")
+            if len(name) - len(name.lstrip()) == 1:  # top level imports only
+                imports.append((int(cumulative), name.strip()))
+    imports.sort(reverse=True)
+
+    print(f"interpreter start:        {bare * 1000:7.1f} ms")
+    print(f"to first response:        {total * 1000:7.1f} ms")
+    print(f"ELIZA's share:            {(total - bare) * 1000:7.1f} ms")
+    print("slowest imports (cumulative, top level):")
+    for cumulative, name in imports[:10]:
+        print(f"  {cumulative / 1000:7.1f} ms  {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--measure"]:
+        sys.exit(measure())
+    sys.exit(converse(sys.argv[1:]))
@@ -0,0 +1,179 @@
+"""
+Conversations kept in two tiers: the recently used in memory, in a SessionManager, and the rest in a SQLite
+database as encode_session() snapshots. A session is written out when it is evicted from memory and read back
+in the next time it is spoken to.
+"""
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Hashable, Iterator, Optional
+
+from elizalogic import DEFAULT_MAX_MEMORIES, DROP_OLDEST
+from elizasession import EVICT_DROP, SessionManager, SessionState, encode_session
+
+
+class ConnectionPool:
+    """
+        A fixed number of connections to one SQLite database, handed out to one thread at a time.
+    """
+    def __init__(self, path: str, size: int = 2):
+        self.path = path
+        self._idle: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._all = []
+        for _ in range(size):
+            conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            if path != ":memory:":
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            self._all.append(conn)
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self) -> None:
+        for conn in self._all:
+            conn.close()
+        self._all = []
+
+
+class TieredSessionStore:
+    """
+        Many conversations with one Eliza, by session id, as SessionManager, except that sessions evicted from
+        memory are spilled to SQLite rather than forgotten. Spilled sessions are written in batches of
+        batch_size, one transaction per batch; a session waiting in an unwritten batch is taken straight back
+        from it. Sessions are only lost if they are dropped, or the process dies with a batch unwritten: call
+        flush() or close() to write everything out.
+
+        Use path ":memory:" only with pool_size 1, as each connection to it is a separate database.
+        max_memories and memory_policy are the MEMORY queue settings of sessions, whether new or read back in.
+    """
+    def __init__(self, eliza, path: str, max_hot: int = 100000, ttl: Optional[float] = None,
+                 batch_size: int = 256, pool_size: int = 2, max_memories: int = DEFAULT_MAX_MEMORIES,
+                 memory_policy: str = DROP_OLDEST):
+        self.eliza = eliza
+        self.pool = ConnectionPool(path, pool_size)
+        with self.pool.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions (session_id PRIMARY KEY, snapshot BLOB NOT NULL)")
+        self.batch_size = batch_size
+        self._pending: Dict[Hashable, bytes] = {}
+        self._lock = threading.RLock()
+        self.hot = SessionManager(eliza, max_hot, ttl, self._spill, loader=self._fault, max_memories=max_memories,
+                                  memory_policy=memory_policy)
+        # metrics
+        self.hits = 0
+        self.faults = 0
+        self.fault_seconds = 0.0
+        self.spills = 0
+        self.spill_batches = 0
+        self.spill_seconds = 0.0
+        self.spilled_bytes = 0
+
+    def respond(self, session_id: Hashable, text: str) -> str:
+        """
+        ELIZA's response to text in the conversation session_id, which is read back in or started as needed.
+        """
+        with self._lock:
+            return self.eliza.response(text, self.get(session_id))
+
+    def get(self, session_id: Hashable) -> SessionState:
+        with self._lock:
+            if session_id in self.hot:
+                self.hits += 1
+            return self.hot.get(session_id)
+
+    def drop(self, session_id: Hashable) -> None:
+        """
+        End the conversation session_id, in memory and on disk.
+        """
+        with self._lock:
+            self.hot.drop(session_id)
+            self._pending.pop(session_id, None)
+            with self.pool.connection() as conn:
+                conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def _spill(self, session_id: Hashable, state: SessionState, reason: str) -> None:
+        if reason == EVICT_DROP:
+            return
+        snapshot = encode_session(state)
+        self._pending[session_id] = snapshot
+        self.spills += 1
+        self.spilled_bytes += len(snapshot)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def _fault(self, session_id: Hashable) -> Optional[SessionState]:
+        start = time.perf_counter()
+        snapshot = self._pending.pop(session_id, None)
+        if snapshot is None:
+            with self.pool.connection() as conn:
+                row = conn.execute("SELECT snapshot FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            snapshot = row[0]
+        state = self.hot.new_state(snapshot)
+        self.faults += 1
+        self.fault_seconds += time.perf_counter() - start
+        return state
+
+    def flush(self, include_hot: bool = False) -> None:
+        """
+        Write the pending batch of spilled sessions in one transaction.
+        :param include_hot: Also write the sessions held in memory, which stay there.
+        """
+        with self._lock:
+            rows = list(self._pending.items())
+            if include_hot:
+                rows.extend((session_id, encode_session(state)) for session_id, state in self.hot.items())
+            if not rows:
+                return
+            start = time.perf_counter()
+            with self.pool.connection() as conn:
+                conn.execute("BEGIN")
+                try:
+                    conn.executemany("INSERT OR REPLACE INTO sessions (session_id, snapshot) VALUES (?, ?)", rows)
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+                conn.execute("COMMIT")
+            self._pending.clear()
+            self.spill_batches += 1
+            self.spill_seconds += time.perf_counter() - start
+
+    def close(self) -> None:
+        """
+        Write every session out, those in memory included, and close the database.
+        """
+        with self._lock:
+            self.flush(include_hot=True)
+            self.pool.close()
+
+    def stored_sessions(self) -> int:
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def metrics(self) -> Dict[str, float]:
+        """
+        hit_rate: share of lookups found in memory; fault_ms, spill_batch_ms: mean time to read a session back,
+        and to write a batch; bytes_per_session: mean snapshot size written.
+        """
+        lookups = self.hits + self.faults + self.hot.created
+        return {
+            "hot_sessions": len(self.hot),
+            "pending_spills": len(self._pending),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "hits": self.hits,
+            "faults": self.faults,
+            "created": self.hot.created,
+            "spills": self.spills,
+            "fault_ms": 1000 * self.fault_seconds / self.faults if self.faults else 0.0,
+            "spill_batch_ms": 1000 * self.spill_seconds / self.spill_batches if self.spill_batches else 0.0,
+            "bytes_per_session": self.spilled_bytes / self.spills if self.spills else 0.0,
+        }
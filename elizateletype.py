@@ -0,0 +1,106 @@
+"""
+Responses typed out at the speed of the IBM 2741 terminal JW's users sat at, 134.5 baud or about 14.8
+characters a second. Every paced stream on an event loop is advanced by one shared timer: on each tick the
+characters that have come due on each stream are written in one write, so thousands of conversations can be
+typed out at once by a single thread that is almost always idle.
+"""
+import asyncio
+import sys
+from typing import Callable, List, Optional
+
+IBM_2741_CPS = 14.8  # characters per second
+DEFAULT_TICK = 0.05  # seconds between writes; a 2741 types a character every 0.068 s
+
+
+class _Stream:
+    __slots__ = ("write", "text", "start", "sent", "future")
+
+    def __init__(self, write: Callable[[bytes], None], text: str, start: float, future: asyncio.Future):
+        self.write = write
+        self.text = text
+        self.start = start
+        self.sent = 0
+        self.future = future
+
+
+class TeletypePacer:
+    """
+        Writes text at cps characters a second through write callables, such as StreamWriter.write, on the
+        running event loop. Text is paced by character and written as UTF-8, so a character is never split
+        between writes.
+
+            pacer = TeletypePacer()
+            await pacer.type(writer.write, "PLEASE CONTINUE\\n")
+
+        Each character is written within a tick of when it comes due. The times are measured from the start of
+        each text, so they do not drift however late a tick runs.
+    """
+    def __init__(self, cps: float = IBM_2741_CPS, tick: float = DEFAULT_TICK):
+        self.cps = cps
+        self.tick = tick
+        self._streams: List[_Stream] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.ticks = 0
+        self.writes = 0
+
+    def active(self) -> int:
+        """
+        The number of texts being typed.
+        """
+        return len(self._streams)
+
+    def type(self, write: Callable[[bytes], None], text: str) -> "asyncio.Future[None]":
+        """
+        Start typing text through write.
+        :return: A future that is done when the last character has been written.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if not text:
+            future.set_result(None)
+            return future
+        self._streams.append(_Stream(write, text, loop.time(), future))
+        if self._timer is None:
+            self._advance(loop)
+        return future
+
+    def _advance(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._timer = None
+        self.ticks += 1
+        now = loop.time()
+        typing = []
+        for stream in self._streams:
+            if stream.future.done():
+                continue  # cancelled
+            due = min(len(stream.text), 1 + int((now - stream.start) * self.cps))
+            if due > stream.sent:
+                try:
+                    stream.write(stream.text[stream.sent:due].encode())
+                except Exception as e:
+                    stream.future.set_exception(e)
+                    continue
+                self.writes += 1
+                stream.sent = due
+            if stream.sent == len(stream.text):
+                stream.future.set_result(None)
+            else:
+                typing.append(stream)
+        self._streams = typing
+        if typing:
+            self._timer = loop.call_at(now + self.tick, self._advance, loop)
+
+
+def type_out(text: str, cps: float = IBM_2741_CPS, out=None) -> None:
+    """
+    Print text at cps characters a second, for the interactive conversation.
+    """
+    out = out or sys.stdout
+
+    def write(data: bytes) -> None:
+        out.write(data.decode())
+        out.flush()
+
+    async def run():
+        await TeletypePacer(cps).type(write, text + "\n")
+
+    asyncio.run(run())
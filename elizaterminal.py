@@ -0,0 +1,198 @@
+"""
+Conversations on many terminals, serial lines or pseudo-terminals, driven by one process from one asyncio event
+loop, as for a museum installation with a row of old terminals. Each terminal is put in raw mode and ELIZA
+does the line discipline herself: she echoes what is typed, handles erase (BS or DEL) and kill (Ctrl-U), ends
+lines at CR or LF and writes CR LF. A blank line ends the conversation and the next visitor is greeted.
+
+    python main.py --port --portname /dev/ttyUSB0,/dev/ttyUSB1
+"""
+import asyncio
+import os
+import termios
+import tty
+from typing import Iterable, List, Optional, Union
+
+from eliza import Eliza
+from elizalogic import DEFAULT_MAX_MEMORIES, Script
+from elizaprefork import MAX_LINE
+from elizasession import SessionState
+from elizateletype import TeletypePacer
+
+ERASE = (b"\b", b"\x7f")
+KILL = b"\x15"  # Ctrl-U
+END_OF_LINE = (b"\r", b"\n")
+
+
+class Terminal:
+    """
+        One terminal: its device, line being typed, output waiting to be written and conversation.
+    """
+    def __init__(self, mux: "TerminalMultiplexer", device: Union[str, int]):
+        self.mux = mux
+        self.name = device if isinstance(device, str) else os.ttyname(device)
+        self.fd = os.open(device, os.O_RDWR | os.O_NOCTTY) if isinstance(device, str) else device
+        os.set_blocking(self.fd, False)
+        self.saved_mode = termios.tcgetattr(self.fd)
+        tty.setraw(self.fd)
+        self.line = bytearray()
+        self.last = b""  # the byte read before
+        self.output = bytearray()
+        self.session = SessionState(mux.engine.script, DEFAULT_MAX_MEMORIES)
+        self.typing: Optional[asyncio.Task] = None  # the response being typed out
+        self.pending: List[str] = []  # lines entered and not yet answered
+        self.conversations = 0
+
+    def write(self, data: bytes) -> None:
+        """
+        Queue data for the terminal, writing what it will take now and the rest when it is ready.
+        """
+        data = data.replace(b"\n", b"\r\n")
+        if not self.output:
+            try:
+                n = os.write(self.fd, data)
+            except BlockingIOError:
+                n = 0
+            data = data[n:]
+            if not data:
+                return
+            self.mux.loop.add_writer(self.fd, self._flush)
+        self.output += data
+
+    def _flush(self) -> None:
+        try:
+            n = os.write(self.fd, self.output)
+        except BlockingIOError:
+            return
+        except OSError:
+            self.mux.loop.remove_writer(self.fd)
+            self.output.clear()
+            return
+        del self.output[:n]
+        if not self.output:
+            self.mux.loop.remove_writer(self.fd)
+
+    def readable(self) -> None:
+        try:
+            data = os.read(self.fd, 1024)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""  # e.g. EIO when the other end of a pty has closed
+        if not data:
+            self.mux.loop.remove_reader(self.fd)
+            return
+        for byte in (data[i:i + 1] for i in range(len(data))):
+            if byte in END_OF_LINE:
+                if byte == b"\n" and self.last == b"\r":
+                    pass  # the LF of CR LF
+                else:
+                    self.write(b"\n")
+                    self.entered(self.line.decode("ascii", "replace"))
+                    self.line.clear()
+            elif byte in ERASE:
+                if self.line:
+                    del self.line[-1]
+                    self.write(b"\b \b")
+            elif byte == KILL:
+                self.write(b"\b \b" * len(self.line))
+                self.line.clear()
+            elif byte >= b" " and len(self.line) < self.mux.max_line:
+                self.line += byte
+                self.write(byte)
+            self.last = byte
+
+    def entered(self, line: str) -> None:
+        self.pending.append(line)
+        if self.typing is None or self.typing.done():
+            self.typing = self.mux.loop.create_task(self._type())
+
+    async def _type(self, text: str = "") -> None:
+        # type text, then the answers to the lines entered, one after another
+        if text:
+            await self.mux.send(self, text)
+        while self.pending:
+            line = self.pending.pop(0)
+            if not line.strip():
+                self.session = SessionState(self.mux.engine.script, DEFAULT_MAX_MEMORIES)
+                self.conversations += 1
+                text = "\n" + self.mux.engine.get_greeting()
+            else:
+                text = self.mux.engine.response(line, self.session)
+                self.mux.responses += 1
+            await self.mux.send(self, text + "\n")
+
+    def greet(self) -> None:
+        self.typing = self.mux.loop.create_task(self._type(self.mux.engine.get_greeting() + "\n"))
+
+    def close(self) -> None:
+        self.mux.loop.remove_reader(self.fd)
+        self.mux.loop.remove_writer(self.fd)
+        if self.typing is not None:
+            self.typing.cancel()
+        try:
+            termios.tcsetattr(self.fd, termios.TCSAFLUSH, self.saved_mode)
+        except termios.error:
+            pass
+        os.close(self.fd)
+
+
+class TerminalMultiplexer:
+    """
+        Serves a conversation on each of the given terminals, device paths or open file descriptors of ttys
+        (which stop() closes), from the running event loop: reads are non-blocking and writes are queued until
+        the device takes them, so there is no thread per terminal. With a pacer, responses are typed out at its
+        speed.
+    """
+    def __init__(self, script: Script, devices: Iterable[Union[str, int]], pacer: Optional[TeletypePacer] = None,
+                 max_line: int = MAX_LINE):
+        self.engine = Eliza(script)
+        self.devices = list(devices)
+        self.pacer = pacer
+        self.max_line = max_line
+        self.terminals: List[Terminal] = []
+        self.responses = 0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def send(self, terminal: Terminal, text: str) -> None:
+        if self.pacer is None:
+            terminal.write(text.encode())
+        else:
+            await self.pacer.type(terminal.write, text)
+
+    def start(self) -> None:
+        """
+        Open the terminals and greet each one.
+        """
+        self.loop = asyncio.get_running_loop()
+        for device in self.devices:
+            terminal = Terminal(self, device)
+            self.terminals.append(terminal)
+            self.loop.add_reader(terminal.fd, terminal.readable)
+            terminal.greet()
+
+    def stop(self) -> None:
+        """
+        Put the terminals back in the mode they were in and close them.
+        """
+        for terminal in self.terminals:
+            terminal.close()
+        self.terminals = []
+
+
+def serve(script: Script, devices: List[str], announce=print, pacer: Optional[TeletypePacer] = None) -> None:
+    """
+    Serve the terminals until interrupted.
+    """
+    async def run():
+        mux = TerminalMultiplexer(script, devices, pacer)
+        mux.start()
+        announce(f"Serving {len(devices)} terminals: {', '.join(devices)}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            mux.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
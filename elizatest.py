@@ -1,3 +1,5 @@
+import os
+import socket
 import unittest
 
 from elizaconstant import TagMap
@@ -708,11 +710,19 @@ class TestBCDFilter(unittest.TestCase):
 
 from eliza import Eliza
 from elizautil import collect_tags, eliza_specific_join
-from elizascript import ElizaScriptReader
+from elizascript import ElizaScriptReader, IncrementalScriptReader
 from DOCTOR_1966_01_CACM import CACM_1966_01_DOCTOR_script
 import elizascript
 from eliza_test_conversations import CACM_1966_01_DOCTOR_test_script
 from eliza_test_conversations import cacm_1966_conversation
+from elizareload import ScriptReloader
+from elizaprefork import PreforkServer
+from elizaprebuilt import load_doctor_script, script_from_data, script_to_data
+from elizasession import SessionManager, SessionState, EVICT_DROP, EVICT_LRU, EVICT_TTL
+from elizasession import decode_session, encode_session
+from elizashared import SharedScript
+from elizastore import TieredSessionStore
+from elizajournal import SessionJournal
 
 
 class TestEliza(unittest.TestCase):
@@ -782,5 +792,1100 @@ class TestEliza(unittest.TestCase):
             self.assertEqual(response, real)
 
 
+class TestScriptReload(unittest.TestCase):
+    script_text = ''.join(["(HELLO)\n",
+                           "(MOTHER\n",
+                           "    ((0 MOTHER 0)\n",
+                           "        (M1)\n",
+                           "        (M2)\n",
+                           "        (M3)))\n",
+                           "(FATHER\n",
+                           "    ((0 FATHER 0)\n",
+                           "        (F1)\n",
+                           "        (F2)))\n",
+                           "(NONE\n",
+                           "    ((0)\n",
+                           "        (N1)\n",
+                           "        (N2)))\n",
+                           "(MEMORY MOTHER\n",
+                           "    (0 MOTHER 0 = A)\n",
+                           "    (0 MOTHER 0 = B)\n",
+                           "    (0 MOTHER 0 = C)\n",
+                           "    (0 MOTHER 0 = D))\n"])
+
+    def test_reload(self):
+        status, script = ElizaScriptReader.read_script(self.script_text)
+        eliza = Eliza(script)
+        self.assertEqual(eliza.response("my mother"), "M1")
+        self.assertEqual(eliza.response("my father"), "F1")
+        self.assertEqual(eliza.limit, 3)
+        memories = list(eliza.session.memories)
+        self.assertEqual(len(memories), 1)
+
+        # FATHER gains a reassembly rule; MOTHER is untouched
+        reloader = ScriptReloader(eliza)
+        edited = self.script_text.replace("        (F2)))", "        (F2)\n        (F3)))")
+        self.assertEqual(reloader.reload_async(edited).result(), "success")
+        reloader.close()
+
+        self.assertEqual(eliza.response("my mother"), "M2")
+        self.assertEqual(eliza.response("my father"), "F1")
+        self.assertEqual(eliza.response("my father"), "F2")
+        self.assertEqual(eliza.response("my father"), "F3")
+        self.assertEqual(eliza.session.memories[0], memories[0])
+
+        # a bad script leaves the running one in place
+        with self.assertRaises(RuntimeError):
+            reloader.reload("(HELLO)")
+        self.assertEqual(eliza.response("my mother"), "M3")
+
+    def test_shared_script(self):
+        status, script = ElizaScriptReader.read_script(self.script_text)
+        eliza = Eliza(script)
+        other = SessionState(script)
+        self.assertEqual(eliza.response("my mother"), "M1")
+        self.assertEqual(eliza.response("my mother", other), "M1")
+        self.assertEqual(eliza.response("my mother"), "M2")
+        self.assertEqual(script.rules["MOTHER"].transformations[0].next_reassembly_rule, 0)
+
+
+class TestIncrementalScriptReader(unittest.TestCase):
+    def test_incremental_script_reader(self):
+        reader = IncrementalScriptReader()
+        status, script = reader.read_script(CACM_1966_01_DOCTOR_script)
+        status, expected = ElizaScriptReader.read_script(CACM_1966_01_DOCTOR_script)
+        self.assertEqual(elizascript.script_to_string(script), elizascript.script_to_string(expected))
+        self.assertEqual(reader.tags, collect_tags(expected.rules))
+
+        edited = CACM_1966_01_DOCTOR_script.replace("(PLEASE DON'T APOLIGIZE)", "(PLEASE DON'T APOLOGIZE)")
+        status, script2 = reader.read_script(edited)
+        self.assertEqual(reader.recompiled, 1)
+        self.assertEqual(script2.rules["SORRY"].transformations[0].reassembly_rules[0],
+                         ["PLEASE", "DON'T", "APOLOGIZE"])
+        self.assertIs(script2.rules["DONT"], script.rules["DONT"])
+        self.assertIs(script2.mem_rule, script.mem_rule)
+
+        edited = edited.replace("(MOTHER DLIST(/NOUN FAMILY))", "(MOTHER DLIST(/FAMILY))")
+        status, script3 = reader.read_script(edited)
+        self.assertEqual(reader.recompiled, 1)
+        self.assertEqual(reader.tags, collect_tags(script3.rules))
+        self.assertEqual(reader.tags["NOUN"], ["FATHER"])
+
+        # errors are reported exactly as by ElizaScriptReader
+        for broken in [edited.replace("(DONT = DON'T)", "(DONT = DON'T"), edited.replace("(MEMORY MY", "(MEMORY MINE"),
+                       edited + "(SORRY ((0) (X)))"]:
+            with self.assertRaises(RuntimeError) as expected_error:
+                ElizaScriptReader.read_script(broken)
+            with self.assertRaises(RuntimeError) as error:
+                reader.read_script(broken)
+            self.assertEqual(str(error.exception), str(expected_error.exception))
+        status, script4 = reader.read_script(edited)
+        self.assertEqual(elizascript.script_to_string(script4), elizascript.script_to_string(script3))
+
+
+class TestPrebuiltScript(unittest.TestCase):
+    def test_prebuilt_doctor_script(self):
+        # if this fails, regenerate the snapshot with 'python elizaprebuilt.py'
+        status, script = ElizaScriptReader.read_script(CACM_1966_01_DOCTOR_script)
+        prebuilt = load_doctor_script()
+        self.assertEqual(elizascript.script_to_string(prebuilt), elizascript.script_to_string(script))
+        self.assertEqual(script_from_data(script_to_data(script)).rules["MY"].transformations[0].key,
+                         script.rules["MY"].transformations[0].key)
+
+        eliza = Eliza(prebuilt)
+        for prompt, response in cacm_1966_conversation:
+            self.assertEqual(eliza.response(prompt), response)
+
+    def test_startup_imports(self):
+        import subprocess
+        import sys
+        # the path to the first response imports neither typing nor re
+        code = ("import sys; from eliza import Eliza; from elizaprebuilt import load_doctor_script; "
+                "Eliza(load_doctor_script()).response('I AM UNHAPPY.'); print(sorted({'typing', 're'} & set(sys.modules)))")
+        output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), "[]")
+
+
+class TestSessionManager(unittest.TestCase):
+    def test_sessions(self):
+        now = [0.0]
+        evicted = []
+        manager = SessionManager(Eliza(load_doctor_script()), max_sessions=3, ttl=60, clock=lambda: now[0],
+                                 on_evict=lambda session_id, state, reason: evicted.append((session_id, reason)))
+
+        # interleaved conversations each go as they would alone
+        for prompt, response in cacm_1966_conversation:
+            for session_id in ("a", "b"):
+                self.assertEqual(manager.respond(session_id, prompt), response)
+        self.assertEqual(len(manager), 2)
+
+        # least recently used goes first
+        manager.respond("c", "HELLO")
+        manager.respond("a", "HELLO")
+        manager.respond("d", "HELLO")
+        self.assertEqual(evicted, [("b", EVICT_LRU)])
+        self.assertEqual(set(manager), {"a", "c", "d"})
+
+        # idle sessions expire
+        now[0] = 30
+        manager.respond("c", "HELLO")
+        now[0] = 61
+        self.assertEqual(manager.expire(), 2)
+        self.assertEqual(list(manager), ["c"])
+        self.assertEqual(evicted[1:], [("a", EVICT_TTL), ("d", EVICT_TTL)])
+
+        # an evicted session can be put back
+        state = manager.drop("c")
+        self.assertEqual(evicted[-1], ("c", EVICT_DROP))
+        manager.put("c", state)
+        self.assertIs(manager.get("c", create=False), state)
+        self.assertIsNone(manager.get("x", create=False))
+        self.assertEqual(manager.stats()["created"], 4)
+
+
+class TestMemoryQueue(unittest.TestCase):
+    def test_bounded(self):
+        from elizalogic import MemoryQueue, DROP_NEWEST
+        queue = MemoryQueue(["A", "B"], maxlen=3)
+        queue.append("C")
+        queue.append("D")
+        self.assertEqual(queue, ["B", "C", "D"])
+        self.assertEqual((queue.pop(0), len(queue), queue.dropped), ("B", 2, 1))
+
+        queue = MemoryQueue(["A", "B", "C"], maxlen=2, policy=DROP_NEWEST)
+        self.assertEqual((list(queue), queue.dropped), (["A", "B"], 1))
+
+        # memories are shared between sessions
+        a, b = MemoryQueue(), MemoryQueue()
+        a.append(" ".join(["YOUR", "MOTHER"]))
+        b.append(" ".join(["YOUR", "MOTHER"]))
+        self.assertIs(a[0], b[0])
+
+        # as JW's, unbounded unless asked, and the interned strings are forgotten least recently used first
+        import elizalogic
+        limit = elizalogic._INTERN_LIMIT
+        elizalogic._INTERN_LIMIT = 3
+        try:
+            queue = MemoryQueue()
+            for memory in ("A", "B", "A", "C", "D") * 20:
+                queue.append("INTERNED " + memory)
+            self.assertEqual((len(queue), queue.dropped), (100, 0))
+            self.assertEqual(list(elizalogic._interned), ["INTERNED A", "INTERNED C", "INTERNED D"])
+        finally:
+            elizalogic._INTERN_LIMIT = limit
+        eliza = Eliza(load_doctor_script())
+        for _ in range(20):
+            eliza.response("MY MOTHER IS KIND")
+        self.assertIsNone(eliza.session.memories.maxlen)
+        self.assertEqual(len(eliza.session.memories), 20)
+
+        # a chatty session keeps at most max_memories
+        manager = SessionManager(Eliza(load_doctor_script()), max_memories=2)
+        for _ in range(3):
+            for remark in ("MY MOTHER IS KIND", "MY FATHER IS KIND", "MY SISTER IS KIND"):
+                manager.respond("s", remark)
+        stats = manager.stats()
+        self.assertEqual(stats["memory_depth_max"], 2)
+        self.assertGreater(stats["memories_dropped"], 0)
+
+
+class TestSessionSnapshot(unittest.TestCase):
+    def test_snapshot(self):
+        script = load_doctor_script()
+        eliza = Eliza(script)
+        self.assertLess(len(encode_session(SessionState(script))), 100)
+
+        # a conversation that keeps nothing but the snapshot between remarks
+        snapshot = encode_session(SessionState(script))
+        for prompt, response in cacm_1966_conversation:
+            state = decode_session(snapshot, script)
+            self.assertEqual(eliza.response(prompt, state), response)
+            snapshot = encode_session(state)
+        self.assertTrue(state.cursors)
+        self.assertTrue(state.memories)
+
+        for compress in (False, True):
+            restored = decode_session(encode_session(state, compress), script)
+            self.assertEqual((restored.limit, restored.cursors, restored.memories),
+                             (state.limit, state.cursors, state.memories))
+
+        # positions of rules the new script does not have are dropped
+        edited = script_from_data(script_to_data(script))
+        del edited.rules["YOU"]
+        restored = decode_session(snapshot, edited)
+        self.assertEqual(restored.cursors, {k: v for k, v in state.cursors.items() if k[0] != "YOU"})
+        self.assertIs(restored.script, edited)
+
+        # and so are positions of rules whose reassembly rules changed, as migrate() drops them
+        key = next(k for k in state.cursors if k[0] != "YOU")
+        edited = script_from_data(script_to_data(script))
+        edited.find_transform(key).reassembly_rules.append(["WHY", "NOT"])
+        restored = decode_session(snapshot, edited)
+        self.assertEqual(restored.cursors, {k: v for k, v in state.cursors.items() if k != key})
+        migrated = decode_session(snapshot, script)
+        migrated.migrate(edited)
+        self.assertEqual(migrated.cursors, restored.cursors)
+
+        for damaged in (b"", b"\x09\x00\x01\x00\x00", snapshot[:-1], snapshot + b"\x00"):
+            self.assertRaises(ValueError, decode_session, damaged, script)
+
+
+class TestTieredSessionStore(unittest.TestCase):
+    def test_spill_and_fault(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "sessions.db")
+            store = TieredSessionStore(Eliza(load_doctor_script()), path, max_hot=2, batch_size=2)
+            # four conversations taking turns through room for two: every turn is a spill and a fault
+            for prompt, response in cacm_1966_conversation:
+                for session_id in ("a", "b", "c", 7):
+                    self.assertEqual(store.respond(session_id, prompt), response)
+            metrics = store.metrics()
+            self.assertEqual((metrics["created"], metrics["hot_sessions"]), (4, 2))
+            self.assertGreater(metrics["faults"], 0)
+            self.assertGreater(metrics["bytes_per_session"], 0)
+            store.drop("c")
+            store.close()
+
+            store = TieredSessionStore(Eliza(load_doctor_script()), path)
+            self.assertEqual(store.stored_sessions(), 3)
+            state = store.get(7)
+            self.assertEqual(len(state.memories), 4)
+            self.assertEqual(store.metrics()["faults"], 1)
+            store.close()
+
+            # sessions read back in get the store's MEMORY queue settings
+            from elizalogic import DROP_NEWEST
+            store = TieredSessionStore(Eliza(load_doctor_script()), path, max_memories=2, memory_policy=DROP_NEWEST)
+            state = store.get(7)
+            self.assertEqual((state.memories.maxlen, state.memories.policy, len(state.memories)), (2, DROP_NEWEST, 2))
+            store.close()
+
+
+class TestSessionJournal(unittest.TestCase):
+    def test_journal(self):
+        import tempfile
+        from elizalogic import StringTracer
+        with tempfile.TemporaryDirectory() as tmp:
+            # room for one session in memory, so each turn rebuilds the other from its journal
+            journal = SessionJournal(Eliza(load_doctor_script()), tmp, compact_every=4, max_hot=1)
+            for prompt, response in cacm_1966_conversation:
+                for session_id in ("a", "b/c"):
+                    self.assertEqual(journal.respond(session_id, prompt), response)
+            self.assertGreater(journal.replayed, 0)
+            self.assertEqual(journal.compactions, 2 * (len(cacm_1966_conversation) // 4))
+
+            # a new journal over the same directory carries on where the old one stopped
+            tracer = StringTracer()
+            journal = SessionJournal(Eliza(load_doctor_script()), tmp)
+            tail = len(cacm_1966_conversation) % 4
+            self.assertEqual(journal.replay("a", tracer), [(prompt.upper().replace("?", "."), response) for
+                                                           prompt, response in cacm_1966_conversation[-tail:]])
+            self.assertTrue(tracer.text())
+            straight = Eliza(load_doctor_script())
+            for prompt, _ in cacm_1966_conversation:
+                straight.response(prompt)
+            rebuilt = journal.hot.get("b/c")
+            self.assertEqual((rebuilt.limit, rebuilt.cursors, rebuilt.memories),
+                             (straight.session.limit, straight.session.cursors, straight.session.memories))
+            journal.drop("a")
+            self.assertEqual(sorted(os.listdir(tmp)), ["b%2Fc.3.log", "b%2Fc.snap"])
+
+            # the ids 1 and "1" are different conversations, with different journals
+            journal = SessionJournal(Eliza(load_doctor_script()), tmp, max_hot=1)
+            for prompt, response in cacm_1966_conversation[:3]:
+                for session_id in (1, "1"):
+                    self.assertEqual(journal.respond(session_id, prompt), response)
+            self.assertEqual(sorted(os.listdir(tmp)), ["1.0.log", "b%2Fc.3.log", "b%2Fc.snap", "int=1.0.log"])
+
+
+@unittest.skipUnless(hasattr(os, "fork") and os.name == "posix", "the mapped session table needs POSIX")
+class TestMappedSessionTable(unittest.TestCase):
+    def test_shared_between_processes(self):
+        import tempfile
+        from elizammap import MappedSessionTable
+        script = load_doctor_script()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "sessions")
+            table = MappedSessionTable.create(path, script, capacity=8, memory_slots=8, heap_size=1 << 16)
+            try:
+                # every other remark of two conversations is answered by a separate process
+                for i, (prompt, response) in enumerate(cacm_1966_conversation):
+                    for session_id in ("a", "b"):
+                        if i % 2 == 0:
+                            self.assertEqual(table.respond(Eliza(script), session_id, prompt), response)
+                            continue
+                        read_end, write_end = os.pipe()
+                        pid = os.fork()
+                        if pid == 0:
+                            child = MappedSessionTable.open(path, script)
+                            os.write(write_end, child.respond(Eliza(script), session_id, prompt).encode())
+                            os._exit(0)
+                        os.close(write_end)
+                        os.waitpid(pid, 0)
+                        with os.fdopen(read_end) as f:
+                            self.assertEqual(f.read(), response)
+
+                straight = Eliza(script)
+                for prompt, _ in cacm_1966_conversation:
+                    straight.response(prompt)
+                with table.session("b") as session:
+                    self.assertEqual(dict(session.cursors.items()), straight.session.cursors)
+                    self.assertEqual(list(session.memories), straight.session.memories)
+                with table.session("c") as session:
+                    # a full queue drops its oldest memory
+                    for n in range(10):
+                        session.memories.append(f"MEMORY {n % 5}")
+                    self.assertEqual(list(session.memories), [f"MEMORY {n % 5}" for n in range(2, 10)])
+                    self.assertEqual(session.memories.pop(0), "MEMORY 2")
+                self.assertTrue(table.drop("a"))
+                with table.session("a", create=False) as session:
+                    self.assertIsNone(session)
+                self.assertRaises(RuntimeError, MappedSessionTable.open, path, ElizaScriptReader.read_script(
+                    CACM_1966_01_DOCTOR_script + "(EXTRA ((0) (MORE)))")[1])
+            finally:
+                table.close()
+
+
+class TestAsyncLineServer(unittest.TestCase):
+    def test_conversations(self):
+        import asyncio
+        from elizaasync import AsyncLineServer
+
+        async def run():
+            server = AsyncLineServer(load_doctor_script(), ("127.0.0.1", 0), max_line=200)
+            host, port = await server.start()
+            clients = [await asyncio.open_connection(host, port) for _ in range(3)]
+            for reader, _ in clients:
+                self.assertEqual(await reader.readline(), b"HOW DO YOU DO. PLEASE TELL ME YOUR PROBLEM\n")
+            for prompt, response in cacm_1966_conversation:
+                for _, writer in clients[:2]:
+                    writer.write(prompt.encode() + b"\n")
+                for reader, _ in clients[:2]:
+                    self.assertEqual((await reader.readline()).decode().rstrip("\n"), response)
+
+            # a line over the limit ends the conversation
+            reader, writer = clients[2]
+            writer.write(b"X" * 300 + b"\n")
+            self.assertEqual(await reader.read(), b"")
+            for _, writer in clients:
+                writer.close()
+            await server.stop()
+            self.assertEqual(server.responses, 2 * len(cacm_1966_conversation))
+
+        asyncio.run(run())
+
+
+class TestTeletypePacer(unittest.TestCase):
+    def test_pacing(self):
+        import asyncio
+        from elizaasync import AsyncLineServer
+        from elizateletype import TeletypePacer
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            pacer = TeletypePacer(cps=200, tick=0.01)
+            outputs = [[] for _ in range(20)]
+            texts = [f"LINE {n} " * (n % 3 + 1) for n in range(20)]
+            start = loop.time()
+            await asyncio.gather(*(pacer.type(outputs[n].append, texts[n]) for n in range(20)))
+            elapsed = loop.time() - start
+            self.assertEqual([b"".join(output).decode() for output in outputs], texts)
+            self.assertGreaterEqual(elapsed, (max(map(len, texts)) - 1) / 200)
+            self.assertLess(elapsed, (max(map(len, texts)) - 1) / 200 + 0.5)
+            self.assertGreater(len(outputs[0]), 1)  # written a few characters at a time
+            self.assertEqual(pacer.active(), 0)
+
+            # paced by character, never splitting one between writes
+            written = []
+            await pacer.type(written.append, "ÉLIZA SAYS “HELLO” 你好")
+            self.assertGreater(len(written), 1)
+            self.assertEqual("".join(data.decode() for data in written), "ÉLIZA SAYS “HELLO” 你好")
+
+            # a paced server says the same things
+            server = AsyncLineServer(load_doctor_script(), ("127.0.0.1", 0), pacer=TeletypePacer(cps=5000))
+            host, port = await server.start()
+            reader, writer = await asyncio.open_connection(host, port)
+            self.assertEqual(await reader.readline(), b"HOW DO YOU DO. PLEASE TELL ME YOUR PROBLEM\n")
+            for prompt, response in cacm_1966_conversation[:5]:
+                writer.write(prompt.encode() + b"\n")
+                self.assertEqual((await reader.readline()).decode().rstrip("\n"), response)
+            writer.close()
+            await server.stop()
+
+        asyncio.run(run())
+
+
+class TestTerminalMultiplexer(unittest.TestCase):
+    def test_ptys(self):
+        import asyncio
+        import os
+        from elizaterminal import TerminalMultiplexer
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            ptys = [os.openpty() for _ in range(12)]
+            mux = TerminalMultiplexer(load_doctor_script(), [os.ttyname(slave) for _, slave in ptys])
+            mux.start()
+            for _, slave in ptys:
+                os.close(slave)
+            masters = [master for master, _ in ptys]
+            received = {master: bytearray() for master in masters}
+
+            async def read_until(master, text):
+                while text not in received[master]:
+                    await loop.run_in_executor(None, lambda: received[master].extend(os.read(master, 4096)))
+                before, _, received[master][:] = received[master].partition(text)
+                return bytes(before)
+
+            try:
+                greeting = b"HOW DO YOU DO. PLEASE TELL ME YOUR PROBLEM\r\n"
+                for master in masters:
+                    await read_until(master, greeting)
+                for prompt, response in cacm_1966_conversation[:6]:
+                    for master in masters:
+                        # typed with a mistake, erased, and CR LF at the end
+                        os.write(master, prompt.encode()[:-1] + b"X\x7f" + prompt.encode()[-1:] + b"\r\n")
+                    for master in masters:
+                        echo = await read_until(master, b"\r\n")
+                        self.assertEqual(echo, prompt.encode()[:-1] + b"X\b \b" + prompt.encode()[-1:])
+                        self.assertEqual(await read_until(master, b"\r\n"), response.encode())
+                # a blank line starts the next visitor's conversation
+                os.write(masters[0], b"\r")
+                await read_until(masters[0], greeting)
+                os.write(masters[0], cacm_1966_conversation[0][0].encode() + b"\r")
+                await read_until(masters[0], b"\r\n")
+                self.assertEqual(await read_until(masters[0], b"\r\n"), cacm_1966_conversation[0][1].encode())
+                self.assertEqual(mux.responses, 6 * len(masters) + 1)
+            finally:
+                mux.stop()
+                for master in masters:
+                    os.close(master)
+
+        asyncio.run(run())
+
+
+class TestHttpAPI(unittest.TestCase):
+    def test_respond(self):
+        import http.client
+        import json
+        import threading
+        from elizahttp import make_server
+
+        server = make_server(load_doctor_script(), ("127.0.0.1", 0))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        conn = http.client.HTTPConnection(*server.server_address[:2])
+
+        def post(path, message):
+            conn.request("POST", path, json.dumps(message), {"Content-Type": "application/json"})
+            reply = conn.getresponse()
+            return reply.status, json.loads(reply.read())
+
+        try:
+            # one kept-alive connection, a conversation kept on the server and one carried in a token
+            token = ""
+            for prompt, response in cacm_1966_conversation:
+                self.assertEqual(post("/respond", {"session": "s1", "text": prompt}), (200, {"response": response}))
+                status, reply = post("/respond", {"token": token, "text": prompt})
+                self.assertEqual(reply["response"], response)
+                token = reply["token"]
+
+            status, reply = post("/respond_batch", {"requests": [{"session": n, "text": prompt}
+                                                                 for n in range(3)
+                                                                 for prompt, _ in cacm_1966_conversation[:2]]})
+            self.assertEqual(reply["responses"], [response for _ in range(3)
+                                                  for _, response in cacm_1966_conversation[:2]])
+
+            # a batch with a bad request in it is not answered at all
+            prompt, response = cacm_1966_conversation[0]
+            self.assertEqual(post("/respond_batch", {"requests": [{"session": "s2", "text": prompt}, {"text": "HI"}]})[0],
+                             400)
+            self.assertEqual(post("/respond", {"session": "s2", "text": prompt}), (200, {"response": response}))
+
+            self.assertEqual(post("/respond", {"text": "HELLO"})[0], 400)
+            self.assertEqual(post("/respond", {"token": "!!", "text": "HELLO"})[0], 400)
+            self.assertEqual(post("/nowhere", {})[0], 404)
+            conn.request("GET", "/greeting")
+            self.assertEqual(json.loads(conn.getresponse().read()),
+                             {"greeting": "HOW DO YOU DO. PLEASE TELL ME YOUR PROBLEM"})
+
+            # a Content-Length that is missing, not a number or negative is refused at once
+            for length in (None, "ten", "-1"):
+                with socket.create_connection(server.server_address[:2], timeout=5) as raw:
+                    raw.sendall(b"POST /respond HTTP/1.1\r\n" +
+                                (b"Content-Length: %s\r\n" % length.encode() if length else b"") + b"\r\n{}")
+                    self.assertTrue(raw.recv(100).startswith(b"HTTP/1.1 400 "))
+        finally:
+            conn.close()
+            server.shutdown()
+            server.server_close()
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "the RPC server needs Unix domain sockets")
+class TestRpc(unittest.TestCase):
+    def test_filter_bcd_bytes(self):
+        from elizaencoding import filter_bcd_bytes
+        for text in ("Well, my boyfriend made me come here!", "It's \u201ctrue\u201d \u00e9t\u00e9?", "tab\there"):
+            self.assertEqual(filter_bcd_bytes(memoryview(text.encode())), filter_bcd(text))
+        self.assertEqual(filter_bcd_bytes(b"\xffOK"), "-OK")
+
+    def test_pipelined(self):
+        import asyncio
+        import tempfile
+        import threading
+        from elizarpc import RpcClient, RpcServer
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "eliza.sock")
+            loop = asyncio.new_event_loop()
+            server = RpcServer(load_doctor_script(), path)
+            loop.run_until_complete(server.start())
+            thread = threading.Thread(target=loop.run_forever, daemon=True)
+            thread.start()
+            client = RpcClient(path, pool_size=2)
+            try:
+                for prompt, response in cacm_1966_conversation:
+                    self.assertEqual(client.respond("one", prompt), response)
+                # many conversations interleaved in one pipeline, more than fits in one window
+                requests = [(n, prompt) for prompt, _ in cacm_1966_conversation for n in range(40)]
+                self.assertEqual(client.respond_many(requests),
+                                 [response for _, response in cacm_1966_conversation for _ in range(40)])
+                # long remarks echoed back fill both ends' socket buffers long before the batch is sent
+                remark = "YOU ARE " + "SAD " * 2000
+                expected = client.respond("echo", remark)
+                self.assertGreater(len(expected), 8000)
+                results = []
+                requests = [(f"echo {n}", remark) for n in range(300)]  # each a new conversation, so all alike
+                batch = threading.Thread(target=lambda: results.append(client.respond_many(requests)), daemon=True)
+                batch.start()
+                batch.join(60)
+                self.assertFalse(batch.is_alive(), "the batch deadlocked")
+                self.assertEqual(results, [[expected] * 300])
+            finally:
+                client.close()
+                asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+                loop.call_soon_threadsafe(loop.stop)
+                thread.join()
+                loop.close()
+
+
+class TestShardedPool(unittest.TestCase):
+    def test_sessions_move_with_resize(self):
+        import time
+        from elizashard import ShardedPool
+        conversation = cacm_1966_conversation
+        half = len(conversation) // 2
+        pool = ShardedPool(load_doctor_script(), workers=2, max_workers=3, batch_size=8)
+        try:
+            requests = [(n, prompt) for prompt, _ in conversation[:half] for n in range(30)]
+            self.assertEqual(pool.respond_many(requests), [response for _, response in conversation[:half]
+                                                           for _ in range(30)])
+            pool.resize(3)
+            futures = [pool.submit(n, prompt) for prompt, _ in conversation[half:] for n in range(30)]
+            pool.resize(1)  # while those are under way
+            self.assertEqual([future.result() for future in futures],
+                             [response for _, response in conversation[half:] for _ in range(30)])
+            self.assertEqual(pool.stats()["workers"], 1)
+            self.assertGreater(pool.stats()["sessions_migrated"], 0)
+        finally:
+            pool.close()
+
+        pool = ShardedPool(load_doctor_script(), workers=2, min_workers=1, max_workers=2, autoscale=True,
+                           idle_seconds=0.2)
+        try:
+            self.assertEqual(pool.respond("x", conversation[0][0]), conversation[0][1])
+            deadline = time.monotonic() + 5
+            while len(pool.workers) > 1 and time.monotonic() < deadline:
+                time.sleep(0.05)
+            self.assertEqual(len(pool.workers), 1)
+            self.assertEqual(pool.respond("x", conversation[1][0]), conversation[1][1])
+        finally:
+            pool.close()
+
+    def test_worker_exits(self):
+        from elizashard import NUM_SLOTS, ShardedPool, session_slot
+        conversation = cacm_1966_conversation
+        pool = ShardedPool(load_doctor_script(), workers=2, max_workers=2)
+        try:
+            sessions = {pool.owner[session_slot(n)]: n for n in range(NUM_SLOTS)}
+            lost, kept = sessions[0], sessions[1]
+            for prompt, response in conversation[:2]:
+                self.assertEqual(pool.respond_many([(lost, prompt), (kept, prompt)]), [response, response])
+            pool.workers[0].process.kill()
+            pool.workers[0].process.join()
+            # the other worker's conversations go on; the one lost starts afresh in a new worker
+            self.assertEqual(pool.respond(kept, conversation[2][0]), conversation[2][1])
+            self.assertEqual(pool.respond(lost, conversation[0][0]), conversation[0][1])
+            self.assertEqual(pool.stats()["restarts"], 1)
+            pool.resize(1)
+            self.assertEqual(pool.respond(kept, conversation[3][0]), conversation[3][1])
+        finally:
+            pool.close()
+
+
+class TestCluster(unittest.TestCase):
+    def test_hash_ring_moves_few_keys(self):
+        from elizacluster import HashRing
+        ring = HashRing(["a", "b", "c"])
+        before = {n: ring.node_for(n) for n in range(3000)}
+        ring.add("d")
+        moved = [n for n in before if ring.node_for(n) != before[n]]
+        self.assertTrue(all(ring.node_for(n) == "d" for n in moved))
+        self.assertLess(len(moved), 3000 / 4 * 1.5)
+        ring.remove("d")
+        self.assertEqual({n: ring.node_for(n) for n in before}, before)
+
+    def test_sessions_move_between_nodes(self):
+        from elizacluster import ClusterRouter, start_local_node
+        script = load_doctor_script()
+        nodes = [start_local_node(script, authkey=b"test") for _ in range(3)]
+        conversation = cacm_1966_conversation
+        third = len(conversation) // 3
+        router = ClusterRouter({"a": nodes[0][1], "b": nodes[1][1]}, authkey=b"test")
+        try:
+            def converse(exchanges):
+                requests = [(n, prompt) for prompt, _ in exchanges for n in range(40)]
+                self.assertEqual(router.respond_many(requests), [response for _, response in exchanges
+                                                                 for _ in range(40)])
+
+            converse(conversation[:third])
+            moved = router.add_node("c", nodes[2][1])
+            self.assertTrue(0 < moved < 40)
+            converse(conversation[third:2 * third])
+            counts = router.stats()["nodes"]
+            self.assertEqual(sum(counts.values()), 40)
+            self.assertEqual(router.remove_node("a"), counts["a"])
+            converse(conversation[2 * third:])
+            self.assertEqual(router.stats()["nodes"], {name: sum(router.ring.node_for(n) == name for n in range(40))
+                                                       for name in ("b", "c")})
+        finally:
+            router.close()
+            for process, _ in nodes:
+                process.terminate()
+                process.join()
+
+    def test_failed_move_keeps_sessions(self):
+        from multiprocessing.connection import Client
+        from elizacluster import ClusterRouter, ElizaNode, _NodeLink, start_local_node
+        script = load_doctor_script()
+        with self.assertRaises(ValueError):
+            ElizaNode(script)
+        nodes = [start_local_node(script, authkey=b"test") for _ in range(2)]
+        router = ClusterRouter({"a": nodes[0][1]}, authkey=b"test")
+        prompt, response = cacm_1966_conversation[0]
+        call = _NodeLink.call
+
+        def failing_import(link, message):
+            if message[0] == "import":
+                raise ConnectionError("node gone")
+            return call(link, message)
+
+        try:
+            self.assertEqual(router.respond_many([(n, prompt) for n in range(20)]), [response] * 20)
+            _NodeLink.call = failing_import
+            try:
+                with self.assertRaises(ConnectionError):
+                    router.add_node("b", nodes[1][1])
+            finally:
+                _NodeLink.call = call
+            self.assertEqual(router.stats()["nodes"], {"a": 20})
+            self.assertEqual(router.respond(0, cacm_1966_conversation[1][0]), cacm_1966_conversation[1][1])
+            # a request that is not JSON closes the connection
+            conn = Client(tuple(nodes[0][1]), authkey=b"test")
+            conn.send_bytes(b"\x80\x04not json")
+            with self.assertRaises(EOFError):
+                conn.recv_bytes()
+            conn.close()
+        finally:
+            router.close()
+            for process, _ in nodes:
+                process.terminate()
+                process.join()
+
+
+class TestThreadPoolEliza(unittest.TestCase):
+    def test_sessions_on_threads(self):
+        from elizathreads import ThreadPoolEliza
+        script = load_doctor_script()
+        rules = list(script.rules.values()) + [script.mem_rule]
+        before = [(rule.trace, [t.next_reassembly_rule for t in rule.transformations]) for rule in rules]
+        pool = ThreadPoolEliza(script, threads=8)
+        try:
+            requests = [(n, prompt) for prompt, _ in cacm_1966_conversation for n in range(50)]
+            self.assertEqual(pool.respond_many(requests), [response for _, response in cacm_1966_conversation
+                                                           for _ in range(50)])
+            future = pool.submit(50, cacm_1966_conversation[0][0])
+            self.assertEqual(future.result(), cacm_1966_conversation[0][1])
+        finally:
+            pool.close()
+        # no response changed the shared script
+        self.assertEqual([(rule.trace, [t.next_reassembly_rule for t in rule.transformations]) for rule in rules],
+                         before)
+        self.assertEqual(len(script.mem_rule.memories), 0)
+
+    def test_threads_share_a_shared_script(self):
+        from elizathreads import ThreadPoolEliza
+        shared = SharedScript.create(load_doctor_script(), cache_size=2)
+        pool = ThreadPoolEliza(shared, threads=8)
+        try:
+            requests = [(n, prompt) for prompt, _ in cacm_1966_conversation for n in range(20)]
+            self.assertEqual(pool.respond_many(requests), [response for _, response in cacm_1966_conversation
+                                                           for _ in range(20)])
+            self.assertLessEqual(len(shared.rules._cache), 2)
+        finally:
+            pool.close()
+            shared.close()
+
+
+class TestFairScheduler(unittest.TestCase):
+    def test_sessions_take_turns(self):
+        import threading
+        from elizafair import DEFICIT, ROUND_ROBIN, FairScheduler
+        self.assertRaises(ValueError, FairScheduler, lambda session_id, remark: remark, policy=DEFICIT, quantum=0)
+        for policy in (ROUND_ROBIN, DEFICIT):
+            with self.subTest(policy=policy):
+                started = threading.Event()
+                release = threading.Event()
+                order = []
+
+                def respond(session_id, remark):
+                    started.set()
+                    release.wait()
+                    order.append((session_id, remark))
+                    return remark.upper()
+
+                scheduler = FairScheduler(respond, workers=1, policy=policy, quantum=10)
+                futures = [scheduler.submit("chatty", f"remark {n}") for n in range(100)]
+                started.wait()  # the first is in flight, the rest are queued
+                futures += [scheduler.submit("a", "hello"), scheduler.submit("b", "x" * 25),
+                            scheduler.submit("a", "again")]
+                release.set()
+                self.assertEqual(futures[-1].result(), "AGAIN")
+                self.assertEqual([f.result() for f in futures[:100]], [f"REMARK {n}" for n in range(100)])
+                scheduler.close()
+                # the other sessions are answered within a few turns, not after chatty's backlog
+                self.assertLess(order.index(("a", "hello")), 3)
+                self.assertLess(order.index(("a", "again")), 8)
+                self.assertLess(order.index(("b", "x" * 25)), 12)
+                self.assertEqual([r for s, r in order if s == "chatty"], [f"remark {n}" for n in range(100)])
+                stats = scheduler.stats()
+                self.assertEqual((stats["submitted"], stats["completed"], stats["waiting"]), (103, 103, 0))
+                self.assertGreater(stats["wait_max"], 0)
+
+    def test_load_shedding(self):
+        import threading
+        from elizafair import FairScheduler, Overloaded
+        now = [100.0]
+        started = threading.Event()
+        release = threading.Event()
+
+        def respond(session_id, remark):
+            started.set()
+            release.wait()
+            return remark.upper()
+
+        scheduler = FairScheduler(respond, workers=1, clock=lambda: now[0], max_queue=3,
+                                  shed=lambda session_id, remark: "SHED")
+        futures = [scheduler.submit("a", "one")]
+        started.wait()
+        futures += [scheduler.submit("b", "two", deadline=110), scheduler.submit("c", "three"),
+                    scheduler.submit("d", "four")]
+        self.assertEqual(scheduler.submit("e", "five").result(), "SHED")  # the queue is full
+        now[0] = 120  # past b's deadline
+        release.set()
+        self.assertEqual([f.result() for f in futures], ["ONE", "SHED", "THREE", "FOUR"])
+        self.assertEqual(scheduler.submit("f", "six", deadline=119).result(), "SHED")  # too late already
+        scheduler.close()
+        stats = scheduler.stats()
+        self.assertEqual((stats["shed_queue_full"], stats["shed_deadline"]), (1, 2))
+        self.assertAlmostEqual(stats["shed_rate"], 3 / 6)
+
+        started.clear()
+        release.clear()
+        scheduler = FairScheduler(respond, max_queue=1)
+        futures = [scheduler.submit("a", "one")]
+        started.wait()
+        futures += [scheduler.submit("a", "two"), scheduler.submit("a", "three")]
+        self.assertRaises(Overloaded, futures[-1].result)
+        release.set()
+        scheduler.close()
+
+    def test_thread_pool_conversation(self):
+        import time
+        from elizafair import DEFICIT
+        from elizathreads import ThreadPoolEliza
+        pool = ThreadPoolEliza(load_doctor_script(), threads=4, fair_policy=DEFICIT)
+        try:
+            requests = [(n, prompt) for prompt, _ in cacm_1966_conversation for n in range(20)]
+            self.assertEqual(pool.respond_many(requests), [response for _, response in cacm_1966_conversation
+                                                           for _ in range(20)])
+        finally:
+            pool.close()
+
+        # a request past its deadline gets the nomatch message, and leaves the conversation as it was
+        pool = ThreadPoolEliza(load_doctor_script(), threads=2, timeout=1.0)
+        try:
+            prompt, response = cacm_1966_conversation[0]
+            # the message for the LIMIT the response would have had: 2, after the 1 a conversation starts with
+            self.assertEqual(pool.submit("x", prompt, deadline=time.monotonic() - 1).result(), "HMMM")
+            self.assertEqual(len(pool.sessions), 0)  # shedding makes no session
+            self.assertEqual(pool.submit("x", prompt).result(), response)
+            self.assertEqual(pool.scheduler.stats()["shed_deadline"], 1)
+        finally:
+            pool.close()
+
+
+class TestScriptRegistry(unittest.TestCase):
+    def test_registry(self):
+        import gc
+        from elizabench import customer_script
+        from elizaregistry import ScriptRegistry
+        texts = {"DOCTOR": CACM_1966_01_DOCTOR_script, "acme": customer_script(1), "globex": customer_script(2)}
+        registry = ScriptRegistry(lambda name: texts[name], max_scripts=2)
+        self.assertRaises(KeyError, registry.get, "initech")
+
+        doctor, acme = registry.start("DOCTOR"), registry.start("acme")
+        self.assertEqual(registry.greeting(acme), "CUSTOMER 1 SAYS HELLO. PLEASE TELL ME YOUR PROBLEM")
+        # the scripts share the rules they have in common, and the word lists of those they don't
+        self.assertIs(doctor.script.script.rules["MOTHER"], acme.script.script.rules["MOTHER"])
+        self.assertIs(doctor.script.script.hello_message[-1], acme.script.script.hello_message[-1])
+        self.assertEqual(registry.stats()["distinct_rules"], len(doctor.script.script.rules) + 3)
+
+        half = len(cacm_1966_conversation) // 2
+        for prompt, response in cacm_1966_conversation[:half]:
+            self.assertEqual(registry.respond(doctor, prompt), response)
+            self.assertEqual(registry.respond(acme, prompt), response)
+        self.assertEqual(registry.respond(acme, "Product1x2 is broken"), "TELL ME ABOUT YOUR PRODUCT1X2")
+
+        # DOCTOR is evicted and then changed, but the conversation already under way goes on with its version
+        globex = registry.start("globex")
+        self.assertEqual(registry.stats()["evictions"], 1)
+        texts["DOCTOR"] = CACM_1966_01_DOCTOR_script.replace("HOW DO YOU DO", "GOOD DAY", 1)
+        self.assertEqual(registry.greeting(registry.start("DOCTOR")), "GOOD DAY. PLEASE TELL ME YOUR PROBLEM")
+        self.assertEqual(registry.greeting(doctor), "HOW DO YOU DO. PLEASE TELL ME YOUR PROBLEM")
+        for prompt, response in cacm_1966_conversation[half:]:
+            self.assertEqual(registry.respond(doctor, prompt), response)
+        self.assertEqual(registry.respond(globex, cacm_1966_conversation[0][0]), cacm_1966_conversation[0][1])
+
+        # once its conversations are over, an evicted version is freed
+        versions = registry.stats()["versions_in_use"]
+        del doctor
+        gc.collect()
+        self.assertEqual(registry.stats()["versions_in_use"], versions - 1)
+
+
+class TestScriptCompiler(unittest.TestCase):
+    def test_compile(self):
+        from elizaregistry import ScriptRegistry
+        from elizasandbox import ScriptCompiler, ScriptCompileError
+        compiler = ScriptCompiler()
+        registry = ScriptRegistry(lambda name: CACM_1966_01_DOCTOR_script, compile=compiler.compile)
+        session = registry.start("DOCTOR")
+        for prompt, response in cacm_1966_conversation:
+            self.assertEqual(registry.respond(session, prompt), response)
+
+        with self.assertRaisesRegex(ScriptCompileError, "no MEMORY rule"):
+            compiler.compile("(HELLO)\n(NONE\n((0)\n(HI)))")
+        with self.assertRaisesRegex(ScriptCompileError, "AAA -> BBB -> AAA"):
+            compiler.compile(CACM_1966_01_DOCTOR_script + "(AAA\n((0)\n(=BBB)))\n(BBB\n((0)\n(=AAA)))")
+        big = CACM_1966_01_DOCTOR_script + f"(HUGE\n((0)\n({' '.join(f'W{j}' for j in range(100000))})))"
+        with self.assertRaisesRegex(ScriptCompileError, "too large"):
+            ScriptCompiler(memory=4 * 1024 * 1024).compile(big)
+        with self.assertRaisesRegex(ScriptCompileError, "not compiled within"):
+            ScriptCompiler(timeout=0.001).compile(big)
+        self.assertEqual((compiler.compiled, compiler.failed), (1, 2))
+
+
+class TestBatch(unittest.TestCase):
+    def test_batch(self):
+        import io
+        import json
+        from elizabatch import run_batch
+        eliza = Eliza(load_doctor_script())
+        prompts = [prompt for prompt, _ in cacm_1966_conversation]
+        responses = [response for _, response in cacm_1966_conversation]
+
+        # text: a blank line between conversations, each answered from the start
+        text = ("\n".join(prompts) + "\n\n") * 2 + "\r\n".join(prompts[:3])
+        out = io.BytesIO()
+        stats = run_batch(eliza, [io.BytesIO(text.encode())], out)
+        self.assertEqual(out.getvalue().decode().split("\n"), responses + [""] + responses + [""] + responses[:3] + [""])
+        self.assertEqual(stats, {"conversations": 3, "exchanges": 2 * len(prompts) + 3, "errors": 0})
+
+        # JSONL: interleaved conversations, one ended and started again, and a line in error
+        requests = []
+        for prompt in prompts:
+            requests += [{"session": "a", "text": prompt}, {"session": 2, "text": prompt}]
+        requests += [{"session": 2, "end": True}, {"session": 2, "text": prompts[0]}, {"text": "no session"}]
+        out = io.BytesIO()
+        stats = run_batch(eliza, [io.BytesIO("".join(json.dumps(r) + "\n" for r in requests).encode())], out,
+                          jsonl=True)
+        replies = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([r["response"] for r in replies if r.get("session") == "a"], responses)
+        self.assertEqual([r["response"] for r in replies if r.get("session") == 2], responses + responses[:1])
+        self.assertEqual(replies[-1]["line"], len(requests))
+        self.assertEqual(stats, {"conversations": 3, "exchanges": 2 * len(prompts) + 1, "errors": 1})
+
+
+class TestReplay(unittest.TestCase):
+    def test_replay(self):
+        import json
+        from elizareplay import replay
+        # three conversations interleaved; the second is recorded with a response ELIZA does not give, and the
+        # third ends and starts again
+        lines = []
+        for n, (prompt, response) in enumerate(cacm_1966_conversation):
+            for session in ("a", "b", 3):
+                expected = "I AM NOT LISTENING" if session == "b" and n == 4 else response
+                lines.append(json.dumps({"session": session, "text": prompt, "response": expected}))
+        lines += [json.dumps({"session": 3, "end": True}),
+                  json.dumps({"session": 3, "text": cacm_1966_conversation[0][0],
+                              "response": cacm_1966_conversation[0][1]}),
+                  "", "not json", json.dumps({"session": ["a"], "text": "", "response": ""})]
+        report = replay(load_doctor_script(), (line.encode() + b"\n" for line in lines), workers=2, chunk=4)
+
+        exchanges = 3 * len(cacm_1966_conversation) + 1
+        skipped = len(cacm_1966_conversation) - 5
+        self.assertEqual((report["conversations"], report["exchanges"], report["matched"], report["skipped"]),
+                         (4, exchanges, exchanges - 1 - skipped, skipped))
+        [divergence] = report["divergences"]
+        self.assertEqual((divergence["session"], divergence["line"], divergence["exchange"]), ("b", 14, 5))
+        self.assertEqual(divergence["actual"], cacm_1966_conversation[4][1])
+        self.assertIn("selected reassemble rule: DO YOU THINK COMING HERE WILL HELP YOU NOT TO BE 5", divergence["trace"])
+        self.assertEqual([bad["line"] for bad in report["bad_lines"]], [len(lines) - 1, len(lines)])
+
+    def test_worker_death_fails_replay(self):
+        import json
+        import multiprocessing
+        from elizareplay import replay
+
+        def lines():
+            for n, (prompt, response) in enumerate(cacm_1966_conversation):
+                yield json.dumps({"session": n % 2, "text": prompt, "response": response}).encode()
+            for process in multiprocessing.active_children():
+                process.kill()
+                process.join()
+
+        with self.assertRaises(RuntimeError):
+            replay(load_doctor_script(), lines(), workers=2, chunk=4)
+
+
+def shared_script_responses(name, remarks):
+    shared = SharedScript.attach(name, cache_size=8)
+    try:
+        eliza = Eliza(shared, shared.tags)
+        return [eliza.response(remark) for remark in remarks]
+    finally:
+        shared.close()
+
+
+class TestSharedScript(unittest.TestCase):
+    def test_shared_script(self):
+        script = load_doctor_script()
+        shared = SharedScript.create(script)
+        try:
+            attached = SharedScript.attach(shared.name, cache_size=4)
+            self.assertEqual(elizascript.script_to_string(attached), elizascript.script_to_string(script))
+            self.assertEqual(attached.tags, collect_tags(script.rules))
+            self.assertTrue("MOTHER" in attached.rules)
+            self.assertFalse("NOSUCHWORD" in attached.rules)
+            self.assertEqual(attached.rules["MY"].transformations[0].key, script.rules["MY"].transformations[0].key)
+
+            eliza = Eliza(attached, attached.tags)
+            for prompt, response in cacm_1966_conversation:
+                self.assertEqual(eliza.response(prompt), response)
+            self.assertLessEqual(len(attached.rules._cache), 4)
+            attached.close()
+
+            # by default a worker holds few of the rules decoded, not a copy of the script
+            from elizashared import DEFAULT_CACHE_SIZE
+            attached = SharedScript.attach(shared.name)
+            eliza = Eliza(attached, attached.tags)
+            for prompt, _ in cacm_1966_conversation:
+                eliza.response(prompt)
+            for keyword in script.rules:
+                attached.rules[keyword]
+            self.assertEqual(len(attached.rules._cache), DEFAULT_CACHE_SIZE)
+            self.assertLess(DEFAULT_CACHE_SIZE, len(script.rules) / 2)
+            attached.close()
+
+            # a worker spawned afresh sees the same script
+            import multiprocessing
+            with multiprocessing.get_context("spawn").Pool(1) as pool:
+                responses = pool.apply(shared_script_responses,
+                                       (shared.name, [prompt for prompt, _ in cacm_1966_conversation]))
+            self.assertEqual(responses, [response for _, response in cacm_1966_conversation])
+        finally:
+            shared.close()
+
+
+@unittest.skipUnless(hasattr(os, "fork"), "pre-fork serving needs os.fork()")
+class TestPreforkServer(unittest.TestCase):
+    def test_prefork_server(self):
+        server = PreforkServer(load_doctor_script(), ("127.0.0.1", 0), 2)
+        address = server.start()
+        try:
+            self.assertEqual(len(server.pids), 2)
+            for _ in range(3):
+                with socket.create_connection(address, timeout=10) as conn:
+                    f = conn.makefile("rwb")
+                    self.assertEqual(f.readline(), b"HOW DO YOU DO. PLEASE TELL ME YOUR PROBLEM\n")
+                    for prompt, response in cacm_1966_conversation[:4]:
+                        f.write(prompt.encode() + b"\n")
+                        f.flush()
+                        self.assertEqual(f.readline().decode(), response + "\n")
+                    f.write(b"\n")
+                    f.flush()
+                    self.assertEqual(f.readline(), b"")
+        finally:
+            server.stop()
+
+    def test_connections_fail_alone(self):
+        import threading
+        server = PreforkServer(load_doctor_script(), ("127.0.0.1", 0), 1)
+        response = server.engine.response
+
+        def failing_response(text, session=None, filtered=False):
+            if text == "FAIL":
+                raise RuntimeError("failed")
+            return response(text, session, filtered)
+
+        server.engine.response = failing_response
+        address = server.start()
+        try:
+            with socket.create_connection(address, timeout=10) as conn, \
+                    socket.create_connection(address, timeout=10) as flood:
+                f = conn.makefile("rwb")
+                self.assertEqual(f.readline(), b"HOW DO YOU DO. PLEASE TELL ME YOUR PROBLEM\n")
+                f.write(cacm_1966_conversation[0][0].encode() + b"\n")
+                f.flush()
+                self.assertEqual(f.readline().decode(), cacm_1966_conversation[0][1] + "\n")
+
+                # a client sending long remarks without reading the responses, which echo them
+                remark = "YOU ARE " + "SAD " * 900
+                sender = threading.Thread(target=flood.sendall, args=((remark + "\n").encode() * 300,), daemon=True)
+                sender.start()
+                # a conversation that fails is closed, and the others on the worker carry on
+                with socket.create_connection(address, timeout=10) as failing:
+                    g = failing.makefile("rwb")
+                    g.readline()
+                    g.write(b"FAIL\n")
+                    g.flush()
+                    self.assertEqual(g.readline(), b"")
+                f.write(cacm_1966_conversation[1][0].encode() + b"\n")
+                f.flush()
+                self.assertEqual(f.readline().decode(), cacm_1966_conversation[1][1] + "\n")
+
+                h = flood.makefile("rb")
+                h.readline()
+                self.assertTrue(all(len(h.readline()) > 3600 for _ in range(300)))  # each echoes the SADs
+                sender.join(10)
+                self.assertFalse(sender.is_alive())
+        finally:
+            server.stop()
+
+
 if __name__ == '__main__':
     unittest.main()
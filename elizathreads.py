@@ -0,0 +1,119 @@
+"""
+Conversations served from a pool of threads in one process. Without a tracer Eliza.response() changes nothing
+in the script, only the session it is given, so responses in different sessions can be made at once: on a
+free-threaded CPython build they run on as many cores as there are threads, while with the GIL they take
+turns, as they would on one thread.
+"""
+import os
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+from eliza import Eliza
+from elizafair import ROUND_ROBIN, FairScheduler
+from elizalogic import Script
+from elizasession import SessionManager, SessionState
+
+# session ids are hashed onto this many locks, which is as good as a lock per session while fewer
+# conversations than this are under way at once
+LOCK_STRIPES = 1024
+
+
+def gil_enabled() -> bool:
+    """
+    False on a free-threaded CPython build running without the GIL.
+    """
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return True if is_gil_enabled is None else is_gil_enabled()
+
+
+class ThreadPoolEliza:
+    """
+        Serves conversations from a concurrent.futures thread pool, keeping them by session id in a
+        SessionManager.
+
+            pool = ThreadPoolEliza(script, threads=8)
+            pool.respond("user 1", "Men are all alike.")
+            pool.submit("user 2", "...")  # a Future
+            pool.close()
+
+        One response is made at a time in each session, and responses in different sessions in parallel. The
+        engine has no tracer, since a tracer records one response at a time. Submitted requests are answered in
+        the order they arrive or, if fair_policy, max_queue or timeout is given, by a FairScheduler, which
+        answers the requests it sheds under overload with ELIZA's built-in nomatch message.
+    """
+    def __init__(self, script: Script, threads: int = 0, max_sessions: int = 100000, ttl: Optional[float] = 3600,
+                 fair_policy: Optional[str] = None, max_queue: int = 0, timeout: Optional[float] = None):
+        self.engine = Eliza(script)
+        self.sessions = SessionManager(self.engine, max_sessions, ttl)
+        self.threads = threads or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(self.threads, thread_name_prefix="eliza")
+        self._table_lock = threading.Lock()  # the SessionManager's table
+        self._session_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._fresh = SessionState(script)  # stands in for a session that has not begun, and is never changed
+        self.scheduler = None
+        if fair_policy or max_queue or timeout is not None:
+            self.scheduler = FairScheduler(self.respond, self.threads, fair_policy or ROUND_ROBIN,
+                                           max_queue=max_queue, timeout=timeout, shed=self._nomatch)
+
+    def respond(self, session_id: Hashable, remark: str) -> str:
+        """
+        ELIZA's response to remark in the conversation session_id, made on the calling thread.
+        """
+        session_lock = self._session_locks[hash(session_id) % LOCK_STRIPES]
+        while True:
+            with self._table_lock:
+                session = self.sessions.get(session_id)
+            with session_lock:
+                # the session may have been evicted, and a new one made for session_id, while this thread waited:
+                # answering with the old one would lose the remark
+                with self._table_lock:
+                    current = self.sessions.get(session_id, create=False) is session
+                if current:
+                    return self.engine.response(remark, session)
+
+    def _nomatch(self, session_id: Hashable, remark: str) -> str:
+        # a shed request makes no session: a flood of them would otherwise fill the table
+        with self._table_lock:
+            session = self.sessions.get(session_id, create=False)
+        return self.engine.nomatch_response(session or self._fresh)
+
+    def submit(self, session_id: Hashable, remark: str, deadline: Optional[float] = None) -> Future:
+        """
+        Make the response on a pool thread.
+        :param deadline: When the response is needed by, as a time.monotonic() time; with a scheduler, a
+                         request that cannot be answered by then is given the nomatch message instead.
+        :return: A Future of the response.
+        """
+        if self.scheduler is not None:
+            return self.scheduler.submit(session_id, remark, deadline)
+        return self.executor.submit(self.respond, session_id, remark)
+
+    def respond_many(self, requests: Iterable[Tuple[Hashable, str]]) -> List[str]:
+        """
+        The responses to requests, in order. The remarks of each session are answered in the order given, and
+        the sessions in parallel.
+        """
+        requests = list(requests)
+        if self.scheduler is not None:
+            return [future.result() for future in [self.scheduler.submit(session_id, remark)
+                                                   for session_id, remark in requests]]
+        by_session: Dict[Hashable, List[int]] = {}
+        for n, (session_id, _) in enumerate(requests):
+            by_session.setdefault(session_id, []).append(n)
+        responses: List[Optional[str]] = [None] * len(requests)
+
+        def converse(session_id, indexes):
+            for n in indexes:
+                responses[n] = self.respond(session_id, requests[n][1])
+
+        for future in [self.executor.submit(converse, session_id, indexes)
+                       for session_id, indexes in by_session.items()]:
+            future.result()
+        return responses
+
+    def close(self) -> None:
+        if self.scheduler is not None:
+            self.scheduler.close()
+        self.executor.shutdown()
@@ -1,11 +1,13 @@
-from collections import OrderedDict
-from typing import Tuple
+from __future__ import annotations
 
-import ctypes
-from typing import List, Dict
+from collections import OrderedDict
 
 from elizaconstant import TagMap, RuleMap
 
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Tuple, List, Dict
+
 
 # CONTAINS ALL UTILITY FUNCTIONS
 def split_input(input_string, punctuation_marks):
@@ -71,11 +73,14 @@ def to_int(symbols: str) -> int:
             return -1
     return integer_value
 
-def char2uint(c: str) -> ctypes.c_char_p:
+# ctypes is only imported when these are used; it is not needed to run ELIZA and is slow to import
+def char2uint(c: str) -> "ctypes.c_char_p":
+    import ctypes
     b_string1 = c.encode('utf-8')
     return ctypes.c_char_p(b_string1)
 
-def unsigned(i: int) -> ctypes.c_uint:
+def unsigned(i: int) -> "ctypes.c_uint":
+    import ctypes
     return ctypes.c_uint(i)
 
 def reassemble_from_rule(reassembly_rule: List[str], components: List[str]) -> List[str]:
@@ -138,9 +143,10 @@ def words_in_list(word: str, wordlist: str, tags: Dict[str, List[str]]) -> bool:
 
 
 # Define types
-tagmap = Dict[str, List[str]]
-vecstr = List[str]
-stringlist = List[str]
+if TYPE_CHECKING:
+    tagmap = Dict[str, List[str]]
+    vecstr = List[str]
+    stringlist = List[str]
 
 def xmatch(tags: tagmap,
            pat_array: vecstr,
@@ -1,19 +1,29 @@
-import argparse
 import sys
 
 from elizalogic import StringTracer, NullTracer, PreTracer
-from elizascript import ElizaScriptReader
 from eliza import Eliza
-from DOCTOR_1966_01_CACM import CACM_1966_01_DOCTOR_script
+
+# the script reader, the reloader and the DOCTOR script text are imported when first needed; see also
+# elizastart.py for an entry point that starts as quickly as possible
 
 def parse_cmdline():
+    import argparse
     parser = argparse.ArgumentParser(description="ELIZA -- A Computer Program for the Study of Natural Language Communication Between Man and Machine")
     parser.add_argument('--nobanner', action='store_true', help="Don't display startup banner")
     parser.add_argument('--showscript', action='store_true', help="Print Weizenbaum's 1966 DOCTOR script and exit")
     parser.add_argument('--quick', action='store_true', help="Print responses without delay (IBM 2741 speed)")
     #parser.add_argument('--help', action='store_true', help="Show usage information")
     parser.add_argument('--port', action='store_true', help="Use serial port for communication")
-    parser.add_argument('--portname', metavar='PORT_NAME', help="Specify the serial port name (e.g., COM2)")
+    parser.add_argument('--portname', metavar='PORT_NAME', help="Specify the serial port name (e.g., /dev/ttyUSB0); a comma separated list serves a conversation on each")
+    parser.add_argument('--bind', metavar='HOST:PORT', default="127.0.0.1:2741", help="Address to serve conversations on")
+    parser.add_argument('--prefork', metavar='WORKERS', type=int, help="Serve conversations on --bind from WORKERS forked processes")
+    parser.add_argument('--serve', action='store_true', help="Serve conversations on --bind from one asyncio process")
+    parser.add_argument('--http', action='store_true', help="Serve the HTTP JSON API (/respond, /respond_batch) on --bind")
+    parser.add_argument('--node', action='store_true', help="Serve as a cluster node on --bind; routers must authenticate with the key in $ELIZA_CLUSTER_KEY")
+    parser.add_argument('--rpc', metavar='SOCKET_PATH', help="Serve the binary RPC protocol on a Unix domain socket")
+    parser.add_argument('--batch', metavar='FILES', help="Answer the conversations in FILES (comma separated; - for stdin) without interaction")
+    parser.add_argument('--jsonl', action='store_true', help="--batch input is JSONL {\"session\", \"text\"} requests (the default for .jsonl files)")
+    parser.add_argument('--output', metavar='FILE', default='-', help="Write --batch responses to FILE instead of stdout")
     parser.add_argument('script_filename', nargs='?', help="Specify the script file name")
     return parser.parse_args()
 
@@ -33,6 +43,7 @@ def print_command_help():
    # print(        "  *cacm           replay conversation from Weizenbaum's Jan 1966 CACM paper\n")
    # print(        "  *key            show all keywords in the current script\n")
    # print(        "  *key KEYWORD    show the transformation rule for the given KEYWORD\n")
+    print(        "  *reload [FILE]  re-read the script (or FILE) without ending the conversation\n")
     print(        "  *traceoff       turn off tracing\n")
     print(        "  *traceon        turn on tracing; enter '*' after any exchange to see trace\n")
     print(        "  *traceauto      turn on tracing; trace shown after every exchange\n")
@@ -41,22 +52,34 @@ def print_command_help():
 
 
 def load_script_from_file(script_file):
-    pass
+    return script_file.read()
+
+
+def report_reload(future):
+    try:
+        future.result()
+        print("Script reloaded\n")
+    except (RuntimeError, OSError) as e:
+        print(f"Error reloading script: {e.__str__()}\n")
 
 
 def main():
 
     try:
         args = parse_cmdline()
+        if args.batch is not None:
+            args.nobanner = True  # nothing but responses on stdout
         if not args.nobanner:
             print_banner()
 
         eliza_script = None
+        script = None
         if not args.script_filename:
-            # Use default 'internal' 1966 CACM published script
+            # Use default 'internal' 1966 CACM published script, already read into its prebuilt snapshot
             if not args.nobanner:
                 print("No script filename given; using built-in 1966 DOCTOR script.")
-            eliza_script = CACM_1966_01_DOCTOR_script  # Assuming you have a function to load the default script
+            from elizaprebuilt import load_doctor_script
+            script = load_doctor_script()
         else:
             # Use the named script file
             try:
@@ -71,18 +94,96 @@ def main():
                 sys.exit(-1)
 
 
-        try:
-            status, script = ElizaScriptReader.read_script(eliza_script)
-        except RuntimeError as e:
-            print(f"Error loading script: {e.__str__()}")
-            exit(2)
+        if script is None:
+            from elizascript import ElizaScriptReader
+            try:
+                status, script = ElizaScriptReader.read_script(eliza_script)
+            except RuntimeError as e:
+                print(f"Error loading script: {e.__str__()}")
+                exit(2)
+
+        if args.batch is not None:
+            import time
+            from elizabatch import open_input, open_output, run_batch
+            names = args.batch.split(",")
+            jsonl = args.jsonl or all(name.endswith(".jsonl") for name in names)
+
+            def inputs():
+                for name in names:
+                    with open_input(name) as f:
+                        yield f
+
+            start = time.perf_counter()
+            try:
+                with open_output(args.output) as out:
+                    stats = run_batch(Eliza(script), inputs(), out, jsonl)
+            except OSError as e:
+                print(f"{sys.argv[0]}: {e}", file=sys.stderr)
+                sys.exit(-1)
+            elapsed = time.perf_counter() - start
+            print(f"{stats['exchanges']} exchanges in {stats['conversations']} conversations in {elapsed:.1f} s"
+                  + (f", {stats['errors']} lines in error" if stats['errors'] else ""), file=sys.stderr)
+            return
+
+        if args.prefork:
+            from elizaprefork import PreforkServer, parse_address
+            server = PreforkServer(script, parse_address(args.bind), args.prefork)
+            host, port = server.start()
+            print(f"Serving on {host}:{port} with {server.workers} worker processes")
+            server.serve_forever()
+            return
+
+        if args.node:
+            import os
+            from elizacluster import serve
+            from elizaprefork import parse_address
+            authkey = os.environ.get("ELIZA_CLUSTER_KEY")
+            if not authkey:
+                print(f"{sys.argv[0]}: --node needs a key shared with the router in ELIZA_CLUSTER_KEY")
+                sys.exit(2)
+            serve(script, parse_address(args.bind), authkey.encode(), lambda message: print(message, flush=True))
+            return
+
+        if args.port or args.portname:
+            if not args.portname:
+                print(f"{sys.argv[0]}: --port needs --portname")
+                sys.exit(2)
+            from elizaterminal import serve
+            from elizateletype import TeletypePacer
+            serve(script, args.portname.split(","), lambda message: print(message, flush=True),
+                  None if args.quick else TeletypePacer())
+            return
+
+        if args.rpc:
+            from elizarpc import serve
+            serve(script, args.rpc, lambda message: print(message, flush=True))
+            return
+
+        if args.http:
+            from elizahttp import serve
+            from elizaprefork import parse_address
+            serve(script, parse_address(args.bind), lambda message: print(message, flush=True))
+            return
+
+        if args.serve:
+            from elizaasync import serve
+            from elizaprefork import parse_address
+            from elizateletype import TeletypePacer
+            serve(script, parse_address(args.bind), lambda message: print(message, flush=True),
+                  None if args.quick else TeletypePacer())
+            return
 
         eliza = Eliza(script)
+        reloader = None
         trace = StringTracer()
         no_trace = NullTracer()
         pre_trace = PreTracer()
         eliza.set_tracer(no_trace)
-        print(eliza.get_greeting())
+        if args.quick:
+            type_out = print
+        else:
+            from elizateletype import type_out
+        type_out(eliza.get_greeting())
         #if not args.nobanner:
             #print("Enter a blank line to quit.\n")
         print("Enter a blank line to quit.\n")
@@ -111,13 +212,26 @@ def main():
                     eliza.set_tracer(pre_trace)
                     print("Tracing PRE enabled\n")
                     trace.clear()
+                elif command == "reload":
+                    if reloader is None:
+                        from elizareload import ScriptReloader
+                        reloader = ScriptReloader(eliza)
+                    filename = user_input.split()[1] if len(user_input.split()) > 1 else args.script_filename
+                    if filename:
+                        reloader.reload_file_async(filename).add_done_callback(report_reload)
+                    else:
+                        from DOCTOR_1966_01_CACM import CACM_1966_01_DOCTOR_script
+                        reloader.reload_async(CACM_1966_01_DOCTOR_script).add_done_callback(report_reload)
                 else:
                     print("Unknown command. Commands are:\n")
                     print_command_help()
                 continue
 
             response = eliza.response(user_input)
-            print(response)
+            type_out(response)
+
+        if reloader is not None:
+            reloader.close()
 
     except Exception as e:
         print("Exception:", e)